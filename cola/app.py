@@ -38,6 +38,7 @@ from . import compat
 from . import fsmonitor
 from . import git
 from . import gitcfg
+from . import gitcmds
 from . import icons
 from . import i18n
 from . import qtcompat
@@ -46,6 +47,10 @@ from . import resources
 from . import version
 
 
+#: Milliseconds to wait for more refresh requests before refreshing
+REFRESH_DELAY = 150
+
+
 def setup_environment():
     # Allow Ctrl-C to exit
     signal.signal(signal.SIGINT, signal.SIG_DFL)
@@ -161,6 +166,13 @@ class ColaApplication(object):
         else:
             self._app = QtCore.QCoreApplication(argv)
 
+        # Coalesce bursts of refresh requests, e.g. from the file monitor
+        self._refresh_timer = timer = QtCore.QTimer()
+        timer.setSingleShot(True)
+        timer.setInterval(REFRESH_DELAY)
+        timer.timeout.connect(self._flush_refresh)
+        main.model().scheduler.schedule = timer.start
+
     def _install_style(self):
         palette = self._app.palette()
         window = palette.color(QtGui.QPalette.Window)
@@ -249,9 +261,18 @@ class ColaApplication(object):
         if hasattr(self._app, 'context'):
             self._app.context = context
 
-    def _update_files(self):
+    def _update_files(self, paths=None):
         # Respond to file system updates
-        cmds.do(cmds.Refresh)
+        gitcmds.diff_cache().invalidate(paths)
+        if paths is None:
+            main.model().request_refresh(update_index=True)
+        else:
+            main.model().request_refresh_paths(paths)
+
+    def _flush_refresh(self):
+        refreshed = main.model().scheduler.flush()
+        if refreshed & main.REFRESH_FILES:
+            fsmonitor.current().refresh()
 
 
 @memoize
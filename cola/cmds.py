@@ -1,6 +1,5 @@
 from __future__ import division, absolute_import, unicode_literals
 import os
-import re
 import sys
 from fnmatch import fnmatch
 from io import StringIO
@@ -18,10 +17,10 @@ from . import gitcmds
 from . import icons
 from . import utils
 from . import resources
-from .diffparse import DiffParser
 from .git import STDOUT
 from .i18n import N_
 from .interaction import Interaction
+from .models import conflicts
 from .models import main
 from .models import prefs
 from .models import selection
@@ -129,6 +128,7 @@ class Command(ModelCommand):
         self.old_mode = self.model.mode
 
         self.new_diff_text = self.old_diff_text
+        self.new_diff_stream = None
         self.new_filename = self.old_filename
         self.new_mode = self.old_mode
 
@@ -136,7 +136,8 @@ class Command(ModelCommand):
         """Perform the operation."""
         self.model.set_filename(self.new_filename)
         self.model.set_mode(self.new_mode)
-        self.model.set_diff_text(self.new_diff_text)
+        self.model.set_diff_text(self.new_diff_text,
+                                 stream=self.new_diff_stream)
 
     def undo(self):
         """Undo the operation."""
@@ -215,7 +216,7 @@ class ApplyDiffSelection(Command):
         self.apply_to_worktree = apply_to_worktree
 
     def do(self):
-        parser = DiffParser(self.model.filename, self.model.diff_text)
+        parser = self.model.diff_parser()
         if self.has_selection:
             patch = parser.generate_patch(self.first_line_idx,
                                           self.last_line_idx,
@@ -239,7 +240,9 @@ class ApplyDiffSelection(Command):
             core.unlink(tmp_file)
 
         Interaction.log_status(status, out, err)
-        self.model.update_file_status(update_index=True)
+        # Only the state of the patched file can have changed
+        self.model.update_paths_status([self.model.filename],
+                                       update_index=True)
 
 
 class ApplyPatches(Command):
@@ -740,10 +743,23 @@ class Diff(Command):
             opts['ref'] = self.model.head
         self.new_filename = filename
         self.new_mode = self.model.mode_worktree
-        self.new_diff_text = gitcmds.diff_helper(filename=filename,
-                                                 cached=cached,
-                                                 deleted=deleted,
-                                                 **opts)
+        cache = gitcmds.diff_cache()
+        key = cache.key(filename, cached=cached, deleted=deleted,
+                        ref=opts.get('ref'))
+        diff_text = cache.get(key)
+        if diff_text is None:
+            # Large diffs are loaded a piece at a time, see LoadMoreDiff
+            stream = gitcmds.diff_stream(filename=filename,
+                                         cached=cached,
+                                         deleted=deleted,
+                                         **opts)
+            diff_text = stream.read(max_lines=prefs.max_diff_lines(),
+                                    max_size=prefs.max_diff_size())
+            if stream.exhausted:
+                cache.put(key, diff_text)
+            else:
+                self.new_diff_stream = stream
+        self.new_diff_text = diff_text
 
 
 class Diffstat(Command):
@@ -1028,6 +1044,17 @@ class LoadFixupMessage(LoadCommitMessageFromOID):
             self.new_commitmsg = self.new_commitmsg.splitlines()[0]
 
 
+class LoadMoreDiff(ModelCommand):
+    """Load the next piece of a diff that was too large to load at once"""
+
+    @staticmethod
+    def name():
+        return N_('Load More')
+
+    def do(self):
+        self.model.load_more_diff()
+
+
 class Merge(Command):
     """Merge commits"""
 
@@ -1556,26 +1583,17 @@ def check_conflicts(unmerged):
 
     """
     if prefs.check_conflicts():
-        unmerged = [path for path in unmerged if is_conflict_free(path)]
+        scan = conflicts.conflict_scanner().scan(unmerged)
+        unmerged = [path for path in unmerged
+                    if not scan[path] or should_stage_conflicts(path)]
     return unmerged
 
 
 def is_conflict_free(path):
     """Return True if `path` contains no conflict markers
     """
-    rgx = re.compile(r'^(<<<<<<<|\|\|\|\|\|\|\||>>>>>>>) ')
-    try:
-        with core.xopen(path, 'r') as f:
-            for line in f:
-                line = core.decode(line, errors='ignore')
-                if rgx.match(line):
-                    if should_stage_conflicts(path):
-                        return True
-                    else:
-                        return False
-    except IOError:
-        # We can't read this file ~ we may be staging a removal
-        pass
+    if conflicts.conflict_scanner().has_conflicts(path):
+        return should_stage_conflicts(path)
     return True
 
 
@@ -1614,7 +1632,8 @@ class Stage(Command):
         # so there's no harm in ignoring updates from other threads
         # (e.g. the file system change monitor).
         with CommandDisabled(UpdateFileStatus):
-            self.model.stage_paths(self.paths)
+            status, out, err = self.model.stage_paths(self.paths)
+        Interaction.log_status(status, out, err)
 
 
 class StageCarefully(Stage):
@@ -1756,7 +1775,8 @@ class Unstage(Command):
         msg = N_('Unstaging: %s') % (', '.join(self.paths))
         Interaction.log(msg)
         with CommandDisabled(UpdateFileStatus):
-            self.model.unstage_paths(self.paths)
+            status, out, err = self.model.unstage_paths(self.paths)
+        Interaction.log_status(status, out, err)
 
 
 class UnstageAll(Command):
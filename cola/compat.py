@@ -7,6 +7,12 @@ except ImportError:
     # Python 3
     from urllib import parse
 
+try:
+    import Queue as queue
+except ImportError:
+    # Python 3
+    import queue
+
 try:
     # Python 2.7+
     from collections import OrderedDict as odict
@@ -117,6 +117,62 @@ def readline(fh, encoding=None):
     return decode(fh.readline(), encoding=encoding)
 
 
+@interruptable
+def _read_chunk(fh, size):
+    # read1() returns the data that is available instead of waiting
+    # until `size` bytes have arrived
+    read = getattr(fh, 'read1', fh.read)
+    return read(size)
+
+
+def read_nul_records(fh, encoding=None, size=65536):
+    """Yield NUL-terminated records from a filehandle as they arrive
+
+    Records are decoded individually so that large outputs, e.g. from
+    "git status -z", can be consumed without buffering everything first.
+
+    """
+    nul = b'\0'
+    pending = b''
+    while True:
+        chunk = _read_chunk(fh, size)
+        if not chunk:
+            break
+        records = (pending + chunk).split(nul)
+        pending = records.pop()
+        for record in records:
+            yield decode(record, encoding=encoding)
+    if pending:
+        yield decode(pending, encoding=encoding)
+
+
+def read_lines(fh, encoding=None, size=65536):
+    """Yield lines from a filehandle as they arrive
+
+    The complete lines of each chunk are decoded together and split using
+    the same rules as str.splitlines(), so large outputs, e.g. from
+    "git diff", are decoded incrementally rather than all at once.
+
+    """
+    newline = b'\n'
+    pending = b''
+    while True:
+        chunk = _read_chunk(fh, size)
+        if not chunk:
+            break
+        data = pending + chunk
+        end = data.rfind(newline) + 1
+        if not end:
+            pending = data
+            continue
+        pending = data[end:]
+        for line in decode(data[:end], encoding=encoding).splitlines():
+            yield line
+    if pending:
+        for line in decode(pending, encoding=encoding).splitlines():
+            yield line
+
+
 @interruptable
 def start_command(cmd, cwd=None, add_env=None,
                   universal_newlines=False,
@@ -192,8 +248,8 @@ def prep_for_subprocess(cmd, shell=False):
 
 
 @interruptable
-def communicate(proc):
-    return proc.communicate()
+def communicate(proc, data=None):
+    return proc.communicate(data)
 
 
 def run_command(cmd, encoding=None, *args, **kwargs):
@@ -201,11 +257,16 @@ def run_command(cmd, encoding=None, *args, **kwargs):
 
     This provides a simpler interface to the subprocess module.
     The results are formatted as a 3-tuple: (exit_code, output, errors)
+    The optional "input" string is written to the command's stdin.
     The other arguments are passed on to start_command().
 
     """
+    data = kwargs.pop('input', None)
+    if data is not None:
+        kwargs['stdin'] = subprocess.PIPE
+        data = encode(data, encoding=encoding)
     process = start_command(cmd, *args, **kwargs)
-    (output, errors) = communicate(process)
+    (output, errors) = communicate(process, data)
     output = decode(output, encoding=encoding)
     errors = decode(errors, encoding=encoding)
     exit_code = process.returncode
@@ -1,6 +1,8 @@
 from __future__ import division, absolute_import, unicode_literals
+import bisect
 import math
 import re
+from array import array
 from collections import defaultdict
 
 from . import compat
@@ -91,10 +93,15 @@ class Counter(object):
         return self
 
     def parse(self, range_str):
-        """Parse a diff range and setup internal state"""
+        """Parse a diff range and setup internal state
+
+        Returns the start of the range.
+
+        """
         start, count = _parse_range_str(range_str)
         self.value = start
         self.max_value = max(start + count, self.max_value)
+        return start
 
     def tick(self, amount=1):
         """Return the current value and increment to the next"""
@@ -103,15 +110,300 @@ class Counter(object):
         return value
 
 
+class DiffLineTable(object):
+    """The line numbers of a diff, stored in compact arrays
+
+    Lines are classified up front into one small code per line.  The line
+    numbers are computed lazily, a chunk at a time, when an entry in the
+    chunk is first accessed.  The counter values at the start of a chunk
+    are derived by counting line classes since the preceding hunk header,
+    so painting any screenful of a huge diff only computes one chunk.
+
+    Each entry reads as an (old, new) tuple, or (ours, theirs, new) for
+    combined diffs, so the table can be used in place of a list of tuples.
+
+    """
+
+    #: The number of entries whose numbers are computed at once
+    CHUNK = 1024
+
+    def __init__(self):
+        self.kinds = array('b')
+        self.hunks = {}
+        self.hunk_starts = []
+        self.skips = {}
+        self.skip_starts = []
+        self.merge_start = None
+        self._chunks = {}
+        self._marks = {}
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __iter__(self):
+        for idx in range(len(self.kinds)):
+            yield self[idx]
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __getitem__(self, idx):
+        size = len(self.kinds)
+        if idx < 0:
+            idx += size
+        if idx < 0 or idx >= size:
+            raise IndexError(idx)
+        chunk, offset = divmod(idx, self.CHUNK)
+        columns = self._chunks.get(chunk)
+        if columns is None or offset >= len(columns[0]):
+            columns = self._chunks[chunk] = self._compute(chunk)
+        kind = self.kinds[idx]
+        if kind == _HUNK:
+            return (DiffLines.DASH,) * len(self.hunks[idx])
+        a, b, c = columns
+        if self.merge_start is not None and idx >= self.merge_start:
+            return (a[offset], b[offset], c[offset])
+        return (a[offset], b[offset])
+
+    def add_hunk(self, starts):
+        """Add a hunk header entry with the given counter starts"""
+        idx = len(self.kinds)
+        self.hunks[idx] = starts
+        self.hunk_starts.append(idx)
+        self.kinds.append(_HUNK)
+
+    def add_skip(self):
+        """Advance the counters before the next entry"""
+        idx = len(self.kinds)
+        if idx in self.skips:
+            self.skips[idx] += 1
+        else:
+            self.skips[idx] = 1
+            self.skip_starts.append(idx)
+
+    def _compute(self, chunk):
+        """Return the (a, b, c) number columns for a chunk"""
+        start = chunk * self.CHUNK
+        end = min(len(self.kinds), start + self.CHUNK)
+        old, new, ours, theirs = self._values_at(start)
+        EMPTY = DiffLines.EMPTY
+        DASH = DiffLines.DASH
+        kinds = self.kinds
+        hunks = self.hunks
+        skips = self.skips
+        a = array('i')
+        b = array('i')
+        c = array('i')
+
+        for idx in range(start, end):
+            if idx in skips:
+                count = skips[idx]
+                old += count
+                new += count
+                ours += count
+                theirs += count
+            kind = kinds[idx]
+            if kind == _EMPTY:
+                a.append(EMPTY)
+                b.append(EMPTY)
+                c.append(EMPTY)
+            elif kind == _HUNK:
+                starts = hunks[idx]
+                if len(starts) == 2:
+                    old, new = starts
+                else:
+                    ours, theirs, new = starts
+                a.append(DASH)
+                b.append(DASH)
+                c.append(DASH)
+            elif kind == _OLD:
+                a.append(old)
+                b.append(EMPTY)
+                c.append(EMPTY)
+                old += 1
+            elif kind == _NEW:
+                a.append(EMPTY)
+                b.append(new)
+                c.append(EMPTY)
+                new += 1
+            elif kind == _BOTH:
+                a.append(old)
+                b.append(new)
+                c.append(EMPTY)
+                old += 1
+                new += 1
+            elif kind == _M_THEIRS:
+                a.append(EMPTY)
+                b.append(theirs)
+                c.append(EMPTY)
+                theirs += 1
+            elif kind == _M_OURS_THEIRS:
+                a.append(ours)
+                b.append(theirs)
+                c.append(EMPTY)
+                ours += 1
+                theirs += 1
+            elif kind == _M_NEW:
+                a.append(EMPTY)
+                b.append(EMPTY)
+                c.append(new)
+                new += 1
+            elif kind == _M_THEIRS_NEW:
+                a.append(EMPTY)
+                b.append(theirs)
+                c.append(new)
+                theirs += 1
+                new += 1
+            elif kind == _M_OURS_NEW:
+                a.append(ours)
+                b.append(EMPTY)
+                c.append(new)
+                ours += 1
+                new += 1
+            else:  # _M_ALL
+                a.append(ours)
+                b.append(theirs)
+                c.append(new)
+                ours += 1
+                theirs += 1
+                new += 1
+
+        return (a, b, c)
+
+    def _values_at(self, start):
+        """Return the (old, new, ours, theirs) counter values at start
+
+        The counters are reset by the nearest preceding hunk header, so
+        the values are its starts plus the number of lines of each class
+        and the number of skipped lines seen since then.  The values at
+        the start of each chunk are remembered so that long hunks are
+        counted from the previous chunk rather than from their header.
+
+        """
+        values = self._marks.get(start)
+        if values is not None:
+            return values
+
+        pos = bisect.bisect_left(self.hunk_starts, start) - 1
+        hunk = self.hunk_starts[pos] if pos >= 0 else -1
+        prev = start - self.CHUNK
+        if prev > hunk and prev in self._marks:
+            old, new, ours, theirs = self._marks[prev]
+            begin = prev
+        elif hunk < 0:
+            old = new = ours = theirs = 0
+            begin = 0
+        else:
+            starts = self.hunks[hunk]
+            if len(starts) == 2:
+                old, new = starts
+                ours = theirs = 0
+            else:
+                ours, theirs, new = starts
+                old = 0
+            begin = hunk + 1
+
+        codes = _tobytes(self.kinds[begin:start])
+        counts = dict((kind, codes.count(_CODE_BYTES[kind]))
+                      for kind in _COUNTED_KINDS)
+        old += counts[_OLD] + counts[_BOTH]
+        new += (counts[_NEW] + counts[_BOTH] + counts[_M_NEW] +
+                counts[_M_THEIRS_NEW] + counts[_M_OURS_NEW] + counts[_M_ALL])
+        ours += (counts[_M_OURS_THEIRS] + counts[_M_OURS_NEW] +
+                 counts[_M_ALL])
+        theirs += (counts[_M_THEIRS] + counts[_M_OURS_THEIRS] +
+                   counts[_M_THEIRS_NEW] + counts[_M_ALL])
+
+        skip_starts = self.skip_starts
+        lo = bisect.bisect_left(skip_starts, begin)
+        hi = bisect.bisect_left(skip_starts, start)
+        skipped = sum(self.skips[idx] for idx in skip_starts[lo:hi])
+
+        values = (old + skipped, new + skipped,
+                  ours + skipped, theirs + skipped)
+        self._marks[start] = values
+        return values
+
+
+# Line classes used by DiffLineTable
+_EMPTY = 0
+_HUNK = 1
+_OLD = 2
+_NEW = 3
+_BOTH = 4
+_M_THEIRS = 5
+_M_OURS_THEIRS = 6
+_M_NEW = 7
+_M_THEIRS_NEW = 8
+_M_OURS_NEW = 9
+_M_ALL = 10
+
+_DIFF_KINDS = {
+    '-': _OLD,
+    '+': _NEW,
+    ' ': _BOTH,
+}
+
+#: Maps the first character of a line to its class in a regular diff.
+#: Lines that need a closer look, e.g. hunk headers, map to _SPECIAL.
+_SPECIAL = 127
+_DIFF_TABLE = bytearray([_SPECIAL] * 256)
+_DIFF_TABLE[ord('-')] = _OLD
+_DIFF_TABLE[ord('+')] = _NEW
+_DIFF_TABLE[ord(' ')] = _BOTH
+_DIFF_TABLE = bytes(_DIFF_TABLE)
+
+
+#: The byte values of the line classes counted by DiffLineTable
+_COUNTED_KINDS = (_OLD, _NEW, _BOTH, _M_THEIRS, _M_OURS_THEIRS, _M_NEW,
+                  _M_THEIRS_NEW, _M_OURS_NEW, _M_ALL)
+_CODE_BYTES = dict((kind, bytes(bytearray([kind])))
+                   for kind in _COUNTED_KINDS)
+
+
+def _tobytes(kinds):
+    """Return the contents of an array('b') as bytes"""
+    if compat.PY3:
+        return kinds.tobytes()
+    return kinds.tostring()
+
+
+def _extend(kinds, data):
+    """Append the bytes in data to an array('b')"""
+    if compat.PY3:
+        kinds.frombytes(data)
+    else:
+        kinds.fromstring(data)
+
+
+_MERGE_KINDS = {
+    '- ': _M_THEIRS,
+    ' -': _M_THEIRS,
+    '--': _M_OURS_THEIRS,
+    '++': _M_NEW,
+    '+ ': _M_THEIRS_NEW,
+    ' +': _M_OURS_NEW,
+    '  ': _M_ALL,
+}
+
+
 class DiffLines(object):
     """Parse diffs and gather line numbers"""
 
     EMPTY = -1
     DASH = -2
 
+    INITIAL_STATE = 0
+    DIFF_STATE = 1
+
     def __init__(self):
         self.valid = True
         self.merge = False
+        self.lines = DiffLineTable()
+        self._state = self.INITIAL_STATE
 
         # diff <old> <new>
         # merge <ours> <theirs> <new>
@@ -125,75 +417,167 @@ class DiffLines(object):
                           self.ours.max_value, self.theirs.max_value))
 
     def parse(self, diff_text):
-        lines = []
-        INITIAL_STATE = 0
-        DIFF_STATE = 1
-        state = INITIAL_STATE
-        merge = self.merge = False
+        """Return a DiffLineTable with the line numbers of diff_text"""
+        self.reset()
+        return self.parse_more(diff_text)
+
+    def parse_more(self, diff_text):
+        """Add the lines of text that continues the last parse
+
+        Returns the same DiffLineTable as the previous parse().
+
+        """
+        self.classify(diff_text.splitlines())
+        return self.lines
+
+    def reset(self):
+        """Forget the state of the previous parse"""
+        self._state = self.INITIAL_STATE
+        self.merge = False
+        self.lines = DiffLineTable()
+        self.old.reset()
+        self.new.reset()
+        self.ours.reset()
+        self.theirs.reset()
+
+    def iter_lines(self, texts):
+        """Yield the line numbers for each line of a diff
+
+        The parser state is kept between calls so that a diff can be
+        processed a piece at a time as it is read.
+
+        """
+        lines = self.lines
+        start = len(lines)
+        self.classify(texts)
+        for idx in range(start, len(lines)):
+            yield lines[idx]
+
+    def classify(self, texts):
+        """Append the line classes of texts to the line table
+
+        Only hunk headers are parsed here.  The line numbers themselves
+        are computed on demand by the DiffLineTable.
+
+        """
+        if not self.merge:
+            texts = list(texts)
+            texts = texts[self._classify_bulk(texts):]
+
+        INITIAL_STATE = self.INITIAL_STATE
+        DIFF_STATE = self.DIFF_STATE
         NO_NEWLINE = '\\ No newline at end of file'
+        state = self._state
+        merge = self.merge
+        table = self.lines
+        kinds = table.kinds
+        append = kinds.append
+        diff_kinds = _DIFF_KINDS
+        merge_kinds = _MERGE_KINDS
+
+        for text in texts:
+            if text[:1] == '@':
+                if text.startswith('@@ -'):
+                    parts = text.split(' ', 4)
+                    if parts[0] == '@@' and parts[3] == '@@':
+                        state = DIFF_STATE
+                        table.add_hunk((
+                            self.old.parse(parts[1][1:]),
+                            self.new.parse(parts[2][1:])))
+                        continue
+                if text.startswith('@@@ -'):
+                    if not merge:
+                        self.merge = merge = True
+                        table.merge_start = len(kinds)
+                    parts = text.split(' ', 5)
+                    if parts[0] == '@@@' and parts[4] == '@@@':
+                        state = DIFF_STATE
+                        table.add_hunk((
+                            self.ours.parse(parts[1][1:]),
+                            self.theirs.parse(parts[2][1:]),
+                            self.new.parse(parts[3][1:])))
+                        continue
+            if state == INITIAL_STATE or text == NO_NEWLINE:
+                append(_EMPTY)
+                continue
+            if merge:
+                kind = merge_kinds.get(text[:2])
+            else:
+                kind = diff_kinds.get(text[:1])
+            if kind is not None:
+                append(kind)
+            elif not text:
+                # Blank lines advance the counters without an entry
+                table.add_skip()
+            else:
+                state = INITIAL_STATE
+                append(_EMPTY)
+
+        self._state = state
+
+    def _classify_bulk(self, texts):
+        """Classify the lines of a regular diff in bulk
 
-        old = self.old.reset()
-        new = self.new.reset()
-        ours = self.ours.reset()
-        theirs = self.theirs.reset()
+        The first character of every line is translated to its class in
+        one pass, and only the lines that need a closer look, e.g. hunk
+        headers and blank lines, are examined individually.  Returns the
+        index of the first line that was not classified, which is where
+        a combined diff begins.
 
-        for text in diff_text.splitlines():
+        """
+        INITIAL_STATE = self.INITIAL_STATE
+        DIFF_STATE = self.DIFF_STATE
+        NO_NEWLINE = '\\ No newline at end of file'
+        state = self._state
+        table = self.lines
+        kinds = table.kinds
+        special = _SPECIAL
+        empty_byte = bytes(bytearray([_EMPTY]))
+
+        firsts = ''.join([text[:1] or '\n' for text in texts])
+        codes = firsts.encode('latin-1', 'replace').translate(_DIFF_TABLE)
+        special_byte = bytes(bytearray([special]))
+        size = len(codes)
+        pos = 0
+
+        while pos < size:
+            end = codes.find(special_byte, pos)
+            if end < 0:
+                end = size
+            if end > pos:
+                if state == DIFF_STATE:
+                    _extend(kinds, codes[pos:end])
+                else:
+                    _extend(kinds, empty_byte * (end - pos))
+                pos = end
+                if pos == size:
+                    break
+
+            text = texts[pos]
+            pos += 1
             if text.startswith('@@ -'):
                 parts = text.split(' ', 4)
                 if parts[0] == '@@' and parts[3] == '@@':
                     state = DIFF_STATE
-                    old.parse(parts[1][1:])
-                    new.parse(parts[2][1:])
-                    lines.append((self.DASH, self.DASH))
+                    table.add_hunk((
+                        self.old.parse(parts[1][1:]),
+                        self.new.parse(parts[2][1:])))
                     continue
             if text.startswith('@@@ -'):
-                self.merge = merge = True
-                parts = text.split(' ', 5)
-                if parts[0] == '@@@' and parts[4] == '@@@':
-                    state = DIFF_STATE
-                    ours.parse(parts[1][1:])
-                    theirs.parse(parts[2][1:])
-                    new.parse(parts[3][1:])
-                    lines.append((self.DASH, self.DASH, self.DASH))
-                    continue
+                # Combined diffs are classified line by line
+                pos -= 1
+                break
             if state == INITIAL_STATE or text == NO_NEWLINE:
-                if merge:
-                    lines.append((self.EMPTY, self.EMPTY, self.EMPTY))
-                else:
-                    lines.append((self.EMPTY, self.EMPTY))
-            elif not merge and text.startswith('-'):
-                lines.append((old.tick(), self.EMPTY))
-            elif merge and text.startswith('- '):
-                lines.append((self.EMPTY, theirs.tick(), self.EMPTY))
-            elif merge and text.startswith(' -'):
-                lines.append((self.EMPTY, theirs.tick(), self.EMPTY))
-            elif merge and text.startswith('--'):
-                lines.append((ours.tick(), theirs.tick(), self.EMPTY))
-            elif not merge and text.startswith('+'):
-                lines.append((self.EMPTY, new.tick()))
-            elif merge and text.startswith('++'):
-                lines.append((self.EMPTY, self.EMPTY, new.tick()))
-            elif merge and text.startswith('+ '):
-                lines.append((self.EMPTY, theirs.tick(), new.tick()))
-            elif merge and text.startswith(' +'):
-                lines.append((ours.tick(), self.EMPTY, new.tick()))
-            elif not merge and text.startswith(' '):
-                lines.append((old.tick(), new.tick()))
-            elif merge and text.startswith('  '):
-                lines.append((ours.tick(), theirs.tick(), new.tick()))
+                kinds.append(_EMPTY)
             elif not text:
-                new.tick()
-                old.tick()
-                ours.tick()
-                theirs.tick()
+                # Blank lines advance the counters without an entry
+                table.add_skip()
             else:
                 state = INITIAL_STATE
-                if merge:
-                    lines.append((self.EMPTY, self.EMPTY, self.EMPTY))
-                else:
-                    lines.append((self.EMPTY, self.EMPTY))
+                kinds.append(_EMPTY)
 
-        return lines
+        self._state = state
+        return pos
 
 
 class FormatDigits(object):
@@ -238,6 +622,116 @@ class FormatDigits(object):
         return result
 
 
+class HighlightStates(object):
+    """Classify the lines of a diff for syntax highlighting
+
+    This is the state machine of the diff syntax highlighter.  It runs
+    over the text in one pass and records the state and format of every
+    line, so that any line can be formatted without visiting the lines
+    before it.
+
+    """
+
+    INITIAL_STATE = -1
+    DEFAULT_STATE = 0
+    DIFFSTAT_STATE = 1
+    DIFF_FILE_HEADER_STATE = 2
+    DIFF_STATE = 3
+    SUBMODULE_STATE = 4
+
+    # Line formats
+    PLAIN = 0
+    HEADER = 1
+    BOLD_HEADER = 2
+    DIFFSTAT = 3
+    ADDITION = 4
+    REMOVAL = 5
+
+    DIFF_FILE_HEADER_START_RGX = re.compile(r'diff --git a/.* b/.*')
+    DIFF_HUNK_HEADER_RGX = re.compile(r'(?:@@ -[0-9,]+ \+[0-9,]+ @@)|'
+                                      r'(?:@@@ (?:-[0-9,]+ ){2}\+[0-9,]+ @@@)')
+
+    def __init__(self, is_commit=False):
+        self.is_commit = is_commit
+        self.states = array('b')
+        self.formats = array('b')
+
+    def __len__(self):
+        return len(self.states)
+
+    def reset(self):
+        """Forget all lines"""
+        self.truncate(0)
+
+    def truncate(self, size):
+        """Forget the lines after the first `size` lines"""
+        del self.states[size:]
+        del self.formats[size:]
+
+    def extend(self, lines):
+        """Classify lines that continue the text"""
+        if self.states:
+            state = self.states[-1]
+        else:
+            state = self.INITIAL_STATE
+        classify = self.classify
+        states = []
+        formats = []
+        for text in lines:
+            state, fmt = classify(text, state)
+            states.append(state)
+            formats.append(fmt)
+        self.states.extend(states)
+        self.formats.extend(formats)
+
+    def classify(self, text, state):
+        """Return the (state, format) of a line given the previous state"""
+        if not text:
+            return self.INITIAL_STATE, self.PLAIN
+
+        if state == self.INITIAL_STATE:
+            if text.startswith('Submodule '):
+                state = self.SUBMODULE_STATE
+            elif text.startswith('diff --git '):
+                state = self.DIFFSTAT_STATE
+            elif self.is_commit:
+                state = self.DEFAULT_STATE
+            else:
+                state = self.DIFFSTAT_STATE
+
+        fmt = self.PLAIN
+        if state == self.DIFFSTAT_STATE:
+            if self.DIFF_FILE_HEADER_START_RGX.match(text):
+                state = self.DIFF_FILE_HEADER_STATE
+                fmt = self.HEADER
+            elif self.DIFF_HUNK_HEADER_RGX.match(text):
+                state = self.DIFF_STATE
+                fmt = self.BOLD_HEADER
+            elif '|' in text:
+                fmt = self.DIFFSTAT
+            else:
+                fmt = self.HEADER
+        elif state == self.DIFF_FILE_HEADER_STATE:
+            if self.DIFF_HUNK_HEADER_RGX.match(text):
+                state = self.DIFF_STATE
+                fmt = self.BOLD_HEADER
+            else:
+                fmt = self.HEADER
+        elif state == self.DIFF_STATE:
+            first = text[:1]
+            if first == '-':
+                fmt = self.REMOVAL
+            elif first == '+':
+                fmt = self.ADDITION
+            elif first == 'd' and self.DIFF_FILE_HEADER_START_RGX.match(text):
+                state = self.DIFF_FILE_HEADER_STATE
+                fmt = self.HEADER
+            elif first == '@' and self.DIFF_HUNK_HEADER_RGX.match(text):
+                fmt = self.BOLD_HEADER
+
+        return state, fmt
+
+
 class DiffParser(object):
     """Parse and rewrite diffs to produce edited patches
 
@@ -249,6 +743,22 @@ class DiffParser(object):
     def __init__(self, filename, diff_text):
         self.filename = filename
         self.hunks = _parse_diff(diff_text)
+        # The sorted line offsets of the hunks, for binary searches
+        self.first_lines = [hunk.first_line_idx for hunk in self.hunks]
+        self.last_lines = [hunk.last_line_idx for hunk in self.hunks]
+
+    def hunks_between(self, first_line_idx, last_line_idx):
+        """Return the hunks that overlap a range of diff lines"""
+        begin = bisect.bisect_left(self.last_lines, first_line_idx)
+        end = bisect.bisect_right(self.first_lines, last_line_idx)
+        return self.hunks[begin:end]
+
+    def hunk_for_line(self, line_idx):
+        """Return the hunk containing a line, or the last hunk"""
+        if not self.hunks:
+            return None
+        idx = bisect.bisect_left(self.last_lines, line_idx)
+        return self.hunks[min(idx, len(self.hunks) - 1)]
 
     def generate_patch(self, first_line_idx, last_line_idx,
                        reverse=False):
@@ -263,16 +773,8 @@ class DiffParser(object):
 
         start_offset = 0
 
-        for hunk in self.hunks:
-            # skip hunks until we get to the one that contains the first
-            # selected line
-            if hunk.last_line_idx < first_line_idx:
-                continue
-            # once we have processed the hunk that contains the last selected
-            # line, we can stop
-            if hunk.first_line_idx > last_line_idx:
-                break
-
+        # Hunks outside of the selection contribute nothing to the patch
+        for hunk in self.hunks_between(first_line_idx, last_line_idx):
             prev_skipped = False
             counts = defaultdict(int)
             filtered_lines = []
@@ -339,10 +841,8 @@ class DiffParser(object):
 
     def generate_hunk_patch(self, line_idx, reverse=False):
         """Return a patch containing the hunk for the specified line only"""
-        if not self.hunks:
+        hunk = self.hunk_for_line(line_idx)
+        if hunk is None:
             return None
-        for hunk in self.hunks:
-            if line_idx <= hunk.last_line_idx:
-                break
         return self.generate_patch(hunk.first_line_idx, hunk.last_line_idx,
                                    reverse=reverse)
@@ -48,7 +48,9 @@ from .interaction import Interaction
 
 class _Monitor(QtCore.QObject):
 
-    files_changed = Signal()
+    #: Emitted with the set of changed worktree-relative paths, or None
+    #: when the changes cannot be narrowed down to specific paths.
+    files_changed = Signal(object)
 
     def __init__(self, thread_class):
         QtCore.QObject.__init__(self)
@@ -79,6 +81,10 @@ class _BaseThread(QtCore.QThread):
     #: modifications into a single signal.
     _NOTIFICATION_DELAY = 888
 
+    #: Whether the collected paths can be passed on to observers.
+    #: Threads that case-fold paths cannot report them as pathspecs.
+    _report_paths = True
+
     def __init__(self, monitor):
         QtCore.QThread.__init__(self)
         self._monitor = monitor
@@ -86,6 +92,7 @@ class _BaseThread(QtCore.QThread):
         self._use_check_ignore = version.check_git('check-ignore')
         self._force_notify = False
         self._file_paths = set()
+        self._worktree = None
 
     @property
     def _pending(self):
@@ -98,6 +105,7 @@ class _BaseThread(QtCore.QThread):
     def notify(self):
         """Notifies all observers"""
         do_notify = False
+        paths = None
         if self._force_notify:
             do_notify = True
         elif self._file_paths:
@@ -116,12 +124,29 @@ class _BaseThread(QtCore.QThread):
                 # except for <pathname>.  So to see if we have any non-ignored
                 # files, we simply check every fourth field to see if any of
                 # them are empty.
-                source_fields = out.split(bchr(0))[0:-1:4]
-                do_notify = not all(source_fields)
+                fields = out.split(bchr(0))
+                paths = set(core.decode(fields[idx + 3])
+                            for idx in range(0, len(fields) - 3, 4)
+                            if not fields[idx])
+                do_notify = bool(paths)
+                paths = self._relative_paths(paths)
         self._force_notify = False
         self._file_paths = set()
         if do_notify:
-            self._monitor.files_changed.emit()
+            self._monitor.files_changed.emit(paths)
+
+    def _relative_paths(self, paths):
+        """Return worktree-relative paths, or None if they are unusable"""
+        if not self._report_paths or not self._worktree:
+            return None
+        prefix = self._worktree.rstrip('/') + '/'
+        size = len(prefix)
+        relative = set()
+        for path in paths:
+            if not path.startswith(prefix):
+                return None
+            relative.add(path[size:])
+        return relative
 
     @staticmethod
     def _log_enabled_message():
@@ -298,6 +323,8 @@ if AVAILABLE == 'inotify':
             elif mask & inotify.IN_ISDIR:
                 pass
             elif wd in self._worktree_wd_to_path_map:
+                if name and core.decode(name) == '.gitattributes':
+                    gitcfg.current().invalidate()
                 if self._use_check_ignore and name:
                     path = os.path.join(self._worktree_wd_to_path_map[wd],
                                         core.decode(name))
@@ -308,6 +335,9 @@ if AVAILABLE == 'inotify':
                 name = core.decode(name)
                 if name == 'HEAD' or name == 'index':
                     self._force_notify = True
+                if name == 'HEAD' or name == 'config':
+                    # includeIf.onbranch: depends on HEAD
+                    gitcfg.current().invalidate()
             elif (wd in self._git_dir_wd_to_path_map
                     and not core.decode(name).endswith('.lock')):
                 self._force_notify = True
@@ -379,6 +409,9 @@ if AVAILABLE == 'pywin32':
                 win32file.CloseHandle(self.event)
 
     class _Win32Thread(_BaseThread):
+        # Paths are case-folded by _transform_path()
+        _report_paths = False
+
         _FLAGS = (win32con.FILE_NOTIFY_CHANGE_FILE_NAME |
                   win32con.FILE_NOTIFY_CHANGE_DIR_NAME |
                   win32con.FILE_NOTIFY_CHANGE_ATTRIBUTES |
@@ -460,6 +493,8 @@ if AVAILABLE == 'pywin32':
                     if self._force_notify:
                         continue
                     path = self._worktree + '/' + self._transform_path(path)
+                    if os.path.basename(path) == '.gitattributes':
+                        gitcfg.current().invalidate()
                     if (path != self._git_dir
                         and not path.startswith(self._git_dir + '/')
                         and not os.path.isdir(path)
@@ -476,6 +511,9 @@ if AVAILABLE == 'pywin32':
                 path = self._transform_path(path)
                 if path.endswith('.lock'):
                     continue
+                if path == 'config' or path == 'head':
+                    # includeIf.onbranch: depends on HEAD
+                    gitcfg.current().invalidate()
                 if (path == 'head'
                     or path == 'index'
                     or path.startswith('refs/')
@@ -1,11 +1,13 @@
 from __future__ import division, absolute_import, unicode_literals
 
+import contextlib
 import functools
 import errno
 import os
 import sys
 import subprocess
 import threading
+import time
 from os.path import join
 
 from . import core
@@ -16,17 +18,196 @@ from .decorators import memoize
 from .interaction import Interaction
 
 
-INDEX_LOCK = threading.Lock()
 GIT_COLA_TRACE = core.getenv('GIT_COLA_TRACE', '')
+#: Seconds of inactivity after which "git cat-file --batch" is shut down
+CAT_FILE_IDLE_TIMEOUT = 30.0
 STATUS = 0
 STDOUT = 1
 STDERR = 2
 
 
+#: Git commands that never write to .git/index
+READONLY_COMMANDS = frozenset((
+    'archive',
+    'blame',
+    'cat-file',
+    'check-attr',
+    'check-ignore',
+    'check-mailmap',
+    'cherry',
+    'count-objects',
+    'describe',
+    'diff-files',
+    'diff-index',
+    'diff-tree',
+    'for-each-ref',
+    'format-patch',
+    'grep',
+    'help',
+    'log',
+    'ls-files',
+    'ls-remote',
+    'ls-tree',
+    'merge-base',
+    'name-rev',
+    'rev-list',
+    'rev-parse',
+    'shortlog',
+    'show',
+    'show-ref',
+    'var',
+    'verify-commit',
+    'verify-tag',
+    'version',
+    'whatchanged',
+))
+
+#: Git commands that are read-only when any of these arguments are present
+READONLY_ARGUMENTS = {
+    'config': frozenset(('--get', '--get-all', '--get-regexp',
+                         '--get-urlmatch', '--list', '-l')),
+    'remote': frozenset(('-v', '--verbose', 'get-url', 'show')),
+    'stash': frozenset(('list', 'show')),
+}
+
+#: Git commands that are read-only when given no arguments
+READONLY_WITHOUT_ARGUMENTS = frozenset(('remote',))
+
+#: Git commands that only write to .git/index opportunistically to save
+#: refreshed stat data.  They are read-only when GIT_OPTIONAL_LOCKS=0.
+OPTIONAL_LOCK_COMMANDS = frozenset(('diff', 'status'))
+
+
+class ReadWriteLock(object):
+    """A reader/writer lock that prefers writers
+
+    Any number of readers can hold the lock at the same time while
+    writers get exclusive access.  Pending writers block new readers
+    so that a steady stream of readers cannot starve them.
+
+    Using the lock as a context manager acquires the exclusive side.
+
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    def acquire_read(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+
+    def release_write(self):
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+    # Lock-compatible API for exclusive access
+    acquire = acquire_write
+    release = release_write
+
+    def __enter__(self):
+        self.acquire_write()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release_write()
+
+    @contextlib.contextmanager
+    def reading(self):
+        self.acquire_read()
+        try:
+            yield self
+        finally:
+            self.release_read()
+
+    @contextlib.contextmanager
+    def writing(self):
+        self.acquire_write()
+        try:
+            yield self
+        finally:
+            self.release_write()
+
+
+#: Guards against thread-unsafe .git/index.lock files.  Commands that modify
+#: the index take the exclusive side; read-only commands run concurrently.
+INDEX_LOCK = ReadWriteLock()
+
+
 def dashify(s):
     return s.replace('_', '-')
 
 
+def git_subcommand(command):
+    """Return (subcommand, args) for a "git" command line
+
+    (None, []) is returned for commands other than "git".
+
+    """
+    if not command or os.path.basename(command[0]) not in ('git', 'git.exe'):
+        return (None, [])
+    idx = 1
+    count = len(command)
+    while idx < count:
+        arg = command[idx]
+        if arg in ('-c', '-C'):
+            idx += 2
+        elif arg.startswith('-'):
+            idx += 1
+        else:
+            return (arg, command[idx+1:])
+    return (None, [])
+
+
+@memoize
+def optional_locks_supported():
+    """Does the installed Git honor GIT_OPTIONAL_LOCKS?"""
+    from . import version  # version.py imports this module
+    return version.check_git('optional-locks')
+
+
+def is_readonly(command):
+    """Is the command line safe to run while other readers are running?
+
+    Non-git commands and git commands that may write to .git/index
+    return False so that they are serialized against each other.
+
+    """
+    subcommand, args = git_subcommand(command)
+    if subcommand is None:
+        return False
+    if subcommand in READONLY_COMMANDS:
+        return True
+    if subcommand in READONLY_ARGUMENTS:
+        readonly_args = READONLY_ARGUMENTS[subcommand]
+        if any(arg in readonly_args for arg in args):
+            return True
+    if subcommand in READONLY_WITHOUT_ARGUMENTS and not args:
+        return True
+    if subcommand in OPTIONAL_LOCK_COMMANDS:
+        return optional_locks_supported()
+    return False
+
+
 def is_git_dir(git_dir):
     """From git's setup.c:is_git_directory()."""
     result = False
@@ -127,6 +308,133 @@ def find_git_directory(curpath):
     return paths
 
 
+class CatFile(object):
+    """A long-running "git cat-file --batch" coprocess
+
+    Object queries are written to the coprocess's stdin and answered on its
+    stdout, so each lookup costs a pipe round-trip instead of a fork/exec.
+    The coprocess is (re)started on demand, restarted when the repository
+    changes, and shut down after being idle for `idle_timeout` seconds.
+
+    """
+
+    def __init__(self, git, check=False, idle_timeout=CAT_FILE_IDLE_TIMEOUT):
+        self.git = git
+        self.check = check
+        self.idle_timeout = idle_timeout
+        if check:
+            self._cmd = ['git', 'cat-file', '--batch-check']
+        else:
+            self._cmd = ['git', 'cat-file', '--batch']
+        self._lock = threading.Lock()
+        self._proc = None
+        self._git_dir = None
+        self._timer = None
+        self._last_used = 0.0
+
+    def query(self, name):
+        """Return (oid, objtype, size, data) for an object name
+
+        `data` is None for --batch-check queries.
+        None is returned when the object does not exist.
+
+        """
+        if not name or '\n' in name:
+            return None
+        with self._lock:
+            try:
+                return self._query(name)
+            except (IOError, OSError, ValueError):
+                # The coprocess went away; retry once with a new one
+                self._stop()
+                try:
+                    return self._query(name)
+                except (IOError, OSError, ValueError):
+                    self._stop()
+                    return None
+
+    def _query(self, name):
+        proc = self._start()
+        self._last_used = time.time()
+        proc.stdin.write(core.encode(name + '\n'))
+        proc.stdin.flush()
+
+        header = core.decode(proc.stdout.readline())
+        if not header:
+            raise IOError(errno.EPIPE, 'git cat-file exited')
+        fields = header.rstrip('\n').split(' ')
+        if len(fields) != 3:
+            # "<name> missing" or "<name> ambiguous"
+            return None
+        oid, objtype, size = fields[0], fields[1], int(fields[2])
+        if self.check:
+            data = None
+        else:
+            data = proc.stdout.read(size + 1)[:size]
+        return (oid, objtype, size, data)
+
+    def _start(self):
+        git_dir = self.git.git_dir()
+        proc = self._proc
+        if proc is not None:
+            if git_dir == self._git_dir and proc.poll() is None:
+                return proc
+            self._stop()
+
+        if GIT_COLA_TRACE:
+            core.stderr(' '.join(self._cmd))
+        self._git_dir = git_dir
+        self._proc = proc = core.start_command(self._cmd,
+                                               cwd=self.git.getcwd(),
+                                               stderr=None)
+        self._schedule_idle_check(self.idle_timeout)
+        return proc
+
+    def _schedule_idle_check(self, timeout):
+        timer = self._timer = threading.Timer(timeout, self._idle_check)
+        timer.daemon = True
+        timer.start()
+
+    def _idle_check(self):
+        with self._lock:
+            current = threading.current_thread()
+            if self._proc is None or self._timer is not current:
+                return
+            idle = time.time() - self._last_used
+            if idle >= self.idle_timeout:
+                self._stop()
+            else:
+                self._schedule_idle_check(self.idle_timeout - idle)
+
+    def stop(self):
+        """Shut down the coprocess"""
+        with self._lock:
+            self._stop()
+
+    def _stop(self):
+        if self._timer is not None:
+            if self._timer is not threading.current_thread():
+                self._timer.cancel()
+            self._timer = None
+        proc = self._proc
+        self._proc = None
+        self._git_dir = None
+        if proc is None:
+            return
+        try:
+            proc.stdin.close()
+        except (IOError, OSError):
+            pass
+        try:
+            core.wait(proc)
+        except OSError:
+            pass
+        proc.stdout.close()
+
+    def is_running(self):
+        return self._proc is not None
+
+
 class Git(object):
     """
     The Git class manages communication with the Git binary
@@ -136,6 +444,8 @@ class Git(object):
 
         self._git_cwd = None  #: The working directory used by execute()
         self._valid = {}  #: Store the result of is_git_dir() for performance
+        self._cat_file = CatFile(self)
+        self._cat_file_check = CatFile(self, check=True)
         self.set_worktree(core.getcwd())
 
     def getcwd(self):
@@ -154,6 +464,7 @@ class Git(object):
     def set_worktree(self, path):
         path = core.decode(path)
         self._find_git_directory(path)
+        self.stop_object_readers()
         return self.paths.worktree
 
     def worktree(self):
@@ -189,6 +500,35 @@ class Git(object):
             self._find_git_directory(path)
         return self.paths.git_dir
 
+    def read_object(self, name):
+        """Read an object using a persistent "git cat-file --batch"
+
+        :param name: object name, e.g. "HEAD:path/to/file"
+        :returns (oid, objtype, data): data is bytes; None if missing
+
+        """
+        result = self._cat_file.query(name)
+        if result is None:
+            return None
+        oid, objtype, size, data = result
+        return (oid, objtype, data)
+
+    def object_info(self, name):
+        """Query an object using a persistent "git cat-file --batch-check"
+
+        :returns (oid, objtype, size): None if the object is missing
+
+        """
+        result = self._cat_file_check.query(name)
+        if result is None:
+            return None
+        return result[:3]
+
+    def stop_object_readers(self):
+        """Shut down the "git cat-file" coprocesses"""
+        self._cat_file.stop()
+        self._cat_file_check.stop()
+
     def __getattr__(self, name):
         git_cmd = functools.partial(self.git, name)
         setattr(self, name, git_cmd)
@@ -201,9 +541,10 @@ class Git(object):
                 _encoding=None,
                 _raw=False,
                 _stdin=None,
+                _input=None,
                 _stderr=subprocess.PIPE,
                 _stdout=subprocess.PIPE,
-                _readonly=False,
+                _readonly=None,
                 _no_win32_startupinfo=False):
         """
         Execute a command and returns its output
@@ -214,6 +555,9 @@ class Git(object):
         :param _encoding: default encoding, defaults to None (utf-8).
         :param _raw: do not strip trailing whitespace.
         :param _stdin: optional stdin filehandle.
+        :param _input: optional string that is written to stdin.
+        :param _readonly: True when the command does not modify the index.
+            Defaults to None, which uses is_readonly() to classify the command.
         :returns (status, out, err): exit status, stdout, stderr
 
         """
@@ -230,17 +574,25 @@ class Git(object):
             # process from the console it should fork and call os.setsid().
             extra['preexec_fn'] = os.setsid
 
+        if _readonly is None:
+            _readonly = is_readonly(command)
+        if _readonly and git_subcommand(command)[0] in OPTIONAL_LOCK_COMMANDS:
+            # Keep "git diff" from refreshing .git/index behind our back
+            extra['add_env'] = {'GIT_OPTIONAL_LOCKS': '0'}
+
         # Start the process
-        # Guard against thread-unsafe .git/index.lock files
-        if not _readonly:
-            INDEX_LOCK.acquire()
-        status, out, err = core.run_command(
-                command, cwd=_cwd, encoding=_encoding,
-                stdin=_stdin, stdout=_stdout, stderr=_stderr,
-                no_win32_startupinfo=_no_win32_startupinfo, **extra)
-        # Let the next thread in
-        if not _readonly:
-            INDEX_LOCK.release()
+        # Guard against thread-unsafe .git/index.lock files.
+        # Read-only commands share the lock; index writers are exclusive.
+        if _readonly:
+            lock = INDEX_LOCK.reading()
+        else:
+            lock = INDEX_LOCK.writing()
+        with lock:
+            status, out, err = core.run_command(
+                    command, cwd=_cwd, encoding=_encoding,
+                    stdin=_stdin, stdout=_stdout, stderr=_stderr,
+                    input=_input,
+                    no_win32_startupinfo=_no_win32_startupinfo, **extra)
 
         if not _raw and out is not None:
             out = out.rstrip('\n')
@@ -261,6 +613,29 @@ class Git(object):
         # Allow access to the command's status code
         return (status, out, err)
 
+    def start(self, cmd, *args, **kwargs):
+        """Start a read-only git command and return the running process
+
+        The caller consumes the output as it arrives, e.g. using
+        core.read_lines(), and is responsible for waiting on the process.
+        The index lock is not held while the command runs, so commands
+        that may write to the index must use the regular methods.
+
+        """
+        cwd = kwargs.pop('_cwd', self._git_cwd)
+        for kwarg in ('_decode', '_encoding', '_raw', '_readonly'):
+            kwargs.pop(kwarg, None)
+        call = ['git', '-c', 'diff.suppressBlankEmpty=false', dashify(cmd)]
+        call.extend(self.transform_kwargs(**kwargs))
+        call.extend(args)
+        add_env = None
+        if dashify(cmd) in OPTIONAL_LOCK_COMMANDS:
+            add_env = {'GIT_OPTIONAL_LOCKS': '0'}
+        if GIT_COLA_TRACE:
+            core.stderr(' '.join(call))
+        return core.start_command(call, cwd=cwd or core.getcwd(),
+                                  add_env=add_env)
+
     def transform_kwargs(self, **kwargs):
         """Transform kwargs into git command line options
 
@@ -303,6 +678,7 @@ class Git(object):
                 '_decode',
                 '_encoding',
                 '_stdin',
+                '_input',
                 '_stdout',
                 '_stderr',
                 '_raw',
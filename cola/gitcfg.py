@@ -5,18 +5,23 @@ import fnmatch
 import os
 import re
 import struct
+import threading
+import time
 from binascii import unhexlify
 from os.path import join
 
 from . import core
 from . import git
 from . import observable
+from . import version
 from .compat import int_types
 from .decorators import memoize
 from .git import STDOUT
 from .compat import ustr
 
-BUILTIN_READER = os.environ.get('GIT_COLA_BUILTIN_CONFIG_READER', False)
+# Set GIT_COLA_BUILTIN_CONFIG_READER=0 to read config files using git
+BUILTIN_READER = core.getenv('GIT_COLA_BUILTIN_CONFIG_READER', '1') not in (
+        '0', 'false', 'no')
 
 _USER_CONFIG = core.expanduser(join('~', '.gitconfig'))
 _USER_XDG_CONFIG = core.expanduser(
@@ -30,17 +35,24 @@ def current():
     return GitConfig()
 
 
-def _stat_info():
-    # Try /etc/gitconfig as a fallback for the system config
+def _config_paths():
+    """Return the (category, path) pairs of the config files
+
+    /etc/gitconfig is used as a fallback for the system config.
+
+    """
     paths = [('system', '/etc/gitconfig'),
              ('user', _USER_XDG_CONFIG),
              ('user', _USER_CONFIG)]
     config = git.current().git_path('config')
     if config:
         paths.append(('repo', config))
+    return paths
 
+
+def _stat_info():
     statinfo = []
-    for category, path in paths:
+    for category, path in _config_paths():
         try:
             statinfo.append((category, path, core.stat(path).st_mtime))
         except OSError:
@@ -48,17 +60,9 @@ def _stat_info():
     return statinfo
 
 
-def _cache_key():
-    # Try /etc/gitconfig as a fallback for the system config
-    paths = ['/etc/gitconfig',
-             _USER_XDG_CONFIG,
-             _USER_CONFIG]
-    config = git.current().git_path('config')
-    if config:
-        paths.append(config)
-
+def _cache_key(paths):
     mtimes = []
-    for path in paths:
+    for _, path in paths:
         try:
             mtimes.append(core.stat(path).st_mtime)
         except OSError:
@@ -66,6 +70,15 @@ def _cache_key():
     return mtimes
 
 
+def _stat_key(path):
+    """Return the stat data used to detect changes to a file"""
+    try:
+        st = core.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime, st.st_size)
+
+
 def _config_to_python(v):
     """Convert a Git config string into a Python value"""
 
@@ -94,8 +107,328 @@ def _config_key_value(line, splitchar):
     return k, _config_to_python(v)
 
 
+#: Include files nested deeper than this are an error, as in git
+MAX_INCLUDE_DEPTH = 10
+
+# Whitespace and comments between entries
+_SKIP = re.compile(r'(?:[ \t\n\v\f\r]+|[#;][^\n]*)*')
+# [section], [section.subsection] and [section "subsection"] headers
+_SECTION = re.compile(r'\[([A-Za-z0-9.-]*)'
+                      r'(?:\]|[ \t\v\f\r]+"((?:[^"\\\n]|\\[^\n])*)"\])')
+# A variable name followed by "=", or by the end of the line
+_VARIABLE = re.compile(r'([A-Za-z][A-Za-z0-9-]*)[ \t]*(=|\n|\Z)')
+# Values without quotes or escapes
+_PLAIN_VALUE = re.compile(r'[^"\\#;\n]*')
+_VALUE_SPACE = re.compile(r'[ \t\v\f\r]')
+_SUBSECTION_ESCAPE = re.compile(r'\\(.)')
+_VALUE_ESCAPES = {'n': '\n', 't': '\t', 'b': '\b', '"': '"', '\\': '\\'}
+
+
+class _ConfigParseError(Exception):
+    """Raised when git would reject a config file"""
+
+
+def read_config_file(path, git_dir=None, depends=None):
+    """Read a git config file and the files that it includes
+
+    Returns a list of (key, value) pairs in the same order as
+    "git config --includes --file <path> --list".  Section and variable
+    names are lowercased while subsection names keep their case.  Keys
+    without a value have a value of None, and multi-valued keys appear once
+    per value.  Like git, parsing stops at the first invalid line; the
+    entries that precede it are returned.
+
+    "includeIf" conditions are evaluated against `git_dir`.  When `depends`
+    is a list, the other files that the result depends on are appended to
+    it: included files, even missing ones, and the HEAD file when an
+    "onbranch:" condition is evaluated.
+
+    """
+    entries = []
+    if depends is None:
+        depends = []
+    try:
+        _read_config(path, git_dir, entries, depends, 0)
+    except _ConfigParseError:
+        pass
+    return entries
+
+
+def _read_config(path, git_dir, entries, depends, depth):
+    with core.xopen(path, 'rb') as f:
+        text = core.decode(f.read())
+    _parse_config(text, path, git_dir, entries, depends, depth)
+
+
+def _parse_config(text, path, git_dir, entries, depends, depth):
+    """Parse config text into entries following git's config.c"""
+    text = text.replace('\r\n', '\n')
+    if text.startswith('\ufeff'):
+        text = text[1:]
+    end = len(text)
+    section = ''
+    pos = 0
+    while True:
+        pos = _SKIP.match(text, pos).end()
+        if pos >= end:
+            break
+        if text[pos] == '[':
+            match = _SECTION.match(text, pos)
+            if match is None:
+                raise _ConfigParseError(path)
+            name, subsection = match.groups()
+            name = name.lower()
+            if subsection is not None:
+                name += '.' + _SUBSECTION_ESCAPE.sub(r'\1', subsection)
+            if not name:
+                raise _ConfigParseError(path)
+            section = name + '.'
+            pos = match.end()
+            continue
+
+        match = _VARIABLE.match(text, pos)
+        if match is None:
+            raise _ConfigParseError(path)
+        key = section + match.group(1).lower()
+        pos = match.end()
+        if match.group(2) == '=':
+            value, pos = _parse_value(text, pos)
+        else:
+            value = None
+        entries.append((key, value))
+
+        if key == 'include.path':
+            _include(value, path, git_dir, entries, depends, depth)
+        elif key.startswith('includeif.') and key.endswith('.path'):
+            condition = key[len('includeif.'):-len('.path')]
+            if condition.startswith('onbranch:') and git_dir:
+                depends.append(join(git_dir, 'HEAD'))
+            if _include_condition(condition, path, git_dir):
+                _include(value, path, git_dir, entries, depends, depth)
+
+
+def _parse_value(text, pos):
+    """Return the value that starts at text[pos] and the position after it
+
+    Outside of quotes, leading and trailing whitespace is dropped and each
+    whitespace character inside the value becomes a space.
+
+    """
+    match = _PLAIN_VALUE.match(text, pos)
+    end = match.end()
+    if end == len(text) or text[end] in '\n#;':
+        value = match.group(0).strip(' \t\v\f\r')
+        if end < len(text) and text[end] != '\n':
+            end = text.find('\n', end)
+            if end < 0:
+                end = len(text)
+        return _VALUE_SPACE.sub(' ', value), end
+
+    value = []
+    quote = comment = False
+    space = 0
+    size = len(text)
+    while True:
+        if pos < size:
+            c = text[pos]
+            pos += 1
+        else:
+            c = '\n'
+        if c == '\n':
+            if quote:
+                raise _ConfigParseError('unterminated quote')
+            return ''.join(value), pos
+        if comment:
+            continue
+        if not quote:
+            if c in ' \t\v\f\r':
+                if value:
+                    space += 1
+                continue
+            if c in '#;':
+                comment = True
+                continue
+        if space:
+            value.append(' ' * space)
+            space = 0
+        if c == '\\':
+            if pos < size:
+                c = text[pos]
+                pos += 1
+            else:
+                c = '\n'
+            if c == '\n':
+                # continuation line
+                continue
+            try:
+                value.append(_VALUE_ESCAPES[c])
+            except KeyError:
+                raise _ConfigParseError('unknown escape: \\%s' % c)
+            continue
+        if c == '"':
+            quote = not quote
+            continue
+        value.append(c)
+
+
+def _include_path(value, path):
+    """Return the path of a file included by the config file at `path`"""
+    include = core.expanduser(value)
+    if not os.path.isabs(include):
+        include = join(os.path.dirname(path), include)
+    return include
+
+
+def _include(value, path, git_dir, entries, depends, depth):
+    """Read an included file relative to the including file"""
+    if value is None:
+        raise _ConfigParseError('include.path must have a value')
+    include = _include_path(value, path)
+    depends.append(include)
+    if not os.access(include, os.R_OK):
+        # missing includes are ignored
+        return
+    if depth >= MAX_INCLUDE_DEPTH:
+        raise _ConfigParseError('exceeded maximum include depth')
+    _read_config(include, git_dir, entries, depends, depth + 1)
+
+
+def _include_condition(condition, path, git_dir):
+    """Evaluate an "includeIf.<condition>.path" condition"""
+    if not git_dir:
+        return False
+    if condition.startswith('gitdir:'):
+        return _include_by_gitdir(condition[len('gitdir:'):],
+                                  path, git_dir, False)
+    if condition.startswith('gitdir/i:'):
+        return _include_by_gitdir(condition[len('gitdir/i:'):],
+                                  path, git_dir, True)
+    if condition.startswith('onbranch:'):
+        return _include_by_branch(condition[len('onbranch:'):], git_dir)
+    return False
+
+
+def _include_by_gitdir(pattern, path, git_dir, icase):
+    pattern = core.expanduser(pattern)
+    prefix = 0
+    if pattern.startswith('./'):
+        # relative to the directory of the config file
+        dirname = os.path.dirname(os.path.realpath(path))
+        pattern = dirname + pattern[1:]
+        prefix = len(dirname) + 1
+    elif not os.path.isabs(pattern):
+        pattern = '**/' + pattern
+    if pattern.endswith('/'):
+        pattern += '**'
+
+    literal = pattern[:prefix]
+    for text in (os.path.realpath(git_dir), os.path.abspath(git_dir)):
+        if icase:
+            matches_prefix = text[:prefix].lower() == literal.lower()
+        else:
+            matches_prefix = text[:prefix] == literal
+        if (matches_prefix and
+                wildmatch(pattern[prefix:], text[prefix:], icase=icase)):
+            return True
+    return False
+
+
+def _include_by_branch(pattern, git_dir):
+    try:
+        with core.xopen(join(git_dir, 'HEAD'), 'rb') as f:
+            head = core.decode(f.read()).strip()
+    except (IOError, OSError):
+        return False
+    prefix = 'ref: refs/heads/'
+    if not head.startswith(prefix):
+        return False
+    if pattern.endswith('/'):
+        pattern += '**'
+    return wildmatch(pattern, head[len(prefix):])
+
+
+def wildmatch(pattern, text, icase=False):
+    """Match text against a pattern like git's wildmatch(WM_PATHNAME)
+
+    "*", "?" and "[...]" do not match "/".  "**/" matches any number
+    of leading directories, "/**/" any number of intermediate directories
+    and a trailing "/**" everything inside of a directory.
+
+    """
+    flags = re.DOTALL
+    if icase:
+        flags |= re.IGNORECASE
+    return re.match(_wildmatch_regexp(pattern), text, flags) is not None
+
+
+def _wildmatch_regexp(pattern):
+    regexp = []
+    size = len(pattern)
+    i = 0
+    while i < size:
+        c = pattern[i]
+        if c == '*':
+            j = i
+            while j < size and pattern[j] == '*':
+                j += 1
+            if (j - i > 1 and (i == 0 or pattern[i-1] == '/') and
+                    (j == size or pattern[j] == '/')):
+                if j == size:
+                    regexp.append('.*')
+                else:
+                    regexp.append('(?:.*/)?')
+                    j += 1
+            else:
+                regexp.append('[^/]*')
+            i = j
+            continue
+        if c == '?':
+            regexp.append('[^/]')
+        elif c == '[':
+            j = i + 1
+            if j < size and pattern[j] in '!^':
+                j += 1
+            if j < size and pattern[j] == ']':
+                j += 1
+            j = pattern.find(']', j)
+            if j < 0:
+                regexp.append(re.escape(c))
+            else:
+                chars = pattern[i+1:j]
+                negate = chars[:1] in ('!', '^')
+                if negate:
+                    chars = chars[1:]
+                chars = re.sub(r'([\\\[\]^])', r'\\\1', chars)
+                if negate:
+                    regexp.append('[^/%s]' % chars)
+                else:
+                    regexp.append('(?!/)[%s]' % chars)
+                i = j
+        elif c == '\\' and i + 1 < size:
+            i += 1
+            regexp.append(re.escape(pattern[i]))
+        else:
+            regexp.append(re.escape(c))
+        i += 1
+    regexp.append(r'\Z')
+    return ''.join(regexp)
+
+
 class GitConfig(observable.Observable):
-    """Encapsulate access to git-config values."""
+    """Encapsulate access to git-config values.
+
+    Values are read into a snapshot that is validated against the mtimes
+    of the config files, the files that they include and, when includeIf
+    uses "onbranch:", HEAD.  Lookups only stat the files again once
+    "check_interval" seconds have passed since the last check, or after
+    invalidate() is called, e.g. when the file system monitor sees
+    .git/config change.  The number of stat calls saved is counted in
+    "stats_avoided".
+
+    """
+
+    #: Seconds during which a validated snapshot is trusted
+    check_interval = 1.0
 
     message_user_config_changed = 'user_config_changed'
     message_repo_config_changed = 'repo_config_changed'
@@ -114,6 +447,13 @@ class GitConfig(observable.Observable):
         self._config_files = {}
         self._value_cache = {}
         self._attr_cache = {}
+        self._attr_stats = {}
+        self._attr_checked = 0.0
+        self._attr_lock = threading.Lock()
+        self._cache_paths = None
+        self._depends = []
+        self._checked = 0.0
+        self.stats_avoided = 0
         self._find_config_files()
 
     def reset(self):
@@ -127,9 +467,20 @@ class GitConfig(observable.Observable):
         self._configs = []
         self._config_files.clear()
         self._value_cache = {}
-        self._attr_cache = {}
+        with self._attr_lock:
+            self._attr_cache = {}
+            self._attr_stats = {}
+            self._attr_checked = 0.0
+        self._cache_paths = None
+        self._depends = []
+        self._checked = 0.0
         self._find_config_files()
 
+    def invalidate(self):
+        """Check the config and attributes files on the next lookup"""
+        self._checked = 0.0
+        self._attr_checked = 0.0
+
     def user(self):
         return copy.deepcopy(self._user)
 
@@ -168,9 +519,18 @@ class GitConfig(observable.Observable):
         Updates the cache and returns False when the cache does not match.
 
         """
-        cache_key = _cache_key()
-        if self._cache_key is None or cache_key != self._cache_key:
+        paths = _config_paths()
+        now = time.time()
+        if (self._cache_key is not None and paths == self._cache_paths and
+                now - self._checked < self.check_interval):
+            self.stats_avoided += len(paths)
+            return True
+        cache_key = (_cache_key(paths), _cache_key(self._depends))
+        self._checked = now
+        if (self._cache_key is None or cache_key != self._cache_key or
+                paths != self._cache_paths):
             self._cache_key = cache_key
+            self._cache_paths = paths
             return False
         return True
 
@@ -183,17 +543,24 @@ class GitConfig(observable.Observable):
         self._repo.clear()
         self._all.clear()
 
+        depends = []
         if 'system' in self._config_files:
             self._system.update(
-                    self.read_config(self._config_files['system']))
+                    self.read_config(self._config_files['system'], depends))
 
         if 'user' in self._config_files:
             self._user.update(
-                    self.read_config(self._config_files['user']))
+                    self.read_config(self._config_files['user'], depends))
 
         if 'repo' in self._config_files:
             self._repo.update(
-                    self.read_config(self._config_files['repo']))
+                    self.read_config(self._config_files['repo'], depends))
+
+        # Included files and HEAD are checked along with the config files
+        depends = [('depends', path) for path in sorted(set(depends))]
+        if depends != self._depends:
+            self._depends = depends
+            self._cache_key = (self._cache_key[0], _cache_key(depends))
 
         for dct in (self._system, self._user):
             self._user_or_system.update(dct)
@@ -201,57 +568,54 @@ class GitConfig(observable.Observable):
         for dct in (self._system, self._user, self._repo):
             self._all.update(dct)
 
-    def read_config(self, path):
-        """Return git config data from a path as a dictionary."""
+    def read_config(self, path, depends=None):
+        """Return git config data from a path as a dictionary.
 
-        if BUILTIN_READER:
-            return self._read_config_file(path)
+        The other files that the data depends on are appended to the
+        `depends` list, as with read_config_file().
 
+        """
+        if depends is None:
+            depends = []
         dest = {}
-        args = ('--null', '--file', path, '--list')
+        git_dir = self.git.git_dir()
+        if BUILTIN_READER:
+            for k, v in read_config_file(path, git_dir=git_dir,
+                                         depends=depends):
+                if v is None:
+                    # a bare key is interpreted as meaning "true"
+                    v = 'true'
+                self._map[k.lower()] = k
+                dest[k] = _config_to_python(v)
+            return dest
+
+        show_origin = version.check_git('config-show-origin')
+        args = ['--null', '--includes', '--file', path, '--list']
+        if show_origin:
+            args.insert(0, '--show-origin')
         config_lines = self.git.config(*args)[STDOUT].split('\0')
-        for line in config_lines:
+        origin = path
+        for idx, line in enumerate(config_lines):
+            if show_origin and idx % 2 == 0:
+                # "file:<path>" precedes each entry
+                origin = line[len('file:'):]
+                continue
             if not line:
                 # the user has an invalid entry in their git config
                 continue
             k, v = _config_key_value(line, '\n')
             self._map[k.lower()] = k
             dest[k] = v
+            # Included files are watched even when git did not read them
+            key = k.lower()
+            if (key == 'include.path' or
+                    key.startswith('includeif.') and key.endswith('.path')):
+                if key.startswith('includeif.onbranch:') and git_dir:
+                    depends.append(join(git_dir, 'HEAD'))
+                if isinstance(v, ustr):
+                    depends.append(_include_path(v, origin))
         return dest
 
-    def _read_config_file(self, path):
-        """Read a .gitconfig file into a dict"""
-
-        config = {}
-        header_simple = re.compile(r'^\[(\s+)]$')
-        header_subkey = re.compile(r'^\[(\s+) "(\s+)"\]$')
-
-        with core.xopen(path, 'rt') as f:
-            file_lines = f.readlines()
-
-        stripped_lines = [line.strip() for line in file_lines]
-        lines = [line for line in stripped_lines if bool(line)]
-        prefix = ''
-        for line in lines:
-            if line.startswith('#'):
-                continue
-
-            match = header_simple.match(line)
-            if match:
-                prefix = match.group(1) + '.'
-                continue
-            match = header_subkey.match(line)
-            if match:
-                prefix = match.group(1) + '.' + match.group(2) + '.'
-                continue
-
-            k, v = _config_key_value(line, '=')
-            k = prefix + k
-            self._map[k.lower()] = k
-            config[k] = v
-
-        return config
-
     def _get(self, src, key, default):
         self.update()
         try:
@@ -310,18 +674,21 @@ class GitConfig(observable.Observable):
             self.unset_user(key)
             return
         self.git.config('--global', key, self.python_to_git(value))
+        self.invalidate()
         self.update()
         msg = self.message_user_config_changed
         self.notify_observers(msg, key, value)
 
     def set_repo(self, key, value):
         self.git.config(key, self.python_to_git(value))
+        self.invalidate()
         self.update()
         msg = self.message_repo_config_changed
         self.notify_observers(msg, key, value)
 
     def unset_user(self, key):
         self.git.config('--global', '--unset', key)
+        self.invalidate()
         self.update()
         msg = self.message_repo_config_changed
         self.notify_observers(msg, key, None)
@@ -353,27 +720,93 @@ class GitConfig(observable.Observable):
     def file_encoding(self, path):
         if not self.is_per_file_attrs_enabled():
             return self.gui_encoding()
-        cache = self._attr_cache
-        try:
-            value = cache[path]
-        except KeyError:
-            value = cache[path] = (self._file_encoding(path) or
-                                   self.gui_encoding())
-        return value
+        return self.file_encodings([path])[path]
+
+    def file_encodings(self, paths):
+        """Return a dict that maps paths to their file encoding
 
-    def _file_encoding(self, path):
-        """Return the file encoding for a path"""
-        status, out, err = self.git.check_attr('encoding', '--', path)
+        Encodings that are not already cached are resolved using a single
+        "git check-attr --stdin" call.  The cache is dropped when any of
+        the attributes files that apply to the cached paths change.
+
+        """
+        if not self.is_per_file_attrs_enabled():
+            encoding = self.gui_encoding()
+            return dict((path, encoding) for path in paths)
+        self._check_attributes()
+        with self._attr_lock:
+            cache = self._attr_cache
+            missing = sorted(set(path for path in paths if path not in cache))
+        if missing:
+            attributes_files = self._attributes_files(missing)
+            with self._attr_lock:
+                self._watch_attributes(attributes_files)
+            default = self.gui_encoding()
+            encodings = self._file_encodings(missing)
+            with self._attr_lock:
+                for path in missing:
+                    cache[path] = encodings.get(path) or default
+        with self._attr_lock:
+            return dict((path, cache[path]) for path in paths)
+
+    def _file_encodings(self, paths):
+        """Return the "encoding" attribute for paths"""
+        status, out, err = self.git.check_attr(
+            'encoding', z=True, stdin=True,
+            _input=''.join(path + '\0' for path in paths))
         if status != 0:
-            return None
-        header = '%s: encoding: ' % path
-        if out.startswith(header):
-            encoding = out[len(header):].strip()
-            if (encoding != 'unspecified' and
-                    encoding != 'unset' and
-                    encoding != 'set'):
-                return encoding
-        return None
+            return {}
+        # Each record is <path> NUL <attribute> NUL <info> NUL
+        fields = out.split('\0')
+        encodings = {}
+        for idx in range(0, len(fields) - 2, 3):
+            encoding = fields[idx + 2]
+            if encoding not in ('unspecified', 'unset', 'set'):
+                encodings[fields[idx]] = encoding
+        return encodings
+
+    def _attributes_files(self, paths):
+        """Return the attributes files that can apply to paths"""
+        dirs = set()
+        for path in paths:
+            dirname = os.path.dirname(path)
+            while dirname not in dirs:
+                dirs.add(dirname)
+                if not dirname:
+                    break
+                dirname = os.path.dirname(dirname)
+        files = [join(dirname, '.gitattributes') for dirname in dirs]
+        attributes_file = self.get('core.attributesfile')
+        if attributes_file:
+            files.append(core.expanduser(attributes_file))
+        else:
+            files.append(join(os.path.dirname(_USER_XDG_CONFIG), 'attributes'))
+        files.append(self.git.git_path('info', 'attributes'))
+        files.append('/etc/gitattributes')
+        return files
+
+    def _watch_attributes(self, attributes_files):
+        """Record the stat data of attributes files; needs _attr_lock"""
+        stats = self._attr_stats
+        for path in attributes_files:
+            if path not in stats:
+                stats[path] = _stat_key(path)
+
+    def _check_attributes(self):
+        """Drop cached encodings once an attributes file has changed"""
+        now = time.time()
+        with self._attr_lock:
+            if now - self._attr_checked < self.check_interval:
+                return
+            self._attr_checked = now
+            stats = self._attr_stats
+        for path, key in list(stats.items()):
+            if _stat_key(path) != key:
+                with self._attr_lock:
+                    if self._attr_stats is stats:
+                        self._attr_cache = {}
+                        self._attr_stats = {}
+                break
 
     def get_guitool_opts(self, name):
         """Return the guitool.<name> namespace as a dict
@@ -2,13 +2,19 @@
 from __future__ import division, absolute_import, unicode_literals
 
 import re
-from io import StringIO
+import threading
+import time
+from binascii import hexlify
+from collections import OrderedDict
+from os.path import join
 
 from . import core
 from . import gitcfg
 from . import utils
 from . import version
+from .decorators import memoize
 from .git import git
+from .git import INDEX_LOCK
 from .git import STDOUT
 from .i18n import N_
 
@@ -225,6 +231,122 @@ def all_refs(split=False, git=git):
         return local_branches + remote_branches + tags
 
 
+class RefCache(object):
+    """The local branches, remote branches and tags of a repository
+
+    "git for-each-ref" only runs when packed-refs or a directory under
+    refs/ has changed since the last load, so refreshes that do not touch
+    refs skip it.  Reftable repositories are checked using
+    reftable/tables.list, which is replaced on every ref update.  Refs are classified in a single pass.  Every load that
+    changes the names bumps the generation and records the names that
+    were added and removed in "delta", keyed by the name of the list.
+    A ref directory that changed within the last few seconds is checked
+    again on the next update, since its mtime may not change again.
+
+    """
+
+    KINDS = (
+        ('heads', 'local_branches'),
+        ('remotes', 'remote_branches'),
+        ('tags', 'tags'),
+    )
+    racy_seconds = 2.0
+
+    def __init__(self):
+        self.local_branches = []
+        self.remote_branches = []
+        self.tags = []
+        self.generation = 0
+        self.delta = {}
+        self.loads = 0
+        self.avoided = 0
+        self._key = None
+        self._lock = threading.Lock()
+
+    def refs_key(self, git=git):
+        """Return the stat data of the files that store refs"""
+        git_dir = git.git_path()
+        if not git_dir:
+            return None
+        common_dir = git_dir
+        commondir_path = join(git_dir, 'commondir')
+        if core.exists(commondir_path):
+            # Linked worktrees share the refs of the main repository
+            common_dir = join(git_dir, core.read(commondir_path).strip())
+        reftable = join(common_dir, 'reftable')
+        if core.isdir(reftable):
+            # refs/ is a stub when extensions.refStorage is "reftable"
+            tables_key = _stat_key(join(reftable, 'tables.list'))
+            if tables_key is None:
+                return None
+            return (tables_key,)
+        key = [_stat_key(join(common_dir, 'packed-refs'))]
+        for dirpath, _, _ in core.walk(join(common_dir, 'refs')):
+            try:
+                key.append((dirpath, core.stat(dirpath).st_mtime))
+            except OSError:
+                pass
+        if len(key) == 1:
+            # Unknown ref storage
+            return None
+        return tuple(key)
+
+    def update(self, git=git):
+        """Reload the refs if they changed; returns True if the names did"""
+        key = self.refs_key(git=git)
+        with self._lock:
+            if key is not None and key == self._key:
+                self.avoided += 1
+                return False
+            self.loads += 1
+            mtimes = [item[1] for item in key[1:]] if key else []
+            if mtimes and time.time() - max(mtimes) < self.racy_seconds:
+                key = None
+            self._key = key
+            return self._load(git)
+
+    def invalidate(self):
+        """Reload the refs on the next update"""
+        with self._lock:
+            self._key = None
+
+    def _load(self, git):
+        refs = dict((kind, []) for kind, _ in self.KINDS)
+        sort = _version_sort()
+        status, out, err = git.for_each_ref(format='%(refname)',
+                                            sort=sort, _readonly=True)
+        for ref in out.splitlines():
+            parts = ref.split('/', 2)
+            if len(parts) == 3 and not ref.endswith('/HEAD'):
+                dst = refs.get(parts[1])
+                if dst is not None:
+                    dst.append(parts[2])
+        refs['tags'].reverse()
+
+        delta = {}
+        for kind, attr in self.KINDS:
+            old = getattr(self, attr)
+            new = refs[kind]
+            if old == new:
+                continue
+            old_set = set(old)
+            new_set = set(new)
+            delta[attr] = ([name for name in new if name not in old_set],
+                           [name for name in old if name not in new_set])
+            setattr(self, attr, new)
+        if not delta:
+            return False
+        self.delta = delta
+        self.generation += 1
+        return True
+
+
+@memoize
+def ref_cache():
+    """Return the ref cache singleton"""
+    return RefCache()
+
+
 def tracked_branch(branch=None, config=None):
     """Return the remote branch associated with 'branch'."""
     if config is None:
@@ -326,8 +448,32 @@ def oid_diff(git, oid, filename=None):
     return out
 
 
+def commit_body(oid, git=git):
+    """Return a commit's message body, as with "git log --pretty=%b"
+
+    The commit is read through the persistent "git cat-file --batch"
+    object reader rather than by running "git log".
+
+    """
+    obj = git.read_object(oid)
+    if obj is None or obj[1] != 'commit':
+        return ''
+    headers, sep, message = obj[2].partition(b'\n\n')
+    encoding = None
+    for line in headers.split(b'\n'):
+        if line.startswith(b'encoding '):
+            encoding = core.decode(line[len(b'encoding '):])
+    message = core.decode(message, encoding=encoding)
+    # Skip the subject paragraph
+    lines = message.splitlines()
+    idx = 0
+    while idx < len(lines) and lines[idx].strip():
+        idx += 1
+    return '\n'.join(lines[idx:]).strip()
+
+
 def diff_info(oid, git=git, filename=None):
-    decoded = log(git, '-1', oid, '--', pretty='format:%b').strip()
+    decoded = commit_body(oid, git=git)
     if decoded:
         decoded += '\n\n'
     return decoded + oid_diff(git, oid, filename=filename)
@@ -346,6 +492,27 @@ def diff_helper(commit=None,
                 reverse=False,
                 git=git):
     "Invokes git diff on a filepath."
+    argv, encoding = _diff_args(commit=commit, ref=ref, endref=endref,
+                                filename=filename, cached=cached, head=head,
+                                amending=amending)
+    status, out, err = git.diff(R=reverse, M=True, cached=cached,
+                                _encoding=encoding,
+                                *argv,
+                                **common_diff_opts())
+    if status != 0:
+        # git init
+        if with_diff_header:
+            return ('', '')
+        else:
+            return ''
+
+    return extract_diff_header(status, deleted,
+                               with_diff_header, suppress_header, out)
+
+
+def _diff_args(commit=None, ref=None, endref=None, filename=None,
+               cached=True, head=None, amending=False):
+    """Return the (argv, encoding) for a "git diff" invocation"""
     if commit:
         ref, endref = commit+'^', commit
     argv = []
@@ -366,54 +533,254 @@ def diff_helper(commit=None,
             argv.append(filename)
             cfg = gitcfg.current()
             encoding = cfg.file_encoding(filename)
-
-    status, out, err = git.diff(R=reverse, M=True, cached=cached,
-                                _encoding=encoding,
-                                *argv,
-                                **common_diff_opts())
-    if status != 0:
-        # git init
-        if with_diff_header:
-            return ('', '')
-        else:
-            return ''
-
-    return extract_diff_header(status, deleted,
-                               with_diff_header, suppress_header, out)
+    return argv, encoding
 
 
 def extract_diff_header(status, deleted,
                         with_diff_header, suppress_header, diffoutput):
-    headers = []
-
     if diffoutput.startswith('Submodule'):
         if with_diff_header:
             return ('', diffoutput)
         else:
             return diffoutput
 
+    if with_diff_header:
+        headers = []
+    else:
+        headers = None
+    lines = filter_diff_header(diffoutput.splitlines(), deleted=deleted,
+                               suppress_header=suppress_header,
+                               headers=headers)
+    result = '\n'.join(lines).rstrip('\n')
+
+    if with_diff_header:
+        return('\n'.join(headers), result)
+    else:
+        return result
+
+
+def filter_diff_header(lines, deleted=False, suppress_header=True,
+                       headers=None):
+    """Yield the lines of a diff, leaving out its header
+
+    Header lines are collected into `headers` when it is a list, and are
+    yielded along with the rest of the diff when `suppress_header` is false.
+    Submodule summaries are passed through as-is.
+
+    """
     start = False
+    first = True
     del_tag = 'deleted file mode '
-    output = StringIO()
 
-    for line in diffoutput.splitlines():
+    for line in lines:
+        if first:
+            first = False
+            if line.startswith('Submodule'):
+                start = True
         if not start and '@@' == line[:2] and '@@' in line[2:]:
             start = True
         if start or (deleted and del_tag in line):
-            output.write(line + '\n')
+            yield line
+        elif headers is not None:
+            headers.append(line)
+        elif not suppress_header:
+            yield line
+
+
+class DiffStream(object):
+    """Reads "git diff" output in size-bounded batches
+
+    Lines are decoded as they arrive from the "git diff" process and pass
+    through filter_diff_header().  read() stops once a batch reaches its
+    line or size limit and leaves the rest of the diff in the pipe, so
+    that huge diffs can be displayed a piece at a time.
+
+    """
+
+    def __init__(self, proc, encoding=None, deleted=False):
+        self.proc = proc
+        self.exhausted = False
+        self.lines_read = 0
+        self._lines = filter_diff_header(core.read_lines(proc.stdout,
+                                                         encoding=encoding),
+                                         deleted=deleted)
+        self._next_line = None
+
+    def read(self, max_lines=0, max_size=0):
+        """Return the next batch of lines as text
+
+        A limit of zero reads without that limit.  Once the end of the diff
+        is reached the stream is closed and "exhausted" is set.
+
+        """
+        if self.exhausted:
+            return ''
+        lines = []
+        size = 0
+        if self._next_line is not None:
+            lines.append(self._next_line)
+            size += len(self._next_line) + 1
+            self._next_line = None
+        for line in self._lines:
+            if ((max_lines and len(lines) >= max_lines) or
+                    (max_size and size >= max_size)):
+                # Hold on to the line so that we know if there is more
+                self._next_line = line
+                break
+            lines.append(line)
+            size += len(line) + 1
         else:
-            if with_diff_header:
-                headers.append(line)
-            elif not suppress_header:
-                output.write(line + '\n')
+            self.close()
+        self.lines_read += len(lines)
+        return '\n'.join(lines)
 
-    result = output.getvalue().rstrip('\n')
-    output.close()
+    def kill(self):
+        """Stop the "git diff" process so that a pending read() finishes
 
-    if with_diff_header:
-        return('\n'.join(headers), result)
-    else:
-        return result
+        This can be called from another thread to cancel a read().
+        The text that was read is incomplete even though the stream
+        becomes exhausted.
+
+        """
+        try:
+            self.proc.kill()
+        except OSError:
+            pass
+
+    def close(self):
+        """Stop reading and reap the "git diff" process"""
+        if self.exhausted:
+            return
+        self.exhausted = True
+        self._next_line = None
+        proc = self.proc
+        if proc.poll() is None:
+            try:
+                proc.kill()
+            except OSError:
+                pass
+        core.communicate(proc)
+
+
+def diff_stream(commit=None,
+                ref=None,
+                endref=None,
+                filename=None,
+                cached=True,
+                deleted=False,
+                head=None,
+                amending=False,
+                reverse=False,
+                git=git):
+    """Start "git diff" on a filepath and return a DiffStream
+
+    This is the streaming counterpart of diff_helper().
+
+    """
+    argv, encoding = _diff_args(commit=commit, ref=ref, endref=endref,
+                                filename=filename, cached=cached, head=head,
+                                amending=amending)
+    proc = git.start('diff', R=reverse, M=True, cached=cached,
+                     *argv, **common_diff_opts())
+    return DiffStream(proc, encoding=encoding, deleted=deleted)
+
+
+class DiffCache(object):
+    """An LRU cache of diff text with a size budget
+
+    Entries are keyed by the path, the diff options and the stat data of
+    the index and of the worktree file, so that a changed index or file
+    yields a different key.  Entries are also dropped explicitly when the
+    file system monitor reports changes.  The budget is measured in
+    characters of diff text.
+
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, filename, cached=False, deleted=False, ref=None,
+            config=None):
+        """Return the cache key for a diff of filename in the current state"""
+        opts = tuple(sorted(common_diff_opts(config=config).items()))
+        index_stat = _stat_key(git.git_path('index'))
+        if cached:
+            worktree_stat = None
+        else:
+            worktree_stat = _stat_key(filename)
+        return (filename, cached, deleted, ref, opts,
+                index_stat, worktree_stat)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key):
+        """Return the cached diff text for key, or None"""
+        with self._lock:
+            text = self._entries.pop(key, None)
+            if text is None:
+                self.misses += 1
+                return None
+            self._entries[key] = text
+            self.hits += 1
+            return text
+
+    def put(self, key, text):
+        """Cache text unless it is larger than the budget"""
+        size = len(text)
+        if size > self.budget:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._entries[key] = text
+            self.size += size
+            while self.size > self.budget:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def invalidate(self, paths=None):
+        """Drop the entries for paths, or everything when paths is None"""
+        with self._lock:
+            if paths is None:
+                self._entries.clear()
+                self.size = 0
+                return
+            paths = set(paths)
+            for key in [k for k in self._entries if k[0] in paths]:
+                self.size -= len(self._entries.pop(key))
+
+    def stats(self):
+        """Return a dict of hit, miss, entry and size counts"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'size': self.size,
+            }
+
+
+def _stat_key(path):
+    try:
+        st = core.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime, st.st_size)
+
+
+@memoize
+def diff_cache():
+    """Return the diff cache singleton"""
+    budget = gitcfg.current().get('cola.diffcachesize', 32 * 1024 * 1024)
+    return DiffCache(budget)
 
 
 def format_patchsets(to_export, revs, output='patches'):
@@ -474,8 +841,41 @@ def export_patchset(start, end, output='patches', **kwargs):
     return git.format_patch('-o', output, start + '^..' + end, **kwargs)
 
 
+def _nul_terminated(paths):
+    """Return paths as NUL-terminated input for "--stdin -z" options"""
+    return ''.join([path + '\0' for path in paths])
+
+
+def update_index_paths(paths, git=git):
+    """Add, update or remove files in the index using a single command
+
+    The paths are written to "git update-index --stdin -z" so that any
+    number of paths can be staged without running into argv limits.
+    Paths that do not exist in the worktree are removed from the index.
+    Directories must be staged using add_paths().
+
+    """
+    return git.update_index('--add', '--remove', '--verbose', '-z', '--stdin',
+                            _input=_nul_terminated(paths))
+
+
+def add_paths(paths, git=git):
+    """Run "git add --force" on paths, reading them from stdin if possible"""
+    if version.check_git('pathspec-from-file'):
+        return git.add('--pathspec-from-file=-', '--pathspec-file-nul',
+                       force=True, verbose=True,
+                       _input=_nul_terminated(paths))
+    return git.add('--', force=True, verbose=True, *paths)
+
+
 def unstage_paths(args, head='HEAD'):
-    status, out, err = git.reset(head, '--', *set(args))
+    args = sorted(set(args))
+    if version.check_git('pathspec-from-file'):
+        status, out, err = git.reset(
+            head, '--pathspec-from-file=-', '--pathspec-file-nul', q=True,
+            _input=_nul_terminated(args))
+    else:
+        status, out, err = git.reset(head, '--', *args)
     if status == 128:
         # handle git init: we have to use 'git rm --cached'
         # detect this condition by checking if the file is still staged
@@ -487,7 +887,8 @@ def unstage_paths(args, head='HEAD'):
 def untrack_paths(args, head='HEAD'):
     if not args:
         return (-1, N_('Nothing to do'), '')
-    return git.update_index('--', force_remove=True, *set(args))
+    return git.update_index('--force-remove', '-z', '--stdin',
+                            _input=_nul_terminated(set(args)))
 
 
 def worktree_state(head='HEAD',
@@ -496,10 +897,25 @@ def worktree_state(head='HEAD',
                    paths=None):
     """Return a dict of files in various states of being
 
+    A single "git status --porcelain=v2" command is used when comparing
+    against HEAD with a capable version of Git.  Otherwise, e.g. when
+    amending, the state is gathered using diff-index, diff-files and ls-files.
+
     :rtype: dict, keys are staged, unstaged, untracked, unmerged,
             changed_upstream, and submodule.
 
     """
+    if head == 'HEAD' and version.check_git('status-porcelain-v2'):
+        return status_state(display_untracked=display_untracked, paths=paths)
+    return diff_state(head=head, update_index=update_index,
+                      display_untracked=display_untracked, paths=paths)
+
+
+def diff_state(head='HEAD',
+               update_index=False,
+               display_untracked=True,
+               paths=None):
+    """Return the worktree state using diff-index, diff-files and ls-files"""
     if update_index:
         git.update_index(refresh=True)
 
@@ -533,6 +949,133 @@ def worktree_state(head='HEAD',
             'submodules': staged_submods | modified_submods}
 
 
+def status_state(display_untracked=True, paths=None):
+    """Return the worktree state using "git status --porcelain=v2"
+
+    "git status" refreshes the index on its own, so there is no need
+    for a separate "git update-index --refresh" call.
+
+    """
+    if display_untracked:
+        untracked_arg = '--untracked-files=all'
+    else:
+        untracked_arg = '--untracked-files=no'
+    cmd = ['git', 'status', '--porcelain=v2', '-z', '--branch',
+           untracked_arg, '--']
+    if paths:
+        cmd.extend(paths)
+
+    # "git status" opportunistically writes the refreshed index
+    with INDEX_LOCK.writing():
+        proc = core.start_command(cmd, cwd=git.getcwd())
+        state, headers = parse_status_porcelain_v2(
+                core.read_nul_records(proc.stdout))
+        core.communicate(proc)
+
+    if proc.returncode != 0:
+        # Not something we can parse, e.g. a corrupt index or unusual config
+        return diff_state(display_untracked=display_untracked, paths=paths)
+
+    upstream = headers.get('branch.upstream')
+    if upstream and headers.get('branch.oid') != '(initial)':
+        state['upstream_changed'] = upstream_filenames('HEAD', upstream)
+
+    for key in ('staged', 'modified', 'unmerged',
+                'untracked', 'upstream_changed'):
+        state[key].sort()
+
+    return state
+
+
+def parse_status_porcelain_v2(records):
+    """Parse "git status --porcelain=v2 -z" records
+
+    Records are consumed one at a time so that output can be parsed
+    while it is being read from the "git status" process.
+
+    Returns a (state, headers) tuple.  `state` matches the structure
+    returned by worktree_state().  `headers` is a dict of the "# key value"
+    header lines, e.g. {'branch.upstream': 'origin/master'}.
+
+    """
+    staged = []
+    modified = []
+    unmerged = []
+    untracked = []
+    staged_deleted = set()
+    unstaged_deleted = set()
+    submodules = set()
+    headers = {}
+
+    records = iter(records)
+    for record in records:
+        kind = record[:1]
+        if kind == '1':
+            # 1 <XY> <sub> <mH> <mI> <mW> <hH> <hI> <path>
+            fields = record.split(' ', 8)
+            orig_path = None
+        elif kind == '2':
+            # 2 <XY> <sub> <mH> <mI> <mW> <hH> <hI> <X><score> <path>
+            # The original path follows as a separate record.
+            fields = record.split(' ', 9)
+            orig_path = next(records, None)
+        elif kind == 'u':
+            # u <XY> <sub> <m1> <m2> <m3> <mW> <h1> <h2> <h3> <path>
+            fields = record.split(' ', 10)
+            unmerged.append(fields[-1])
+            continue
+        elif kind == '?':
+            untracked.append(record[2:])
+            continue
+        elif kind == '#':
+            # # branch.upstream <upstream>
+            fields = record[2:].split(' ', 1)
+            if len(fields) == 2:
+                headers[fields[0]] = fields[1]
+            continue
+        else:
+            # Ignored files ("!") and anything unknown
+            continue
+
+        index_status, worktree_status = fields[1][0], fields[1][1]
+        path = fields[-1]
+        if fields[2][:1] == 'S':
+            submodules.add(path)
+
+        # diff-index does not detect renames, so they are reported
+        # as a deletion of the old path and an addition of the new path.
+        if index_status in 'DAMTC':
+            staged.append(path)
+            if index_status == 'D':
+                staged_deleted.add(path)
+        elif index_status == 'R':
+            staged.append(path)
+            if orig_path:
+                staged.append(orig_path)
+                staged_deleted.add(orig_path)
+
+        if worktree_status in 'DAMTC':
+            modified.append(path)
+            if worktree_status == 'D':
+                unstaged_deleted.add(path)
+        elif worktree_status == 'R':
+            modified.append(path)
+            if orig_path:
+                modified.append(orig_path)
+                unstaged_deleted.add(orig_path)
+
+    state = {'staged': staged,
+             'modified': modified,
+             'unmerged': unmerged,
+             'untracked': untracked,
+             'upstream_changed': [],
+             'staged_deleted': staged_deleted,
+             'unstaged_deleted': unstaged_deleted,
+             'submodules': submodules}
+
+    return state, headers
+
+
 def _parse_raw_diff(out):
     while out:
         info, path, out = out.split('\0', 2)
@@ -597,6 +1140,21 @@ def diff_upstream(head):
     return diff_filenames(base, tracked)
 
 
+def upstream_filenames(head, upstream):
+    """Return the paths changed in upstream since it diverged from head
+
+    This is diff_upstream() in a single command: "head...upstream"
+    diffs upstream against the merge-base of head and upstream.
+
+    """
+    status, out, err = git.diff('%s...%s' % (head, upstream),
+                                name_only=True, no_renames=True,
+                                no_ext_diff=True, z=True, _readonly=True)
+    if status != 0:
+        return []
+    return _parse_diff_filenames(out)
+
+
 def _branch_status(branch):
     """
     Returns a tuple of staged, unstaged, untracked, and unmerged files
@@ -638,21 +1196,48 @@ def parse_ls_tree(rev):
 
 
 def ls_tree(path, ref='HEAD'):
-    """Return a parsed git ls-tree result for a single directory"""
+    """Return a parsed git ls-tree result for a single directory
+
+    The tree is read through the persistent "git cat-file --batch"
+    object reader rather than by running "git ls-tree".
+
+    """
+    dirname = path.rstrip('/')
+    if dirname == '.':
+        dirname = ''
+    obj = git.read_object('%s:%s' % (ref, dirname))
+    if obj is None or obj[1] != 'tree':
+        return []
+    if dirname:
+        prefix = dirname + '/'
+    else:
+        prefix = ''
+    oid_size = len(obj[0]) // 2
+    return [(objtype, prefix + name)
+            for (mode, objtype, oid, name) in parse_tree(obj[2], oid_size)]
 
-    result = []
-    status, out, err = git.ls_tree(ref, '--', path, z=True, full_tree=True)
-    if status == 0 and out:
-        for line in out[:-1].split('\0'):
-            # .....6 ...4 ......................................40
-            # 040000 tree c127cde9a0c644a3a8fef449a244f47d5272dfa6	relative
-            # 100644 blob 139e42bf4acaa4927ec9be1ec55a252b97d3f1e2	relative/path
-            # 0..... 7... 12......................................	53
-            # path offset = 6 + 1 + 4 + 1 + 40 + 1 = 53
-            objtype = line[7:11]
-            relpath = line[53:]
-            result.append((objtype, relpath))
 
+def parse_tree(data, oid_size=20):
+    """Parse raw tree object data into (mode, type, oid, name) tuples"""
+    result = []
+    nul = b'\0'
+    space = b' '
+    offset = 0
+    end = len(data)
+    while offset < end:
+        space_idx = data.index(space, offset)
+        nul_idx = data.index(nul, space_idx)
+        mode = core.decode(data[offset:space_idx])
+        name = core.decode(data[space_idx+1:nul_idx])
+        oid = hexlify(data[nul_idx+1:nul_idx+1+oid_size])
+        offset = nul_idx + 1 + oid_size
+        if mode == '40000':
+            objtype = 'tree'
+        elif mode == '160000':
+            objtype = 'commit'
+        else:
+            objtype = 'blob'
+        result.append((mode, objtype, core.decode(oid), name))
     return result
 
 # A regex for matching the output of git(log|rev-list) --pretty=oneline
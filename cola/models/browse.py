@@ -1,5 +1,6 @@
 from __future__ import division, absolute_import, unicode_literals
 import collections
+import threading
 import time
 
 from qtpy import QtCore
@@ -14,7 +15,6 @@ from .. import core
 from .. import icons
 from .. import utils
 from .. import qtutils
-from ..git import STDOUT
 from ..i18n import N_
 from ..models import main
 
@@ -82,6 +82,7 @@ class GitRepoModel(QtGui.QStandardItemModel):
         self._interesting_paths = set()
         self._interesting_files = set()
         self._runtask = qtutils.RunTask(parent=parent)
+        self._last_commits = LastCommits(main.model().git)
 
         self.model_updated.connect(self.refresh, type=Qt.QueuedConnection)
 
@@ -176,11 +177,11 @@ class GitRepoModel(QtGui.QStandardItemModel):
         # Insert directories before file paths
         for dirname in dirs:
             self.add_directory(parent, dirname)
-            self.update_entry(dirname)
 
         for filename in paths:
             self.add_file(parent, filename)
-            self.update_entry(filename)
+
+        self.update_entries(dirs + paths)
 
     def path_is_interesting(self, path):
         """Return True if path has a status."""
@@ -213,8 +214,7 @@ class GitRepoModel(QtGui.QStandardItemModel):
             self.restore.emit()
 
         # Existing items
-        for path in sorted(new_paths.union(old_paths)):
-            self.update_entry(path)
+        self.update_entries(sorted(new_paths.union(old_paths)))
 
         self._interesting_files = new_files
         self._interesting_paths = new_paths
@@ -229,48 +229,122 @@ class GitRepoModel(QtGui.QStandardItemModel):
         self.populate_dir(root, './')
 
     def update_entry(self, path):
-        if self.turbo or path not in self.entries:
-            return  # entry doesn't currently exist
-        task = GitRepoInfoTask(self._parent, path, self.default_author)
+        self.update_entries([path])
+
+    def update_entries(self, paths):
+        """Look up the status and last commit for paths in one task"""
+        if self.turbo:
+            return
+        # Skip entries that don't currently exist
+        paths = [path for path in paths if path in self.entries]
+        if not paths:
+            return
+        task = GitRepoInfoTask(self._parent, paths, self.default_author,
+                               self._last_commits)
         self._runtask.start(task)
 
 
-class GitRepoInfoTask(qtutils.Task):
-    """Handles expensive git lookups for a path."""
+class LastCommits(object):
+    """Caches the last commit that modified each path
 
-    def __init__(self, parent, path, default_author):
-        qtutils.Task.__init__(self, parent)
-        self.path = path
-        self._parent = parent
-        self._default_author = default_author
+    Lookups for many paths are answered by a single "git log --name-only"
+    walk that stops as soon as every path has been seen.  The cache is
+    keyed by the HEAD commit and is dropped when HEAD changes.
+
+    """
+
+    def __init__(self, git):
+        self.git = git
+        self._head = None
         self._data = {}
+        self._lock = threading.Lock()
 
-    def data(self, key):
-        """Return git data for a path
+    def get(self, paths):
+        """Return a dict mapping paths to (date, message, author)
 
-        Supported keys are 'date', 'message', and 'author'
+        Paths that have no history are mapped to None.
 
         """
-        if not self._data:
-            log_line = main.model().git.log('-1', '--', self.path,
-                                            no_color=True,
-                                            pretty=r'format:%ar%x01%s%x01%an',
-                                            _readonly=True
-                                            )[STDOUT]
-            if log_line:
-                log_line = log_line
-                date, message, author = log_line.split(chr(0x01), 2)
-                self._data['date'] = date
-                self._data['message'] = message
-                self._data['author'] = author
-            else:
-                self._data['date'] = self.date()
-                self._data['message'] = '-'
-                self._data['author'] = self._default_author
+        status, head, err = self.git.rev_parse('HEAD', _readonly=True)
+        if status != 0:
+            # Unborn branch; nothing has history yet
+            return dict((path, None) for path in paths)
+
+        with self._lock:
+            if head != self._head:
+                self._head = head
+                self._data = {}
+            result = dict((path, self._data[path]) for path in paths
+                          if path in self._data)
+
+        missing = [path for path in paths if path not in result]
+        if missing:
+            found = self.walk(head, missing)
+            result.update(found)
+            with self._lock:
+                if head == self._head:
+                    self._data.update(found)
 
-        return self._data[key]
+        return result
+
+    def walk(self, head, paths):
+        """Find the last commit for each path with a single history walk"""
+        result = dict((path, None) for path in paths)
+        unresolved = set(paths)
+        # Pathspecs are read from stdin to avoid command-line length limits
+        cmd = ['git', '--literal-pathspecs', 'log', '--stdin',
+               '--no-color', '--no-renames', '--name-only', '-z',
+               '--pretty=format:%x01%ar%x01%s%x01%an']
+        stdin = '\n'.join([head, '--'] + list(paths)) + '\n'
+        proc = core.start_command(cmd, cwd=self.git.getcwd())
+        try:
+            core.xwrite(proc.stdin, stdin)
+            proc.stdin.close()
+            info = None
+            for record in core.read_nul_records(proc.stdout):
+                if record.startswith('\x01'):
+                    meta, _, record = record[1:].partition('\n')
+                    date, meta = meta.split('\x01', 1)
+                    message, author = meta.rsplit('\x01', 1)
+                    info = (date, message, author)
+                if not record or info is None:
+                    continue
+                # A changed file resolves itself and its parent directories
+                while record:
+                    if record in unresolved:
+                        unresolved.remove(record)
+                        result[record] = info
+                    record = utils.dirname(record)
+                if not unresolved:
+                    break
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+            proc.wait()
+        return result
 
-    def date(self):
+
+class GitRepoInfoTask(qtutils.Task):
+    """Handles expensive git lookups for a batch of paths."""
+
+    def __init__(self, parent, paths, default_author, last_commits):
+        qtutils.Task.__init__(self, parent)
+        self.paths = paths
+        self._parent = parent
+        self._default_author = default_author
+        self._last_commits = last_commits
+
+    def data(self, path, last_commit):
+        """Return the (message, author, date) to display for a path"""
+        if last_commit:
+            date, message, author = last_commit
+        else:
+            date = self.date(path)
+            message = '-'
+            author = self._default_author
+        return (message, author, date)
+
+    def date(self, path):
         """Returns a relative date for a file path
 
         This is typically used for new entries that do not have
@@ -278,7 +352,7 @@ class GitRepoInfoTask(qtutils.Task):
 
         """
         try:
-            st = core.stat(self.path)
+            st = core.stat(path)
         except:
             return N_('%d minutes ago') % 0
         elapsed = time.time() - st.st_mtime
@@ -290,20 +364,13 @@ class GitRepoInfoTask(qtutils.Task):
             return N_('%d hours ago') % hours
         return N_('%d days ago') % int(elapsed / 60 / 60 / 24)
 
-    def status(self):
-        """Return the status for the entry's path."""
-
-        model = main.model()
-        unmerged = utils.add_parents(model.unmerged)
-        modified = utils.add_parents(model.modified)
-        staged = utils.add_parents(model.staged)
-        untracked = utils.add_parents(model.untracked)
-        upstream_changed = utils.add_parents(model.upstream_changed)
+    def status(self, path, states):
+        """Return the status for a path."""
+        unmerged, modified, staged, untracked, upstream_changed = states
 
-        path = self.path
         if path in unmerged:
             status = (icons.modified_name(), N_('Unmerged'))
-        elif path in modified and self.path in staged:
+        elif path in modified and path in staged:
             status = (icons.partial_name(), N_('Partially Staged'))
         elif path in modified:
             status = (icons.modified_name(), N_('Modified'))
@@ -319,15 +386,24 @@ class GitRepoInfoTask(qtutils.Task):
 
     def task(self):
         """Perform expensive lookups and post corresponding events."""
-        data = (
-            self.path,
-            self.status(),
-            self.data('message'),
-            self.data('author'),
-            self.data('date'),
+        model = main.model()
+        states = (
+            utils.add_parents(model.unmerged),
+            utils.add_parents(model.modified),
+            utils.add_parents(model.staged),
+            utils.add_parents(model.untracked),
+            utils.add_parents(model.upstream_changed),
         )
+        # Untracked files have no history, so don't walk it looking for them
+        untracked = set(model.untracked)
+        tracked = [path for path in self.paths if path not in untracked]
+        last_commits = self._last_commits.get(tracked)
+
         app = QtWidgets.QApplication.instance()
-        app.postEvent(self._parent, GitRepoInfoEvent(data))
+        for path in self.paths:
+            message, author, date = self.data(path, last_commits.get(path))
+            data = (path, self.status(path, states), message, author, date)
+            app.postEvent(self._parent, GitRepoInfoEvent(data))
 
 
 class GitRepoInfoEvent(QtCore.QEvent):
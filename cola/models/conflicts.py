@@ -0,0 +1,93 @@
+"""Detect unresolved conflict markers in worktree files"""
+from __future__ import division, absolute_import, unicode_literals
+import mmap
+import multiprocessing
+import re
+import threading
+from multiprocessing.pool import ThreadPool
+
+from .. import core
+from ..decorators import memoize
+
+
+# Conflict markers start a line and are followed by a space
+MARKERS = re.compile(br'^(<<<<<<<|\|\|\|\|\|\|\||>>>>>>>) ', re.MULTILINE)
+
+
+def has_markers(path):
+    """Return True if the file at `path` contains conflict markers"""
+    try:
+        with core.xopen(path, 'rb') as fh:
+            try:
+                data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty files cannot be mapped
+                return False
+            try:
+                return MARKERS.search(data) is not None
+            finally:
+                data.close()
+    except (IOError, OSError):
+        # We can't read this file ~ we may be staging a removal
+        return False
+
+
+class ConflictScanner(object):
+    """Scan files for conflict markers using a pool of threads
+
+    Files are memory-mapped and searched as raw bytes.  The verdict for
+    each path is cached along with the file's mtime and size, so files
+    are only scanned again after they change.
+
+    """
+
+    def __init__(self, threads=None):
+        if threads is None:
+            try:
+                threads = multiprocessing.cpu_count()
+            except NotImplementedError:
+                threads = 1
+        self.threads = max(1, min(threads, 8))
+        self.hits = 0
+        self.misses = 0
+        self._verdicts = {}
+        self._lock = threading.Lock()
+
+    def has_conflicts(self, path):
+        """Return True if the file at `path` contains conflict markers"""
+        try:
+            st = core.stat(path)
+            key = (st.st_mtime, st.st_size)
+        except OSError:
+            key = None
+        with self._lock:
+            cached = self._verdicts.get(path)
+            if key is not None and cached is not None and cached[0] == key:
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+        result = has_markers(path)
+        if key is not None:
+            with self._lock:
+                self._verdicts[path] = (key, result)
+        return result
+
+    def scan(self, paths):
+        """Return a dict that maps each path to has_conflicts(path)"""
+        paths = list(paths)
+        if len(paths) < 2 or self.threads == 1:
+            results = [self.has_conflicts(path) for path in paths]
+        else:
+            pool = ThreadPool(min(self.threads, len(paths)))
+            try:
+                results = pool.map(self.has_conflicts, paths)
+            finally:
+                pool.close()
+                pool.join()
+        return dict(zip(paths, results))
+
+
+@memoize
+def conflict_scanner():
+    """Return the conflict scanner singleton"""
+    return ConflictScanner()
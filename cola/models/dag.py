@@ -1,9 +1,14 @@
 from __future__ import division, absolute_import, unicode_literals
+import hashlib
 import json
+import marshal
+import os
+from array import array
 
 from .. import core
 from .. import utils
 from ..git import git
+from ..git import STDOUT
 from ..observable import Observable
 
 # put summary at the end b/c it can contain
@@ -13,33 +18,21 @@ logsep = chr(0x01)
 
 
 class CommitFactory(object):
-    root_generation = 0
-    commits = {}
+    store = None
+
+    @classmethod
+    def from_record(cls, record, labels=()):
+        """Create a commit from a (oid, parents, author, ...) record"""
+        return cls.store.from_record(record, labels=labels)
 
     @classmethod
     def reset(cls):
-        cls.commits.clear()
-        cls.root_generation = 0
+        # Commits handed out earlier keep referring to the previous store
+        cls.store = CommitStore()
 
     @classmethod
     def new(cls, oid=None, log_entry=None):
-        if not oid and log_entry:
-            oid = log_entry[:40]
-        try:
-            commit = cls.commits[oid]
-            if log_entry and not commit.parsed:
-                commit.parse(log_entry)
-            cls.root_generation = max(commit.generation,
-                                      cls.root_generation)
-        except KeyError:
-            commit = Commit(oid=oid,
-                            log_entry=log_entry)
-            if not log_entry:
-                cls.root_generation += 1
-                commit.generation = max(commit.generation,
-                                        cls.root_generation)
-            cls.commits[oid] = commit
-        return commit
+        return cls.store.new(oid=oid, log_entry=log_entry)
 
 
 class DAG(Observable):
@@ -88,65 +81,267 @@ class DAG(Observable):
         return [p for p in all_refs if p and core.exists(p)]
 
 
+#: Marks an unset column, row or edge in the CommitStore arrays
+UNSET = -0x80000000
+
+
+class CommitStore(object):
+    """Columnar storage for the commits shown in the DAG
+
+    Each oid is interned to an integer id that indexes into the per-commit
+    columns.  Parent edges are stored as offsets into a flat array of ids,
+    child edges as append-only chains of ids, and author names and emails
+    are interned into a shared string table.  Commit objects are
+    lightweight views onto a single id.
+
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.oids = []
+        self.summaries = []
+        self.authdates = []
+        self.strings = []
+        self.string_ids = {}
+        self.author_ids = array('i')
+        self.email_ids = array('i')
+        self.generations = array('i')
+        self.columns = array('i')
+        self.rows = array('i')
+        self.parsed = array('b')
+        self.parent_offsets = array('i')
+        self.parent_counts = array('i')
+        self.parent_ids = array('i')
+        self.child_first = array('i')
+        self.child_last = array('i')
+        self.child_counts = array('i')
+        self.edge_child = array('i')
+        self.edge_next = array('i')
+        self.labels = {}
+        self.root_generation = 0
+
+    def __len__(self):
+        return len(self.oids)
+
+    def __contains__(self, oid):
+        return oid in self.ids
+
+    def commit(self, oid):
+        """Return a view onto an existing commit"""
+        return Commit(self, self.ids[oid])
+
+    def intern(self, value):
+        """Return the id of an interned author name or email"""
+        try:
+            return self.string_ids[value]
+        except KeyError:
+            idx = self.string_ids[value] = len(self.strings)
+            self.strings.append(value)
+            return idx
+
+    def add(self, oid):
+        """Allocate an id for an oid whose details are not yet known"""
+        idx = self.ids[oid] = len(self.oids)
+        empty = self.intern('')
+        self.oids.append(oid)
+        self.summaries.append(None)
+        self.authdates.append(None)
+        self.author_ids.append(empty)
+        self.email_ids.append(empty)
+        self.generations.append(self.root_generation)
+        self.columns.append(UNSET)
+        self.rows.append(UNSET)
+        self.parsed.append(0)
+        self.parent_offsets.append(0)
+        self.parent_counts.append(0)
+        self.child_first.append(UNSET)
+        self.child_last.append(UNSET)
+        self.child_counts.append(0)
+        return idx
+
+    def new(self, oid=None, log_entry=None):
+        """Return the commit for an oid or log entry, creating it if needed"""
+        if not oid and log_entry:
+            oid = log_entry[:40]
+        try:
+            commit = Commit(self, self.ids[oid])
+            if log_entry and not commit.parsed:
+                commit.parse(log_entry)
+            self.root_generation = max(commit.generation,
+                                       self.root_generation)
+        except KeyError:
+            commit = Commit(self, self.add(oid))
+            if log_entry:
+                commit.parse(log_entry)
+            else:
+                self.root_generation += 1
+                commit.generation = max(commit.generation,
+                                        self.root_generation)
+        return commit
+
+    def from_record(self, record, labels=()):
+        """Create a commit from a (oid, parents, author, ...) record"""
+        oid, parent_oids, author, authdate, email, summary = record
+        try:
+            commit = Commit(self, self.ids[oid])
+        except KeyError:
+            commit = Commit(self, self.add(oid))
+        if not commit.parsed:
+            commit.set_details(parent_oids, author, authdate, email, summary)
+        self.root_generation = max(commit.generation, self.root_generation)
+        for label in labels:
+            commit.add_label(label)
+        return commit
+
+    def set_details(self, idx, parent_oids, author, authdate, email, summary):
+        """Record the details and parent edges of a commit"""
+        self.summaries[idx] = summary or ''
+        self.authdates[idx] = authdate or ''
+        self.author_ids[idx] = self.intern(author or '')
+        self.email_ids[idx] = self.intern(email or '')
+
+        parent_ids = self.parent_ids
+        self.parent_offsets[idx] = len(parent_ids)
+        self.parent_counts[idx] = len(parent_oids)
+        generations = self.generations
+        generation = None
+        for parent_oid in parent_oids:
+            parent_idx = self.new(oid=parent_oid).idx
+            parent_ids.append(parent_idx)
+            self.add_child(parent_idx, idx)
+            parent_generation = generations[parent_idx] + 1
+            if generation is None or parent_generation > generation:
+                generation = parent_generation
+        if generation is not None:
+            generations[idx] = generation
+        self.parsed[idx] = 1
+
+    def add_child(self, idx, child_idx):
+        """Append a child edge, preserving the order in which they arrive"""
+        edge = len(self.edge_child)
+        self.edge_child.append(child_idx)
+        self.edge_next.append(UNSET)
+        last = self.child_last[idx]
+        if last == UNSET:
+            self.child_first[idx] = edge
+        else:
+            self.edge_next[last] = edge
+        self.child_last[idx] = edge
+        self.child_counts[idx] += 1
+
+    def parents(self, idx):
+        """Return the ids of a commit's parents"""
+        offset = self.parent_offsets[idx]
+        return self.parent_ids[offset:offset+self.parent_counts[idx]]
+
+    def children(self, idx):
+        """Return the ids of a commit's children"""
+        result = []
+        edge = self.child_first[idx]
+        edge_child = self.edge_child
+        edge_next = self.edge_next
+        while edge != UNSET:
+            result.append(edge_child[edge])
+            edge = edge_next[edge]
+        return result
+
+
+def _get_position(values):
+    def getter(self):
+        value = getattr(self._store, values)[self._idx]
+        if value == UNSET:
+            value = None
+        return value
+
+    def setter(self, value):
+        if value is None:
+            value = UNSET
+        getattr(self._store, values)[self._idx] = value
+
+    return property(getter, setter)
+
+
 class Commit(object):
-    root_generation = 0
-
-    __slots__ = ('oid',
-                 'summary',
-                 'parents',
-                 'children',
-                 'tags',
-                 'author',
-                 'authdate',
-                 'email',
-                 'generation',
-                 'column',
-                 'row',
-                 'parsed')
-
-    def __init__(self, oid=None, log_entry=None):
-        self.oid = oid
-        self.summary = None
-        self.parents = []
-        self.children = []
-        self.tags = set()
-        self.email = None
-        self.author = None
-        self.authdate = None
-        self.parsed = False
-        self.generation = CommitFactory.root_generation
-        self.column = None
-        self.row = None
-        if log_entry:
-            self.parse(log_entry)
+    """A view onto a single commit in a CommitStore"""
+
+    __slots__ = ('_store', '_idx')
+
+    def __init__(self, store, idx):
+        self._store = store
+        self._idx = idx
+
+    store = property(lambda self: self._store)
+    idx = property(lambda self: self._idx)
+    oid = property(lambda self: self._store.oids[self._idx])
+    summary = property(lambda self: self._store.summaries[self._idx])
+    authdate = property(lambda self: self._store.authdates[self._idx])
+    parsed = property(lambda self: bool(self._store.parsed[self._idx]))
+    column = _get_position('columns')
+    row = _get_position('rows')
+
+    @property
+    def author(self):
+        store = self._store
+        return store.strings[store.author_ids[self._idx]]
+
+    @property
+    def email(self):
+        store = self._store
+        return store.strings[store.email_ids[self._idx]]
+
+    def _get_generation(self):
+        return self._store.generations[self._idx]
+
+    def _set_generation(self, generation):
+        self._store.generations[self._idx] = generation
+
+    generation = property(_get_generation, _set_generation)
+
+    @property
+    def parents(self):
+        store = self._store
+        return [Commit(store, idx) for idx in store.parents(self._idx)]
+
+    @property
+    def children(self):
+        store = self._store
+        return [Commit(store, idx) for idx in store.children(self._idx)]
+
+    @property
+    def tags(self):
+        return self._store.labels.get(self._idx, frozenset())
+
+    def __eq__(self, other):
+        return (isinstance(other, Commit) and
+                self._store is other._store and self._idx == other._idx)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._idx)
 
     def parse(self, log_entry, sep=logsep):
-        self.oid = log_entry[:40]
         after_oid = log_entry[41:]
         details = after_oid.split(sep, 5)
         (parents, tags, author, authdate, email, summary) = details
 
-        self.summary = summary and summary or ''
-        self.author = author and author or ''
-        self.authdate = authdate or ''
-        self.email = email and email or ''
-
         if parents:
-            generation = None
-            for parent_oid in parents.split(' '):
-                parent = CommitFactory.new(oid=parent_oid)
-                parent.children.append(self)
-                if generation is None:
-                    generation = parent.generation+1
-                self.parents.append(parent)
-                generation = max(parent.generation+1, generation)
-            self.generation = generation
+            parent_oids = parents.split(' ')
+        else:
+            parent_oids = []
+        self.set_details(parent_oids, author, authdate, email, summary)
 
         if tags:
             for tag in tags[2:-1].split(', '):
                 self.add_label(tag)
 
-        self.parsed = True
+        return self
+
+    def set_details(self, parent_oids, author, authdate, email, summary):
+        """Populate the commit from already-parsed fields"""
+        self._store.set_details(self._idx, parent_oids,
+                                author, authdate, email, summary)
         return self
 
     def add_label(self, tag):
@@ -193,10 +388,13 @@ class Commit(object):
 
         head_arrow = 'HEAD -> '
         if tag.startswith(head_arrow):
-            self.tags.add('HEAD')
+            self._add_tag('HEAD')
             self.add_label(tag[len(head_arrow):])
         else:
-            self.tags.add(tag)
+            self._add_tag(tag)
+
+    def _add_tag(self, tag):
+        self._store.labels.setdefault(self._idx, set()).add(tag)
 
     def __str__(self):
         return self.oid
@@ -208,7 +406,7 @@ class Commit(object):
             'author': self.author,
             'authdate': self.authdate,
             'parents': [p.oid for p in self.parents],
-            'tags': self.tags,
+            'tags': sorted(self.tags),
         }
 
     def __repr__(self):
@@ -216,11 +414,157 @@ class Commit(object):
 
     def is_fork(self):
         ''' Returns True if the node is a fork'''
-        return len(self.children) > 1
+        return self._store.child_counts[self._idx] > 1
 
     def is_merge(self):
         ''' Returns True if the node is a fork'''
-        return len(self.parents) > 1
+        return self._store.parent_counts[self._idx] > 1
+
+
+#: Revision options that select commits without filtering them
+CACHEABLE_OPTIONS = frozenset(('--all', '--branches', '--remotes', '--tags'))
+
+
+def _array_to_bytes(values):
+    try:
+        return values.tobytes()
+    except AttributeError:
+        return values.tostring()  # Python 2
+
+
+def _array_from_bytes(typecode, data):
+    values = array(typecode)
+    try:
+        values.frombytes(data)
+    except AttributeError:
+        values.fromstring(data)  # Python 2
+    return values
+
+
+class CommitCache(object):
+    """On-disk cache of the commit records read by RepoReader
+
+    Records are stored under .git/cola/dag/ in a compact, columnar layout:
+    commits are identified by their index into an oid table, parent links
+    are a flat array of indexes with per-commit offsets, and author names
+    and emails are interned.  Each cache file is keyed by the ref arguments
+    and count, and remembers the ref tips it was built from so that later
+    reads only need to visit commits that are not yet in the cache.
+
+    """
+    version = 1
+
+    def __init__(self, ref, count, git=git):
+        key = '%s\0%d' % (ref, count)
+        digest = hashlib.sha1(core.encode(key)).hexdigest()
+        self.path = git.git_path('cola', 'dag', digest)
+
+    def load(self):
+        """Return (tips, records) from the cache, or None"""
+        if not self.path or not core.exists(self.path):
+            return None
+        try:
+            with core.xopen(self.path, 'rb') as fh:
+                data = marshal.loads(fh.read())
+            return self._decode(data)
+        except Exception:
+            # Unreadable, truncated, or written by another Python version
+            return None
+
+    def save(self, tips, records):
+        """Write (oid, parents, author, authdate, email, summary) records"""
+        if not self.path:
+            return
+        tmp_path = self.path + '.tmp'
+        try:
+            dirname = os.path.dirname(self.path)
+            if not core.isdir(dirname):
+                core.makedirs(dirname)
+            with core.xopen(tmp_path, 'wb') as fh:
+                fh.write(marshal.dumps(self._encode(tips, records)))
+            try:
+                os.rename(core.mkpath(tmp_path), core.mkpath(self.path))
+            except OSError:
+                # Windows cannot rename over an existing file
+                core.unlink(self.path)
+                os.rename(core.mkpath(tmp_path), core.mkpath(self.path))
+        except (IOError, OSError):
+            pass
+
+    def _encode(self, tips, records):
+        oids = []
+        oid_index = {}
+        for record in records:
+            oid_index[record[0]] = len(oids)
+            oids.append(record[0])
+
+        parent_offsets = array('i', [0])
+        parent_ids = array('i')
+        strings = []
+        string_index = {}
+        author_ids = array('i')
+        email_ids = array('i')
+        authdates = []
+        summaries = []
+
+        def intern(value):
+            try:
+                return string_index[value]
+            except KeyError:
+                idx = string_index[value] = len(strings)
+                strings.append(value)
+                return idx
+
+        for oid, parents, author, authdate, email, summary in records:
+            for parent in parents:
+                try:
+                    parent_id = oid_index[parent]
+                except KeyError:
+                    # Parents outside of the --max-count window
+                    parent_id = oid_index[parent] = len(oids)
+                    oids.append(parent)
+                parent_ids.append(parent_id)
+            parent_offsets.append(len(parent_ids))
+            author_ids.append(intern(author))
+            email_ids.append(intern(email))
+            authdates.append(authdate)
+            summaries.append(summary)
+
+        if oids:
+            oid_size = len(oids[0])
+        else:
+            oid_size = 40
+        return (self.version,
+                list(tips[0]), list(tips[1]),
+                oid_size, ''.join(oids),
+                _array_to_bytes(parent_offsets), _array_to_bytes(parent_ids),
+                strings,
+                _array_to_bytes(author_ids), _array_to_bytes(email_ids),
+                authdates, summaries)
+
+    def _decode(self, data):
+        (version, positives, negatives, oid_size, oid_table,
+         parent_offsets, parent_ids, strings,
+         author_ids, email_ids, authdates, summaries) = data
+        if version != self.version:
+            return None
+        parent_offsets = _array_from_bytes('i', parent_offsets)
+        parent_ids = _array_from_bytes('i', parent_ids)
+        author_ids = _array_from_bytes('i', author_ids)
+        email_ids = _array_from_bytes('i', email_ids)
+
+        def oid(idx):
+            start = idx * oid_size
+            return oid_table[start:start+oid_size]
+
+        records = []
+        for idx in range(len(summaries)):
+            parents = [oid(parent_id) for parent_id in
+                       parent_ids[parent_offsets[idx]:parent_offsets[idx+1]]]
+            records.append((oid(idx), parents,
+                            strings[author_ids[idx]], authdates[idx],
+                            strings[email_ids[idx]], summaries[idx]))
+        return ((positives, negatives), records)
 
 
 class RepoReader(object):
@@ -229,7 +573,7 @@ class RepoReader(object):
         self.ctx = ctx
         self.git = git
         self._proc = None
-        self._objects = {}
+        self._store = CommitFactory.store
         self._cmd = ['git', 'log',
                      '--topo-order',
                      '--reverse',
@@ -239,8 +583,13 @@ class RepoReader(object):
         """Indicates that all data has been read"""
         self._idx = -1
         """Index into the cached commits"""
-        self._topo_list = []
-        """List of commits objects in topological order"""
+        self._topo_list = array('i')
+        """Commit ids in topological order"""
+        self._cache = None
+        """On-disk commit cache, when the ref arguments allow caching"""
+        self._tips = None
+        """(positive, negative) oids that the ref arguments resolve to"""
+        self.returncode = 0
 
     cached = property(lambda self: self._cached)
     """Return True when no commits remain to be read"""
@@ -251,7 +600,7 @@ class RepoReader(object):
     def reset(self):
         CommitFactory.reset()
         if self._proc:
-            self._topo_list = []
+            self._topo_list = array('i')
             self._proc.kill()
         self._proc = None
         self._cached = False
@@ -266,16 +615,19 @@ class RepoReader(object):
         if self._cached:
             try:
                 self._idx += 1
-                return self._topo_list[self._idx]
+                return Commit(self._store, self._topo_list[self._idx])
             except IndexError:
                 self._idx = -1
                 raise StopIteration
 
         if self._proc is None:
             ref_args = utils.shell_split(self.ctx.ref)
+            self._store = CommitFactory.store
+            self._topo_list = array('i')
+            if self._read_cache(ref_args):
+                return self.next()
             cmd = self._cmd + ['-%d' % self.ctx.count] + ref_args
             self._proc = core.start_command(cmd)
-            self._topo_list = []
 
         log_entry = core.readline(self._proc.stdout).rstrip()
         if not log_entry:
@@ -283,21 +635,184 @@ class RepoReader(object):
             self._proc.wait()
             self.returncode = self._proc.returncode
             self._proc = None
+            if self.returncode == 0 and self._cache is not None:
+                self._cache.save(self._tips, self._records())
             raise StopIteration
 
+        store = self._store
         oid = log_entry[:40]
         try:
-            return self._objects[oid]
+            idx = store.ids[oid]
+            if store.parsed[idx]:
+                return Commit(store, idx)
         except KeyError:
-            c = CommitFactory.new(log_entry=log_entry)
-            self._objects[c.oid] = c
-            self._topo_list.append(c)
-            return c
+            pass
+        c = store.new(log_entry=log_entry)
+        self._topo_list.append(c.idx)
+        return c
 
     __next__ = next  # for Python 3
 
     def __getitem__(self, oid):
-        return self._objects[oid]
+        store = self._store
+        idx = store.ids[oid]
+        if not store.parsed[idx]:
+            raise KeyError(oid)
+        return Commit(store, idx)
 
     def items(self):
-        return self._objects.items()
+        store = self._store
+        return [(store.oids[idx], Commit(store, idx))
+                for idx in self._topo_list]
+
+    def _resolve_tips(self, ref_args):
+        """Resolve ref arguments into (positive, negative) oid lists
+
+        None is returned when the arguments do more than name revisions,
+        e.g. when they limit the history to paths or authors.
+
+        """
+        if '--' in ref_args:
+            idx = ref_args.index('--')
+            if ref_args[idx+1:]:
+                return None
+            ref_args = ref_args[:idx]
+        for arg in ref_args:
+            if arg.startswith('-') and arg not in CACHEABLE_OPTIONS:
+                return None
+        if '--all' in ref_args:
+            # "git log --all" includes a detached HEAD
+            ref_args = ref_args + ['HEAD']
+        # The trailing "--" makes rev-parse reject anything but revisions
+        status, out, err = self.git.rev_parse(_readonly=True,
+                                              *(ref_args + ['--']))
+        if status != 0:
+            return None
+        positives = set()
+        negatives = set()
+        for line in out.splitlines():
+            if line.startswith('^'):
+                negatives.add(line)
+            elif line and line != '--':
+                positives.add(line)
+        if not positives:
+            return None
+        return (sorted(positives), sorted(negatives))
+
+    def _read_cache(self, ref_args):
+        """Populate the topo list from the on-disk cache
+
+        Commits that are not yet in the cache are read with "git log",
+        and the cache is updated.  Returns False when the caller should
+        read all commits with "git log" instead.
+
+        """
+        self._tips = self._resolve_tips(ref_args)
+        if self._tips is None:
+            self._cache = None
+            return False
+        self._cache = CommitCache(self.ctx.ref, self.ctx.count, git=self.git)
+        cached = self._cache.load()
+        if cached is None:
+            return False
+        (old_positives, old_negatives), records = cached
+        positives, negatives = self._tips
+        if old_negatives != negatives:
+            return False
+        if old_positives != positives:
+            # The cache can be extended when the old tips are still
+            # reachable from the new ones.
+            status, out, err = self.git.rev_list(
+                    '-1', _readonly=True,
+                    *(old_positives + ['--not'] + positives))
+            if status != 0 or out:
+                return False
+            new_records = self._read_new_records(old_positives)
+            if new_records is None:
+                return False
+            known = set(record[0] for record in records)
+            records.extend([r for r in new_records if r[0] not in known])
+            records = records[-self.ctx.count:]
+
+        labels = self._labels()
+        store = self._store
+        topo_list = self._topo_list
+        for record in records:
+            commit = store.from_record(
+                    record, labels=labels.get(record[0], ()))
+            topo_list.append(commit.idx)
+
+        if old_positives != positives:
+            self._cache.save(self._tips, records)
+
+        self.returncode = 0
+        self._cached = True
+        return True
+
+    def _read_new_records(self, old_positives):
+        """Read records for commits that are not reachable from the cache"""
+        positives, negatives = self._tips
+        args = (['-%d' % self.ctx.count] + positives + negatives +
+                ['--not'] + old_positives)
+        status, out, err = self.git.log(
+                topo_order=True, reverse=True, pretty=logfmt,
+                _readonly=True, *args)
+        if status != 0:
+            return None
+        records = []
+        for log_entry in out.splitlines():
+            if not log_entry:
+                continue
+            oid = log_entry[:40]
+            (parents, tags, author, authdate, email,
+             summary) = log_entry[41:].split(logsep, 5)
+            if parents:
+                parent_oids = parents.split(' ')
+            else:
+                parent_oids = []
+            records.append((oid, parent_oids, author, authdate, email,
+                            summary))
+        return records
+
+    def _labels(self):
+        """Return a dict mapping oids to "git log --decorate=full" labels"""
+        labels = {}
+        fmt = '%(objectname)%01%(*objectname)%01%(refname)'
+        status, out, err = self.git.for_each_ref(format=fmt, _readonly=True)
+        for line in out.splitlines():
+            try:
+                oid, peeled, refname = line.split(logsep, 2)
+            except ValueError:
+                continue
+            oid = peeled or oid
+            if refname.startswith('refs/tags/'):
+                refname = 'tag: ' + refname
+            labels.setdefault(oid, []).append(refname)
+
+        head_oid = self.git.rev_parse('HEAD', _readonly=True)[STDOUT]
+        if head_oid:
+            status, head_ref, err = self.git.symbolic_ref(
+                    'HEAD', q=True, _readonly=True)
+            if status == 0 and head_ref:
+                head_labels = labels.setdefault(head_oid, [])
+                try:
+                    head_labels.remove(head_ref)
+                except ValueError:
+                    pass
+                head_labels.append('HEAD -> ' + head_ref)
+            else:
+                labels.setdefault(head_oid, []).append('HEAD')
+        return labels
+
+    def _records(self):
+        """Return cacheable records for the commits that were read"""
+        store = self._store
+        strings = store.strings
+        oids = store.oids
+        return [(oids[idx], [oids[p] for p in store.parents(idx)],
+                 strings[store.author_ids[idx]], store.authdates[idx],
+                 strings[store.email_ids[idx]], store.summaries[idx])
+                for idx in self._topo_list]
+
+
+CommitFactory.reset()
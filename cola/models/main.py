@@ -3,10 +3,12 @@
 """
 from __future__ import division, absolute_import, unicode_literals
 
-import copy
+import bisect
 import os
+import threading
 
 from .. import core
+from .. import diffparse
 from .. import git
 from .. import gitcmds
 from .. import gitcfg
@@ -18,18 +20,161 @@ from ..models import prefs
 from ..compat import ustr
 
 
+#: Refresh the worktree and index state
+REFRESH_FILES = 1
+#: Refresh branches, tags, HEAD and merge/rebase state
+REFRESH_REFS = 2
+#: Re-read the git config and the remotes defined there
+REFRESH_CONFIG = 4
+#: Refresh the worktree and index state of specific paths only
+REFRESH_PATHS = 8
+#: Everything that update_status() refreshes
+REFRESH_STATUS = REFRESH_FILES | REFRESH_REFS
+
+
 @memoize
 def model():
     """Returns the main model singleton"""
     return MainModel()
 
 
+class RefreshScheduler(object):
+    """Coalesces requests to refresh the main model
+
+    Filesystem events and commands request refreshes of the parts of the
+    model that they affect.  Deferred requests are merged until flush() is
+    called, typically by a debounce timer installed by the application,
+    and flush() refreshes the union of what was requested.  A refresh that
+    runs immediately drops the pending requests that it covers, and a
+    deferred refresh is dropped when a newer request arrives while it is
+    reading the worktree.  The number of refreshes avoided is counted in
+    "skipped".  Path-scoped requests accumulate their paths until they are
+    flushed, and a full REFRESH_FILES refresh absorbs them.
+
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.schedule = None
+        """Called to (re)start the debounce timer; None flushes at once"""
+        self.requested = 0
+        self.performed = 0
+        self.skipped = 0
+        self._pending = 0
+        self._pending_update_index = False
+        self._pending_paths = set()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def request(self, kinds, update_index=False, paths=None):
+        """Request a deferred refresh of the given REFRESH_* kinds
+
+        REFRESH_PATHS requests refresh the worktree state of `paths`.
+
+        """
+        with self._lock:
+            self.requested += 1
+            if self._pending:
+                self.skipped += 1
+            if kinds & REFRESH_PATHS:
+                self._pending_paths.update(paths or ())
+            self._pending |= kinds
+            self._pending_update_index |= update_index
+            self._generation += 1
+        if self.schedule is None:
+            self.flush()
+        else:
+            self.schedule()
+
+    def run(self, kinds, update_index=False, paths=None):
+        """Refresh immediately, absorbing the pending requests it covers"""
+        with self._lock:
+            self.requested += 1
+            self._generation += 1
+            pending = self._pending
+            if pending:
+                if kinds & REFRESH_FILES:
+                    update_index |= self._pending_update_index
+                    self._pending_update_index = False
+                    self._pending_paths = set()
+                    kinds |= REFRESH_PATHS
+                elif kinds & REFRESH_PATHS:
+                    update_index |= self._pending_update_index
+                    paths = self._pending_paths.union(paths or ())
+                    self._pending_paths = set()
+                self._pending = pending & ~kinds
+                if not self._pending:
+                    self.skipped += 1
+        self._refresh(kinds, update_index, None, paths=paths)
+
+    def flush(self):
+        """Perform the pending refresh, if any; returns the kinds refreshed"""
+        with self._lock:
+            kinds = self._pending
+            update_index = self._pending_update_index
+            paths = self._pending_paths
+            generation = self._generation
+            self._pending = 0
+            self._pending_update_index = False
+            self._pending_paths = set()
+        if kinds & REFRESH_FILES:
+            kinds &= ~REFRESH_PATHS
+        if kinds:
+            self._refresh(kinds, update_index, generation, paths=paths)
+        return kinds
+
+    def stale(self, generation, kinds):
+        """Has a newer request for any of the kinds arrived?"""
+        if generation is None:
+            return False
+        with self._lock:
+            return generation != self._generation and self._pending & kinds
+
+    def _refresh(self, kinds, update_index, generation, paths=None):
+        if self.model.refresh(kinds, update_index=update_index,
+                              generation=generation, paths=paths):
+            with self._lock:
+                self.performed += 1
+        else:
+            with self._lock:
+                self.skipped += 1
+
+    def stats(self):
+        """Return a dict of request, refresh and skip counts"""
+        with self._lock:
+            return {
+                'requested': self.requested,
+                'performed': self.performed,
+                'skipped': self.skipped,
+            }
+
+
+def merge_sorted_paths(items, paths, updated):
+    """Replace the entries for `paths` in a sorted list of paths
+
+    Entries for `paths` are removed from a copy of `items` and the
+    entries of `updated` that belong to `paths` are inserted in order.
+
+    """
+    result = list(items)
+    for path in paths:
+        idx = bisect.bisect_left(result, path)
+        if idx < len(result) and result[idx] == path:
+            del result[idx]
+    wanted = set(paths)
+    for path in updated:
+        if path in wanted:
+            bisect.insort(result, path)
+    return result
+
+
 class MainModel(Observable):
     """Provides a friendly wrapper for doing common git operations."""
 
     # Observable messages
     message_about_to_update = 'about_to_update'
     message_commit_message_changed = 'commit_message_changed'
+    message_diff_text_appended = 'diff_text_appended'
     message_diff_text_changed = 'diff_text_changed'
     message_filename_changed = 'filename_changed'
     message_mode_about_to_change = 'mode_about_to_change'
@@ -69,6 +214,8 @@ class MainModel(Observable):
         self.initialized = False
         self.head = 'HEAD'
         self.diff_text = ''
+        self.diff_stream = None
+        self._diff_parser = None
         self.mode = self.mode_none
         self.filename = None
         self.is_merging = False
@@ -95,6 +242,10 @@ class MainModel(Observable):
         self.local_branches = []
         self.remote_branches = []
         self.tags = []
+        # Bumped when the ref names change; see gitcmds.RefCache
+        self.refs_generation = 0
+        self.refs_delta = {}
+        self.scheduler = RefreshScheduler(self)
         if cwd:
             self.set_worktree(cwd)
 
@@ -143,10 +294,50 @@ class MainModel(Observable):
             pass
         return path
 
-    def set_diff_text(self, txt):
+    def set_diff_text(self, txt, stream=None):
+        """Set the diff text, with an optional stream for the rest of it"""
+        if self.diff_stream is not None and self.diff_stream is not stream:
+            self.diff_stream.close()
+        if stream is not None and stream.exhausted:
+            stream = None
+        self.diff_stream = stream
         self.diff_text = txt
+        self._diff_parser = None
         self.notify_observers(self.message_diff_text_changed, txt)
 
+    def has_more_diff(self):
+        """Is there more of a truncated diff left to load?"""
+        return self.diff_stream is not None
+
+    def load_more_diff(self):
+        """Append the next batch of a truncated diff to the diff text"""
+        stream = self.diff_stream
+        if stream is None:
+            return
+        txt = stream.read(max_lines=prefs.max_diff_lines(),
+                          max_size=prefs.max_diff_size())
+        if stream.exhausted:
+            self.diff_stream = None
+        if self.diff_text and txt:
+            self.diff_text += '\n' + txt
+        else:
+            self.diff_text += txt
+        self._diff_parser = None
+        self.notify_observers(self.message_diff_text_appended, txt)
+
+    def diff_parser(self):
+        """Return a DiffParser for the current diff
+
+        The parser and its hunk index are built once per diff and reused
+        when lines are staged or unstaged repeatedly.
+
+        """
+        parser = self._diff_parser
+        if parser is None or parser.filename != self.filename:
+            parser = diffparse.DiffParser(self.filename, self.diff_text)
+            self._diff_parser = parser
+        return parser
+
     def set_directory(self, path):
         self.directory = path
 
@@ -185,28 +376,106 @@ class MainModel(Observable):
         self.update_file_status()
 
     def update_file_status(self, update_index=False):
-        self.notify_observers(self.message_about_to_update)
-        self._update_files(update_index=update_index)
-        self.notify_observers(self.message_updated)
+        self.scheduler.run(REFRESH_FILES, update_index=update_index)
 
     def update_status(self, update_index=False):
+        self.scheduler.run(REFRESH_STATUS, update_index=update_index)
+
+    def update_paths_status(self, paths, update_index=False):
+        """Refresh the state of the given paths immediately"""
+        self.scheduler.run(REFRESH_PATHS, update_index=update_index,
+                           paths=paths)
+
+    def request_refresh(self, kinds=REFRESH_STATUS, update_index=False,
+                        paths=None):
+        """Refresh the model once the current burst of requests settles"""
+        self.scheduler.request(kinds, update_index=update_index, paths=paths)
+
+    def request_refresh_paths(self, paths):
+        """Refresh the state of the given worktree-relative paths"""
+        self.request_refresh(REFRESH_PATHS, paths=paths)
+
+    def refresh(self, kinds, update_index=False, generation=None,
+                paths=None):
+        """Refresh the REFRESH_* kinds of state
+
+        Returns False when the refresh was dropped because a newer request
+        made it stale.  When a newer request only covers the worktree state,
+        the other kinds are still refreshed.  Use update_status() or
+        request_refresh() instead of calling this directly so that requests
+        are coalesced.
+
+        """
         # Give observers a chance to respond
         self.notify_observers(self.message_about_to_update)
-        self.initialized = True
-        self._update_merge_rebase_status()
-        self._update_files(update_index=update_index)
-        self._update_remotes()
-        self._update_branches_and_tags()
-        self._update_branch_heads()
-        self._update_commitmsg()
+        if kinds & REFRESH_REFS:
+            # HEAD may have moved, which changes staged diffs
+            gitcmds.diff_cache().invalidate()
+            self.initialized = True
+            self._update_merge_rebase_status()
+        if kinds & REFRESH_CONFIG:
+            gitcfg.current().reset()
+        stale = False
+        if kinds & REFRESH_FILES:
+            state = self._read_files(update_index=update_index)
+            # A newer request will read the worktree again
+            stale = self.scheduler.stale(generation, REFRESH_FILES)
+            if not stale:
+                self._set_files(state)
+        elif kinds & REFRESH_PATHS and paths:
+            state = self._read_paths(paths, update_index=update_index)
+            stale = self.scheduler.stale(generation, REFRESH_FILES)
+            if not stale:
+                self._set_files(state)
+        if stale and not kinds & ~(REFRESH_FILES | REFRESH_PATHS):
+            return False
+        if kinds & (REFRESH_REFS | REFRESH_CONFIG):
+            self._update_remotes()
+        if kinds & REFRESH_REFS:
+            self._update_branches_and_tags()
+            self._update_branch_heads()
+            self._update_commitmsg()
         self.notify_observers(self.message_updated)
+        return True
 
     def _update_files(self, update_index=False):
+        self._set_files(self._read_files(update_index=update_index))
+
+    def _read_files(self, update_index=False):
+        display_untracked = prefs.display_untracked()
+        return gitcmds.worktree_state(head=self.head,
+                                      update_index=update_index,
+                                      display_untracked=display_untracked,
+                                      paths=self.filter_paths)
+
+    def _read_paths(self, paths, update_index=False):
+        """Read the state of `paths` and merge it into the current state
+
+        Only the given paths are passed to "git status", so the cost
+        follows the number of changed paths rather than the worktree size.
+
+        """
+        if self.filter_paths:
+            # Paths outside of the filter must not be added
+            return self._read_files(update_index=update_index)
+        paths = sorted(set(paths))
         display_untracked = prefs.display_untracked()
-        state = gitcmds.worktree_state(head=self.head,
-                                       update_index=update_index,
-                                       display_untracked=display_untracked,
-                                       paths=self.filter_paths)
+        pathspecs = [':(literal)' + path for path in paths]
+        update = gitcmds.worktree_state(head=self.head,
+                                        update_index=update_index,
+                                        display_untracked=display_untracked,
+                                        paths=pathspecs)
+        state = {'upstream_changed': self.upstream_changed}
+        for key in ('staged', 'modified', 'unmerged', 'untracked'):
+            state[key] = merge_sorted_paths(getattr(self, key), paths,
+                                            update.get(key, []))
+        for key in ('staged_deleted', 'unstaged_deleted', 'submodules'):
+            current = getattr(self, key)
+            state[key] = ((current - set(paths)) |
+                          (update.get(key, set()) & set(paths)))
+        return state
+
+    def _set_files(self, state):
         self.staged = state.get('staged', [])
         self.modified = state.get('modified', [])
         self.unmerged = state.get('unmerged', [])
@@ -216,6 +485,12 @@ class MainModel(Observable):
         self.unstaged_deleted = state.get('unstaged_deleted', set())
         self.submodules = state.get('submodules', set())
 
+        cfg = gitcfg.current()
+        if cfg.is_per_file_attrs_enabled():
+            # Resolve the encodings of the visible paths in a single call
+            cfg.file_encodings(self.staged + self.modified +
+                               self.unmerged + self.untracked)
+
         sel = selection_model()
         if self.is_empty():
             sel.reset()
@@ -239,10 +514,13 @@ class MainModel(Observable):
         self.currentbranch = gitcmds.current_branch()
 
     def _update_branches_and_tags(self):
-        local_branches, remote_branches, tags = gitcmds.all_refs(split=True)
-        self.local_branches = local_branches
-        self.remote_branches = remote_branches
-        self.tags = tags
+        refs = gitcmds.ref_cache()
+        refs.update(git=self.git)
+        self.local_branches = refs.local_branches
+        self.remote_branches = refs.remote_branches
+        self.tags = refs.tags
+        self.refs_generation = refs.generation
+        self.refs_delta = refs.delta
 
     def _update_merge_rebase_status(self):
         merge_head = self.git.git_path('MERGE_HEAD')
@@ -290,70 +568,45 @@ class MainModel(Observable):
         self.notify_observers(self.message_updated)
         return status, out, err
 
-    def _sliced_op(self, input_items, map_fn):
-        """Slice input_items and call map_fn over every slice
+    def _add_paths(self, paths):
+        """Stage paths using one git command for files and one for directories
 
-        This exists because of "errno: Argument list too long"
+        Files, including deleted files, are streamed to "git update-index"
+        so that the number of paths is not limited by the size of argv.
 
         """
-        # This comment appeared near the top of include/linux/binfmts.h
-        # in the Linux source tree:
-        #
-        # /*
-        #  * MAX_ARG_PAGES defines the number of pages allocated for arguments
-        #  * and envelope for the new program. 32 should suffice, this gives
-        #  * a maximum env+arg of 128kB w/4KB pages!
-        #  */
-        # #define MAX_ARG_PAGES 32
-        #
-        # 'size' is a heuristic to keep things highly performant by minimizing
-        # the number of slices.  If we wanted it to run as few commands as
-        # possible we could call "getconf ARG_MAX" and make a better guess,
-        # but it's probably not worth the complexity (and the extra call to
-        # getconf that we can't do on Windows anyways).
-        #
-        # In my testing, getconf ARG_MAX on Mac OS X Mountain Lion reported
-        # 262144 and Debian/Linux-x86_64 reported 2097152.
-        #
-        # The hard-coded max_arg_len value is safely below both of these
-        # real-world values.
-
-        max_arg_len = 32 * 4 * 1024
-        avg_filename_len = 300
-        size = max_arg_len // avg_filename_len
-
+        files = []
+        dirs = []
+        for path in paths:
+            if core.isdir(path):
+                dirs.append(path.rstrip('/'))
+            else:
+                files.append(path)
         status = 0
         outs = []
         errs = []
-
-        items = copy.copy(input_items)
-        while items:
-            stat, out, err = map_fn(items[:size])
+        for fn, items in ((gitcmds.update_index_paths, files),
+                          (gitcmds.add_paths, dirs)):
+            if not items:
+                continue
+            stat, out, err = fn(items, git=self.git)
             status = max(stat, status)
             outs.append(out)
             errs.append(err)
-            items = items[size:]
-
         return (status, '\n'.join(outs), '\n'.join(errs))
 
-    def _sliced_add(self, items):
-        add = self.git.add
-        return self._sliced_op(
-                items, lambda x: add('--', force=True, verbose=True, *x))
-
     def stage_modified(self):
-        status, out, err = self._sliced_add(self.modified)
+        status, out, err = self._add_paths(self.modified)
         self.update_file_status()
         return (status, out, err)
 
     def stage_untracked(self):
-        status, out, err = self._sliced_add(self.untracked)
+        status, out, err = self._add_paths(self.untracked)
         self.update_file_status()
         return (status, out, err)
 
     def reset(self, *items):
-        reset = self.git.reset
-        status, out, err = self._sliced_op(items, lambda x: reset('--', *x))
+        status, out, err = gitcmds.unstage_paths(items)
         self.update_file_status()
         return (status, out, err)
 
@@ -461,42 +714,21 @@ class MainModel(Observable):
     def stage_paths(self, paths):
         """Stages add/removals to git."""
         if not paths:
-            self.stage_all()
-            return
-
-        add = []
-        remove = []
-
-        for path in set(paths):
-            if core.exists(path):
-                if path.endswith('/'):
-                    path = path.rstrip('/')
-                add.append(path)
-            else:
-                remove.append(path)
+            return self.stage_all()
 
         self.notify_observers(self.message_about_to_update)
-
-        # `git add -u` doesn't work on untracked files
-        if add:
-            self._sliced_add(add)
-
-        # If a path doesn't exist then that means it should be removed
-        # from the index.   We use `git add -u` for that.
-        if remove:
-            while remove:
-                self.git.add('--', u=True, *remove[:42])
-                remove = remove[42:]
-
+        # Paths that do not exist are removed from the index
+        status, out, err = self._add_paths(sorted(set(paths)))
         self._update_files()
         self.notify_observers(self.message_updated)
+        return (status, out, err)
 
     def unstage_paths(self, paths):
         if not paths:
-            self.unstage_all()
-            return
-        gitcmds.unstage_paths(paths, head=self.head)
+            return self.unstage_all()
+        status, out, err = gitcmds.unstage_paths(paths, head=self.head)
         self.update_file_status()
+        return (status, out, err)
 
     def untrack_paths(self, paths):
         status, out, err = gitcmds.untrack_paths(paths, head=self.head)
@@ -0,0 +1,180 @@
+"""An in-memory index of paths for completion and the file finder"""
+from __future__ import division, absolute_import, unicode_literals
+import fnmatch
+import re
+import threading
+
+from .. import core
+from .. import utils
+from ..decorators import memoize
+from ..git import git
+from ..git import STDOUT
+
+
+# Characters that start a new word within a path
+_SEPARATORS = set('/_-. ')
+
+
+def fuzzy_score(text, path):
+    """Score how well a path matches the text typed by the user
+
+    Substrings score higher than scattered characters, and matches that
+    start a basename or a word score higher still.  None is returned when
+    the characters of `text` do not appear in `path` in order.
+
+    """
+    if not text:
+        return 0
+    basename = path.rfind('/') + 1
+    pos = path.rfind(text)
+    if pos >= 0:
+        score = 100
+        if pos == basename:
+            score += 50
+        elif pos == 0 or path[pos-1] in _SEPARATORS:
+            score += 25
+        if pos >= basename:
+            score += 25
+        if pos + len(text) == len(path):
+            score += 10
+        return score
+
+    score = 0
+    prev = -2
+    idx = 0
+    for char in text:
+        idx = path.find(char, idx)
+        if idx < 0:
+            return None
+        if idx == prev + 1:
+            score += 5
+        elif idx == 0 or path[idx-1] in _SEPARATORS:
+            score += 3
+        prev = idx
+        idx += 1
+    return min(score, 99)
+
+
+def _subsequence_regexp(text):
+    """Return a regexp that matches when text is a subsequence of a string"""
+    chars = [re.escape(char) for char in text]
+    pattern = chars[0] + ''.join(['[^%s]*%s' % (char, char)
+                                  for char in chars[1:]])
+    return re.compile(pattern)
+
+
+class PathIndex(object):
+    """A sorted index of files and their parent directories
+
+    The sorted and case-folded paths and the set of directories are
+    computed once.  Fuzzy matches only have to score the paths that
+    contain the typed characters in order, and the matches of the previous
+    query are remembered so that typing more characters only filters them
+    further.
+
+    """
+
+    def __init__(self, files=()):
+        self.files = files = set(files)
+        paths = utils.add_parents(files)
+        self.dirs = paths.difference(files)
+        self.paths = sorted(paths)
+        self.folded = [path.lower() for path in self.paths]
+        self._folded_order = sorted(range(len(self.paths)),
+                                    key=self.folded.__getitem__)
+        self._last = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.paths)
+
+    def matches(self, text, case_sensitive):
+        """Return the paths that fuzzy-match text, best matches first"""
+        if not text:
+            if case_sensitive:
+                return list(self.paths)
+            return [self.paths[i] for i in self._folded_order]
+        if case_sensitive:
+            haystack = self.paths
+        else:
+            haystack = self.folded
+            text = text.lower()
+
+        with self._lock:
+            last_text, last_ids = self._last.get(case_sensitive, ('', None))
+        if last_ids is not None and text.startswith(last_text):
+            # Longer text can only match a subset of the previous matches
+            ids = last_ids
+        else:
+            ids = range(len(haystack))
+
+        search = _subsequence_regexp(text).search
+        ids = [i for i in ids if search(haystack[i])]
+        with self._lock:
+            self._last[case_sensitive] = (text, ids)
+
+        scored = [(-fuzzy_score(text, haystack[i]), haystack[i], i)
+                  for i in ids]
+        scored.sort()
+        paths = self.paths
+        return [paths[i] for (_, _, i) in scored]
+
+    def find_paths(self, patterns):
+        """Return the sorted files that match any of the globs"""
+        files = self.files
+        if not patterns:
+            return [path for path in self.paths if path in files]
+        return [path for path in self.paths
+                if path in files and
+                any(fnmatch.fnmatchcase(path, pattern)
+                    for pattern in patterns)]
+
+
+class TrackedPaths(object):
+    """The path index of the tracked files
+
+    The index is rebuilt when the git index changes, at most once per
+    change, and prefetch() rebuilds it in the background so that it is
+    ready by the time the user starts typing.
+
+    """
+
+    def __init__(self, git=git):
+        self.git = git
+        self.builds = 0
+        self._index = PathIndex()
+        self._key = None
+        self._lock = threading.Lock()
+
+    def _index_key(self):
+        path = self.git.git_path('index')
+        if not path:
+            return None
+        try:
+            st = core.stat(path)
+        except OSError:
+            return None
+        return (path, st.st_ino, st.st_mtime, st.st_size)
+
+    def current(self):
+        """Return a PathIndex of the tracked files, rebuilding it if needed"""
+        key = self._index_key()
+        with self._lock:
+            if key is None or key != self._key:
+                out = self.git.ls_files('--', z=True)[STDOUT]
+                self._index = PathIndex([p for p in out.split('\0') if p])
+                self._key = key
+                self.builds += 1
+            return self._index
+
+    def prefetch(self):
+        """Bring the index up to date in a background thread"""
+        thread = threading.Thread(target=self.current)
+        thread.daemon = True
+        thread.start()
+
+
+@memoize
+def tracked_paths():
+    """Return the tracked path index singleton"""
+    return TrackedPaths()
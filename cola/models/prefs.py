@@ -17,8 +17,12 @@ DIFFTOOL = 'diff.tool'
 DISPLAY_UNTRACKED = 'gui.displayuntracked'
 EDITOR = 'gui.editor'
 FONTDIFF = 'cola.fontdiff'
+GREP_MAX_COUNT = 'cola.grepmaxcount'
+GREP_THREADS = 'cola.grepthreads'
 HISTORY_BROWSER = 'gui.historybrowser'
 LINEBREAK = 'cola.linebreak'
+MAX_DIFF_LINES = 'cola.maxdifflines'
+MAX_DIFF_SIZE = 'cola.maxdiffsize'
 MERGE_DIFFSTAT = 'merge.diffstat'
 MERGE_KEEPBACKUP = 'merge.keepbackup'
 MERGE_SUMMARY = 'merge.summary'
@@ -28,6 +32,7 @@ SAVEWINDOWSETTINGS = 'cola.savewindowsettings'
 SORT_BOOKMARKS = 'cola.sortbookmarks'
 TABWIDTH = 'cola.tabwidth'
 TEXTWIDTH = 'cola.textwidth'
+TRIGRAM_INDEX = 'cola.trigramindex'
 USER_EMAIL = 'user.email'
 USER_NAME = 'user.name'
 SPELL_CHECK = 'cola.spellcheck'
@@ -87,6 +92,27 @@ def history_browser():
 def linebreak():
     return gitcfg.current().get(LINEBREAK, True)
 
+
+def max_diff_lines():
+    return gitcfg.current().get(MAX_DIFF_LINES, 10000)
+
+
+def max_diff_size():
+    return gitcfg.current().get(MAX_DIFF_SIZE, 1024 * 1024)
+
+
+def grep_max_count():
+    return gitcfg.current().get(GREP_MAX_COUNT, 0)
+
+
+def grep_threads():
+    return gitcfg.current().get(GREP_THREADS, 0)
+
+
+def trigram_index():
+    return gitcfg.current().get(TRIGRAM_INDEX, False)
+
+
 def spellcheck():
     return gitcfg.current().get(SPELL_CHECK, False)
 
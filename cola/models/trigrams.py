@@ -0,0 +1,472 @@
+"""A persistent trigram index for searching tracked files"""
+from __future__ import division, absolute_import, unicode_literals
+import fnmatch
+import marshal
+import os
+import threading
+from array import array
+
+from .. import core
+from ..compat import PY3
+from ..decorators import memoize
+from ..git import git
+from ..git import STDOUT
+
+
+# Characters that end a run of literal characters in a regular expression
+_REGEXP_SPECIAL = set('.^$*+?|()')
+# Characters that make the preceding character optional
+_QUANTIFIERS = set('*+?{')
+# Characters that end a run of literal characters in a pathspec glob
+_GLOB_SPECIAL = set('*?[]\\')
+
+
+def trigrams(data):
+    """Return the set of 3-byte substrings of a byte string"""
+    return set([data[i:i+3] for i in range(len(data) - 2)])
+
+
+def line_trigrams(data):
+    """Return the set of 3-byte substrings of the lines in a byte string
+
+    "git grep" matches lines, so trigrams that span lines are never needed,
+    and repeated lines only have to be scanned once.
+
+    """
+    result = set()
+    for line in set(data.split(b'\n')):
+        result.update(trigrams(line))
+    return result
+
+
+def regexp_literals(pattern, regexp_mode='--basic-regexp'):
+    """Return literal strings that every match of a "git grep" pattern has
+
+    None is returned when the pattern cannot be reduced to literals,
+    e.g. when it contains alternations or groups.
+
+    """
+    if regexp_mode == '--fixed-strings':
+        if '\n' in pattern:
+            return None
+        return [pattern]
+    if regexp_mode == '--extended-regexp':
+        if '|' in pattern or '(' in pattern:
+            return None
+    elif '\\|' in pattern or '\\(' in pattern:
+        return None
+
+    literals = []
+    run = []
+    size = len(pattern)
+    idx = 0
+    while idx < size:
+        char = pattern[idx]
+        if char == '\\':
+            # Escapes are skipped, and "\{", "\+" and "\?" quantify
+            char = pattern[idx+1:idx+2]
+            if char in _QUANTIFIERS and run:
+                run.pop()
+            if char == '{':
+                idx = _skip_past(pattern, idx, '}')
+            else:
+                idx += 2
+        elif char == '[':
+            idx = _skip_bracket(pattern, idx)
+        elif char == '{':
+            if run:
+                run.pop()
+            idx = _skip_past(pattern, idx, '}')
+        elif char in _REGEXP_SPECIAL:
+            if char in _QUANTIFIERS and run:
+                # The quantified character is optional
+                run.pop()
+            idx += 1
+        else:
+            run.append(char)
+            idx += 1
+            continue
+        if run:
+            literals.append(''.join(run))
+        run = []
+    if run:
+        literals.append(''.join(run))
+    return literals
+
+
+def _skip_past(pattern, idx, char):
+    """Return the index after the next `char`, or the end of the pattern"""
+    end = pattern.find(char, idx + 1)
+    if end < 0:
+        return len(pattern)
+    return end + 1
+
+
+def _skip_bracket(pattern, idx):
+    """Return the index after the bracket expression that starts at idx
+
+    Character classes, equivalence classes and collating symbols such as
+    "[:space:]", "[=a=]" and "[.-.]" are skipped as a whole because they
+    end with "]".  Both "^" and the glob "!" are taken as negations;
+    treating a literal "!" as one only skips more of the pattern.
+
+    """
+    size = len(pattern)
+    idx += 1
+    if pattern[idx:idx+1] in ('^', '!'):
+        idx += 1
+    if pattern[idx:idx+1] == ']':
+        idx += 1
+    while idx < size:
+        char = pattern[idx]
+        if char == ']':
+            return idx + 1
+        delimiter = pattern[idx+1:idx+2]
+        if char == '[' and delimiter and delimiter in ':=.':
+            end = pattern.find(delimiter + ']', idx + 2)
+            if end < 0:
+                return size
+            idx = end + 2
+        else:
+            idx += 1
+    return size
+
+
+def glob_literals(pattern):
+    """Return the literal strings that every match of a glob has"""
+    literals = []
+    run = []
+    size = len(pattern)
+    idx = 0
+    while idx < size:
+        char = pattern[idx]
+        if char == '[':
+            idx = _skip_bracket(pattern, idx)
+        elif char in _GLOB_SPECIAL:
+            idx += 1
+        else:
+            run.append(char)
+            idx += 1
+            continue
+        if run:
+            literals.append(''.join(run))
+        run = []
+    if run:
+        literals.append(''.join(run))
+    return literals
+
+
+def _array_bytes(values):
+    if PY3:
+        return values.tobytes()
+    return values.tostring()
+
+
+def _bytes_array(data):
+    values = array('i')
+    if PY3:
+        values.frombytes(data)
+    else:
+        values.fromstring(data)
+    return values
+
+
+class TrigramIndex(object):
+    """A trigram index over the contents and paths of tracked files
+
+    The index maps the trigrams of each file's staged blob, and of its
+    path, to the ids of the files that contain them.  Queries intersect
+    the postings of the trigrams of the literal parts of a pattern to
+    find the few files that may match, so that the real pattern only has
+    to be run on those candidates.
+
+    The index is stored under .git/cola/ and is brought up to date by
+    comparing the blob ids in the git index with the indexed ones, so
+    only new and changed blobs are read.  Files whose worktree contents
+    differ from the index are always candidates.  So are files that are
+    too large to index and files whose checkout is converted by
+    attributes.  Removed files leave dead ids behind, which are
+    compacted away once they outnumber the live ones.
+
+    """
+
+    version = 2
+    max_file_size = 1024 * 1024
+
+    def __init__(self, git=git):
+        self.git = git
+        self.path = None
+        self.index_stat = None
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.paths = []  # file id -> path, or None for dead ids
+        self.oids = []  # file id -> blob id
+        self.ids = {}  # path -> file id
+        self.unindexed = set()  # ids whose contents are not indexed
+        self.postings = {}  # content trigram -> array('i') of file ids
+        self.path_postings = {}  # path trigram -> array('i') of file ids
+        self.index_stat = None
+        self.dead = 0
+
+    def __len__(self):
+        return len(self.ids)
+
+    def update(self):
+        """Bring the index up to date and return the modified paths
+
+        The modified paths are the tracked files whose worktree contents
+        differ from the git index, including unmerged files.
+
+        """
+        with self._lock:
+            path = self.git.git_path('cola', 'trigrams')
+            if path != self.path:
+                self._reset()
+                self.path = path
+                self._load()
+
+            index_path = self.git.git_path('index')
+            try:
+                st = core.stat(index_path)
+                index_stat = (st.st_ino, st.st_mtime, st.st_size)
+            except (OSError, TypeError):
+                index_stat = None
+            if index_stat is None or index_stat != self.index_stat:
+                self._update_entries()
+                self.index_stat = index_stat
+                self._save()
+
+            out = self.git.diff_files(name_only=True, z=True)[STDOUT]
+            return set([p for p in out.split('\0') if p])
+
+    def _update_entries(self):
+        """Index the blobs that changed since the last update"""
+        out = self.git.ls_files(stage=True, z=True)[STDOUT]
+        entries = {}
+        for record in out.split('\0'):
+            if not record:
+                continue
+            info, filename = record.split('\t', 1)
+            mode, oid, stage = info.split(' ', 2)
+            if stage != '0' or mode == '160000':
+                # Unmerged entries are reported by diff-files
+                oid = ''
+            entries[filename] = oid
+
+        removed = [p for p in self.ids if p not in entries]
+        changed = [p for p in sorted(entries)
+                   if p not in self.ids or
+                   self.oids[self.ids[p]] != entries[p]]
+        if [p for p in removed + changed
+                if os.path.basename(p) == '.gitattributes']:
+            # Attributes can change how any file is checked out
+            removed = list(self.ids)
+            changed = sorted(entries)
+
+        for filename in removed:
+            self._remove(filename)
+
+        converted = self._converted_paths(changed)
+        for filename in changed:
+            if filename in self.ids:
+                self._remove(filename)
+            self._add(filename, entries[filename],
+                      converted=filename in converted)
+
+        if self.dead > len(self.ids):
+            self._compact()
+
+    def _converted_paths(self, paths):
+        """Return the paths whose worktree contents can differ from the blob
+
+        "git grep" searches the worktree, so files that are converted by
+        filters, "ident", "eol" or "working-tree-encoding" are not indexed
+        and are always candidates.
+
+        """
+        if not paths:
+            return set()
+        status, out, _ = self.git.check_attr(
+            'filter', 'ident', 'eol', 'working-tree-encoding',
+            z=True, stdin=True, _input=''.join(p + '\0' for p in paths))
+        if status != 0:
+            return set(paths)
+        # Each record is <path> NUL <attribute> NUL <info> NUL
+        fields = out.split('\0')
+        return set(fields[idx] for idx in range(0, len(fields) - 2, 3)
+                   if fields[idx + 2] not in ('unspecified', 'unset'))
+
+    def _add(self, filename, oid, converted=False):
+        file_id = len(self.paths)
+        self.paths.append(filename)
+        self.oids.append(oid)
+        self.ids[filename] = file_id
+
+        for trigram in trigrams(core.encode(filename)):
+            self.path_postings.setdefault(trigram, array('i')).append(file_id)
+
+        if converted:
+            self.unindexed.add(file_id)
+            return
+        data = None
+        if oid:
+            result = self.git.read_object(oid)
+            if result is not None:
+                data = result[2]
+        if data is None or len(data) > self.max_file_size:
+            self.unindexed.add(file_id)
+            return
+        postings = self.postings
+        for trigram in line_trigrams(data):
+            postings.setdefault(trigram, array('i')).append(file_id)
+
+    def _remove(self, filename):
+        file_id = self.ids.pop(filename)
+        self.paths[file_id] = None
+        self.unindexed.discard(file_id)
+        self.dead += 1
+
+    def _compact(self):
+        """Renumber the live ids and drop the dead ones from the postings"""
+        mapping = {}
+        paths = []
+        oids = []
+        for file_id, filename in enumerate(self.paths):
+            if filename is not None:
+                mapping[file_id] = len(paths)
+                paths.append(filename)
+                oids.append(self.oids[file_id])
+
+        def renumber(postings):
+            result = {}
+            for trigram, ids in postings.items():
+                live = array('i', [mapping[i] for i in ids if i in mapping])
+                if live:
+                    result[trigram] = live
+            return result
+
+        self.postings = renumber(self.postings)
+        self.path_postings = renumber(self.path_postings)
+        self.unindexed = set([mapping[i] for i in self.unindexed])
+        self.paths = paths
+        self.oids = oids
+        self.ids = dict((filename, i) for i, filename in enumerate(paths))
+        self.dead = 0
+
+    def _candidate_ids(self, postings, literals):
+        """Return the live ids that contain all of the literals"""
+        result = None
+        for literal in literals:
+            for trigram in trigrams(core.encode(literal)):
+                ids = postings.get(trigram)
+                if ids is None:
+                    return set()
+                if result is None:
+                    result = set(ids)
+                else:
+                    result.intersection_update(ids)
+                if not result:
+                    return result
+        if result is None:
+            result = set(range(len(self.paths)))
+        return result
+
+    def grep_candidates(self, pattern, regexp_mode='--basic-regexp'):
+        """Return the sorted paths that may contain matches of a pattern
+
+        Returns None when the index cannot narrow down the search.
+
+        """
+        literals = regexp_literals(pattern, regexp_mode)
+        if literals is None:
+            return None
+        literals = [literal for literal in literals if len(literal) >= 3]
+        if not literals:
+            return None
+        modified = self.update()
+        with self._lock:
+            ids = self._candidate_ids(self.postings, literals)
+            ids.update(self.unindexed)
+            paths = self.paths
+            candidates = set([paths[i] for i in ids if paths[i] is not None])
+        candidates.update(modified)
+        return sorted(candidates)
+
+    def find_paths(self, patterns):
+        """Return the sorted tracked paths that match any of the globs"""
+        self.update()
+        with self._lock:
+            paths = self.paths
+            if not patterns:
+                return sorted(self.ids)
+            result = set()
+            for pattern in patterns:
+                ids = self._candidate_ids(self.path_postings,
+                                          glob_literals(pattern))
+                for file_id in ids:
+                    filename = paths[file_id]
+                    if (filename is not None and
+                            fnmatch.fnmatchcase(filename, pattern)):
+                        result.add(filename)
+        return sorted(result)
+
+    def _load(self):
+        if not self.path or not core.exists(self.path):
+            return
+        try:
+            with core.xopen(self.path, 'rb') as fh:
+                data = marshal.loads(fh.read())
+            if data['version'] != self.version:
+                return
+            self.paths = data['paths']
+            self.oids = data['oids']
+            self.unindexed = set(data['unindexed'])
+            self.postings = dict((k, _bytes_array(v))
+                                 for k, v in data['postings'].items())
+            self.path_postings = dict(
+                (k, _bytes_array(v))
+                for k, v in data['path_postings'].items())
+            self.ids = dict((filename, i)
+                            for i, filename in enumerate(self.paths)
+                            if filename is not None)
+            self.dead = len(self.paths) - len(self.ids)
+        except Exception:
+            # Unreadable, truncated, or written by another Python version
+            self._reset()
+
+    def _save(self):
+        if not self.path:
+            return
+        data = {
+            'version': self.version,
+            'paths': self.paths,
+            'oids': self.oids,
+            'unindexed': list(self.unindexed),
+            'postings': dict((k, _array_bytes(v))
+                             for k, v in self.postings.items()),
+            'path_postings': dict((k, _array_bytes(v))
+                                  for k, v in self.path_postings.items()),
+        }
+        tmp_path = self.path + '.tmp'
+        try:
+            dirname = os.path.dirname(self.path)
+            if not core.isdir(dirname):
+                core.makedirs(dirname)
+            with core.xopen(tmp_path, 'wb') as fh:
+                fh.write(marshal.dumps(data))
+            try:
+                os.rename(core.mkpath(tmp_path), core.mkpath(self.path))
+            except OSError:
+                # Windows cannot rename over an existing file
+                core.unlink(self.path)
+                os.rename(core.mkpath(tmp_path), core.mkpath(self.path))
+        except (IOError, OSError):
+            pass
+
+
+@memoize
+def trigram_index():
+    """Return the trigram index singleton"""
+    return TrigramIndex()
@@ -28,6 +28,14 @@ _versions = {
     'check-ignore': '1.8.5',
     # git for-each-ref --sort=version:refname
     'version-sort': '2.7.0',
+    # git status --porcelain=v2 was introduced in 2.11.0
+    'status-porcelain-v2': '2.11.0',
+    # GIT_OPTIONAL_LOCKS was introduced in 2.15.0
+    'optional-locks': '2.15.0',
+    # git config learned --show-origin in 2.8.0
+    'config-show-origin': '2.8.0',
+    # git add and git reset learned --pathspec-from-file in 2.25.0
+    'pathspec-from-file': '2.25.0',
 }
 
 
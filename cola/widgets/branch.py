@@ -58,6 +58,8 @@ class BranchesWidget(QtWidgets.QWidget):
 
 class BranchesTreeWidget(standard.TreeWidget):
     updated = Signal()
+    #: The largest number of ref changes that are applied item by item
+    max_delta = 500
 
     def __init__(self, parent=None):
         standard.TreeWidget.__init__(self, parent)
@@ -76,6 +78,8 @@ class BranchesTreeWidget(standard.TreeWidget):
 
         self.runtask = qtutils.RunTask(parent=self)
         self._active = False
+        # The model's refs_generation shown by the items
+        self._refs_generation = None
 
         self.updated.connect(self.refresh, type=Qt.QueuedConnection)
         model.add_observer(model.message_updated, self.updated.emit)
@@ -94,6 +98,22 @@ class BranchesTreeWidget(standard.TreeWidget):
         if not self._active:
             return
         model = self.main_model
+        generation = model.refs_generation
+        if generation == self._refs_generation:
+            # The ref names are unchanged
+            self.update_current_branch()
+        elif (self._refs_generation is not None and
+                generation == self._refs_generation + 1 and
+                self.apply_delta(model.refs_delta)):
+            self.update_current_branch()
+        else:
+            self.rebuild()
+        self._refs_generation = generation
+
+    def rebuild(self):
+        """Recreate all of the items"""
+        model = self.main_model
+        previous_branch = self.current_branch
         self.current_branch = model.currentbranch
 
         states = self.save_tree_state()
@@ -124,6 +144,67 @@ class BranchesTreeWidget(standard.TreeWidget):
         self.addTopLevelItems([local, remote, tags])
         self.update_select_branch()
         self.load_tree_state(states)
+        if self.current_branch != previous_branch:
+            self.expand_current_branch()
+
+    def apply_delta(self, delta):
+        """Add and remove the items for the refs that changed
+
+        Returns False when the delta is too large to apply item by item.
+
+        """
+        changes = sum([len(added) + len(removed)
+                       for (added, removed) in delta.values()])
+        if changes > self.max_delta or self.topLevelItemCount() != 3:
+            return False
+        self.reset_select_branch()
+        helper = self.tree_helper
+        ellipsis = icons.ellipsis()
+        for idx, attr, icon in ((0, 'local_branches', icons.branch()),
+                                (1, 'remote_branches', icons.branch()),
+                                (2, 'tags', icons.tag())):
+            if attr not in delta:
+                continue
+            added, removed = delta[attr]
+            top_level_item = self.topLevelItem(idx)
+            names = getattr(self.main_model, attr)
+            positions = dict((name, i) for i, name in enumerate(names))
+            for name in removed:
+                helper.remove_item(top_level_item, name, positions,
+                                   icon, ellipsis)
+            for name in added:
+                helper.add_item(top_level_item, name, positions,
+                                icon, ellipsis)
+        return True
+
+    def reset_select_branch(self):
+        """Restore the item of the previously selected branch"""
+        item = self.tree_helper.find_item(self.topLevelItem(0),
+                                          self.current_branch)
+        if item is not None:
+            item.setText(0, item.name)
+            if item.childCount() > 0:
+                item.setIcon(0, icons.ellipsis())
+            else:
+                item.setIcon(0, icons.branch())
+
+    def update_current_branch(self):
+        """Move the current branch marker and its ahead/behind counts"""
+        previous_branch = self.current_branch
+        states = self.save_tree_state()
+        self.reset_select_branch()
+        self.current_branch = self.main_model.currentbranch
+        self.update_select_branch()
+        self.load_tree_state(states)
+        if self.current_branch != previous_branch:
+            self.expand_current_branch()
+
+    def expand_current_branch(self):
+        """Expand the parents of the current branch"""
+        item = self.tree_helper.find_item(self.topLevelItem(0),
+                                          self.current_branch)
+        if item is not None:
+            self.tree_helper.expand_from_item(item)
 
     def showEvent(self, event):
         """Defer updating widgets until the widget is visible"""
@@ -214,7 +295,6 @@ class BranchesTreeWidget(standard.TreeWidget):
                                            self.current_branch)
 
         if item is not None:
-            self.tree_helper.expand_from_item(item)
             item.setIcon(0, icons.star())
 
             tracked_branch = gitcmds.tracked_branch(self.current_branch)
@@ -459,10 +539,78 @@ class BranchesTreeHelper(object):
 
         return result
 
+    @staticmethod
+    def find_item(top_level_item, name):
+        """Find an item by its full name, one path component at a time"""
+        if top_level_item is None or not name:
+            return None
+        item = top_level_item
+        for part in name.split(SEPARATOR_CHAR):
+            for i in range(item.childCount()):
+                child = item.child(i)
+                if child.name == part:
+                    item = child
+                    break
+            else:
+                return None
+        return item
+
+    def _position(self, item, positions):
+        """Return the position of the first ref under an item"""
+        while True:
+            position = positions.get(self.get_full_name(item, SEPARATOR_CHAR))
+            if position is not None or item.childCount() == 0:
+                return position
+            item = item.child(0)
+
+    def add_item(self, top_level_item, name, positions, icon, ellipsis):
+        """Add the items for a new ref, in the order of positions"""
+        position = positions[name]
+        item = top_level_item
+        for part in name.split(SEPARATOR_CHAR):
+            child = None
+            for i in range(item.childCount()):
+                if item.child(i).name == part:
+                    child = item.child(i)
+                    break
+            if child is None:
+                # Binary search for the first sibling that sorts after it
+                low = 0
+                high = item.childCount()
+                while low < high:
+                    mid = (low + high) // 2
+                    sibling_position = self._position(item.child(mid),
+                                                      positions)
+                    if (sibling_position is not None and
+                            sibling_position < position):
+                        low = mid + 1
+                    else:
+                        high = mid
+                child = BranchTreeWidgetItem(part, icon=icon)
+                item.insertChild(low, child)
+                if item is not top_level_item:
+                    item.setIcon(0, ellipsis)
+            item = child
+
+    def remove_item(self, top_level_item, name, positions, icon, ellipsis):
+        """Remove the items of a deleted ref that no other ref needs"""
+        item = self.find_item(top_level_item, name)
+        if item is None:
+            return
+        while item is not top_level_item:
+            if item.childCount() > 0:
+                item.setIcon(0, ellipsis)
+                break
+            if self.get_full_name(item, SEPARATOR_CHAR) in positions:
+                item.setIcon(0, icon)
+                break
+            parent = item.parent()
+            parent.removeChild(item)
+            item = parent
+
     def load_state(self, item, state):
-        """Load expanded items from a dict"""
-        if len(state.keys()) > 0:
-            item.setExpanded(True)
+        """Load expanded and collapsed items from a dict"""
+        item.setExpanded(len(state.keys()) > 0)
 
         for i in range(item.childCount()):
             child = item.child(i)
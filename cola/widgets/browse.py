@@ -216,10 +216,6 @@ class RepoTreeView(standard.TreeView):
         model.populate(item)
         model.update_entry(path)
 
-        for row in range(item.rowCount()):
-            path = item.child(row, 0).path
-            model.update_entry(path)
-
         item.cached = True
 
     def index_collapsed(self, index):
@@ -526,12 +522,14 @@ class SaveBlob(BaseCommand):
 
     def do(self):
         model = self.model
-        cmd = ['git', 'show', '%s:%s' % (model.ref, model.relpath)]
-        with core.xopen(model.filename, 'wb') as fp:
-            proc = core.start_command(cmd, stdout=fp)
-            out, err = proc.communicate()
+        obj = git.read_object('%s:%s' % (model.ref, model.relpath))
+        if obj is None:
+            status = 1
+        else:
+            status = 0
+            with core.xopen(model.filename, 'wb') as fp:
+                fp.write(obj[2])
 
-        status = proc.returncode
         msg = (N_('Saved "%(filename)s" from "%(ref)s" to "%(destination)s"') %
                dict(filename=model.relpath,
                     ref=model.ref,
@@ -13,6 +13,7 @@ from .. import icons
 from .. import qtutils
 from .. import utils
 from ..models import main
+from ..models import pathindex
 from . import defs
 from . import text
 
@@ -429,17 +430,6 @@ def filter_matches(match_text, candidates, case_sensitive,
     return matches
 
 
-def filter_path_matches(match_text, file_list, case_sensitive):
-    """Return matching completions from a list of candidate files"""
-
-    files = set(file_list)
-    files_and_dirs = utils.add_parents(files)
-    dirs = files_and_dirs.difference(files)
-
-    paths = filter_matches(match_text, files_and_dirs, case_sensitive)
-    return (paths, dirs)
-
-
 class Completer(QtWidgets.QCompleter):
 
     def __init__(self, model, parent):
@@ -556,15 +546,24 @@ class GitPathCompletionModel(GitCompletionModel):
 
     def __init__(self, parent):
         GitCompletionModel.__init__(self, parent)
+        self._candidates = None
+        self._index = None
 
     def candidate_paths(self):
         return []
 
+    def path_index(self):
+        """Return a PathIndex of the candidate paths"""
+        candidates = self.candidate_paths()
+        if self._index is None or candidates != self._candidates:
+            self._index = pathindex.PathIndex(candidates)
+            self._candidates = candidates
+        return self._index
+
     def gather_matches(self, case_sensitive):
-        paths, dirs = filter_path_matches(self.match_text,
-                                          self.candidate_paths(),
-                                          case_sensitive)
-        return ((), paths, dirs)
+        index = self.path_index()
+        paths = index.matches(self.match_text, case_sensitive)
+        return ((), paths, index.dirs)
 
 
 class GitStatusFilterCompletionModel(GitPathCompletionModel):
@@ -585,19 +584,13 @@ class GitTrackedCompletionModel(GitPathCompletionModel):
     def __init__(self, parent):
         GitPathCompletionModel.__init__(self, parent)
         self.model_updated.connect(self.gather_paths, type=Qt.QueuedConnection)
-        self._paths = []
+        self.gather_paths()
 
     def gather_paths(self):
-        self._paths = gitcmds.tracked_files()
-
-    def gather_matches(self, case_sensitive):
-        if not self._paths:
-            self.gather_paths()
+        pathindex.tracked_paths().prefetch()
 
-        refs = []
-        paths, dirs = filter_path_matches(self.match_text, self._paths,
-                                          case_sensitive)
-        return (refs, paths, dirs)
+    def path_index(self):
+        return pathindex.tracked_paths().current()
 
 
 class GitLogCompletionModel(GitRefCompletionModel):
@@ -606,18 +599,17 @@ class GitLogCompletionModel(GitRefCompletionModel):
     def __init__(self, parent):
         GitRefCompletionModel.__init__(self, parent)
         self.model_updated.connect(self.gather_paths, type=Qt.QueuedConnection)
-        self._paths = []
+        self.gather_paths()
 
     def gather_paths(self):
-        self._paths = gitcmds.tracked_files()
+        pathindex.tracked_paths().prefetch()
 
     def gather_matches(self, case_sensitive):
-        if not self._paths:
-            self.gather_paths()
         refs = filter_matches(self.match_text, self.matches(), case_sensitive,
                               sort_key=ref_sort_key)
-        paths, dirs = filter_path_matches(self.match_text, self._paths,
-                                          case_sensitive)
+        index = pathindex.tracked_paths().current()
+        paths = index.matches(self.match_text, case_sensitive)
+        dirs = index.dirs
         has_doubledash = (self.match_text == '--' or
                           self.full_text.startswith('-- ') or
                           ' -- ' in self.full_text)
@@ -816,16 +816,16 @@ class Edge(QtWidgets.QGraphicsItem):
         self.recompute_bound()
         self.path_valid = False
 
-        # Choose a new color for new branch edges
-        if self.source.x() < self.dest.x():
-            color = EdgeColor.cycle()
-            line = Qt.SolidLine
-        elif self.source.x() != self.dest.x():
-            color = EdgeColor.current()
-            line = Qt.SolidLine
+        # Edges are created lazily as they scroll into view, so the color is
+        # derived from the branch's column rather than from creation order.
+        # A first-parent edge continues the child's branch, and any other
+        # edge merges the parent's branch into the child.
+        parents = dest.commit.parents
+        if parents and parents[0] == source.commit:
+            color = EdgeColor.column(dest.commit.column)
         else:
-            color = EdgeColor.current()
-            line = Qt.SolidLine
+            color = EdgeColor.column(source.commit.column)
+        line = Qt.SolidLine
 
         self.pen = QtGui.QPen(color, 4.0, line, Qt.SquareCap, Qt.RoundJoin)
 
@@ -918,7 +918,6 @@ class Edge(QtWidgets.QGraphicsItem):
 class EdgeColor(object):
     """An edge color factory"""
 
-    current_color_index = 0
     colors = [
                 QtGui.QColor(Qt.red),
                 QtGui.QColor(Qt.green),
@@ -939,21 +938,12 @@ class EdgeColor(object):
              ]
 
     @classmethod
-    def cycle(cls):
-        cls.current_color_index += 1
-        cls.current_color_index %= len(cls.colors)
-        color = cls.colors[cls.current_color_index]
+    def column(cls, column):
+        """Return the color for edges in a column"""
+        color = QtGui.QColor(cls.colors[(column or 0) % len(cls.colors)])
         color.setAlpha(128)
         return color
 
-    @classmethod
-    def current(cls):
-        return cls.colors[cls.current_color_index]
-
-    @classmethod
-    def reset(cls):
-        cls.current_color_index = 0
-
 
 class Commit(QtWidgets.QGraphicsItem):
     item_type = QtWidgets.QGraphicsItem.UserType + 2
@@ -987,21 +977,29 @@ class Commit(QtWidgets.QGraphicsItem):
     def __init__(self, commit,
                  notifier,
                  selectable=QtWidgets.QGraphicsItem.ItemIsSelectable,
-                 cursor=Qt.PointingHandCursor,
-                 xpos=commit_radius/2.0 + 1.0,
-                 cached_commit_color=commit_color,
-                 cached_merge_color=merge_color):
+                 cursor=Qt.PointingHandCursor):
 
         QtWidgets.QGraphicsItem.__init__(self)
 
-        self.commit = commit
         self.notifier = notifier
+        self.label = None
 
         self.setZValue(0)
         self.setFlag(selectable)
         self.setCursor(cursor)
+        self.set_commit(commit)
+
+    def set_commit(self, commit,
+                   xpos=commit_radius/2.0 + 1.0,
+                   cached_commit_color=commit_color,
+                   cached_merge_color=merge_color,
+                   cached_commit_pen=commit_pen):
+        """Display a commit; used when recycling items while scrolling"""
+        self.commit = commit
         self.setToolTip(commit.oid[:12] + ': ' + commit.summary)
 
+        if self.label is not None:
+            self.label.setParentItem(None)
         if commit.tags:
             self.label = label = Label(commit)
             label.setParentItem(self)
@@ -1009,10 +1007,11 @@ class Commit(QtWidgets.QGraphicsItem):
         else:
             self.label = None
 
-        if len(commit.parents) > 1:
+        if commit.is_merge():
             self.brush = cached_merge_color
         else:
             self.brush = cached_commit_color
+        self.commit_pen = cached_commit_pen
 
         self.pressed = False
         self.dragged = False
@@ -1206,6 +1205,13 @@ class GraphView(QtWidgets.QGraphicsView, ViewerMixin):
     x_off = -18
     y_off = -24
 
+    # Rows materialized above and below the viewport
+    viewport_margin = 32
+    # Rows per bucket in the index of edges that span many rows
+    edge_bucket_rows = 64
+    # Commit items kept for reuse after they scroll out of view
+    item_pool_size = 512
+
     def __init__(self, notifier, parent):
         QtWidgets.QGraphicsView.__init__(self, parent)
         ViewerMixin.__init__(self)
@@ -1225,6 +1231,14 @@ class GraphView(QtWidgets.QGraphicsView, ViewerMixin):
         self.x_min = 24
         self.x_offsets = collections.defaultdict(lambda: self.x_min)
 
+        self.reset_columns()
+        self.reset_rows()
+        self.reset_viewport()
+
+        self.viewport_timer = QtCore.QTimer(self)
+        self.viewport_timer.setSingleShot(True)
+        self.viewport_timer.timeout.connect(self.update_viewport)
+
         self.is_panning = False
         self.pressed = False
         self.selecting = False
@@ -1267,12 +1281,14 @@ class GraphView(QtWidgets.QGraphicsView, ViewerMixin):
         notifier.add_observer(diff.COMMITS_SELECTED, self.commits_selected)
 
     def clear(self):
-        EdgeColor.reset()
         self.scene().clear()
         self.selection_list = []
         self.items.clear()
         self.x_offsets.clear()
         self.x_min = 24
+        self.reset_columns()
+        self.reset_rows()
+        self.reset_viewport()
         self.commits = []
 
     # ViewerMixin interface
@@ -1295,9 +1311,8 @@ class GraphView(QtWidgets.QGraphicsView, ViewerMixin):
         """Select the item for the oids"""
         self.scene().clearSelection()
         for oid in oids:
-            try:
-                item = self.items[oid]
-            except KeyError:
+            item = self.item_for(oid)
+            if item is None:
                 continue
             item.blockSignals(True)
             item.setSelected(True)
@@ -1315,10 +1330,7 @@ class GraphView(QtWidgets.QGraphicsView, ViewerMixin):
                     criteria_fn(generation, commit.generation)):
                 oid = commit.oid
                 generation = commit.generation
-        try:
-            return self.items[oid]
-        except KeyError:
-            return None
+        return self.item_for(oid)
 
     def oldest_item(self, commits):
         """Return the item for the commit with the oldest generation number"""
@@ -1395,10 +1407,10 @@ class GraphView(QtWidgets.QGraphicsView, ViewerMixin):
 
     def set_initial_view(self):
         self_commits = self.commits
-        self_items = self.items
 
         commits = self_commits[-7:]
-        items = [self_items[c.oid] for c in commits]
+        items = [self.item_for(c.oid) for c in commits]
+        items = [item for item in items if item is not None]
 
         selected = self.selected_items()
         if selected:
@@ -1414,7 +1426,8 @@ class GraphView(QtWidgets.QGraphicsView, ViewerMixin):
 
     def fit_view_to_items(self, items):
         if not items:
-            rect = self.scene().itemsBoundingRect()
+            # Items only exist for the visible rows
+            rect = self.sceneRect()
         else:
             x_min = y_min = maxsize
             x_max = y_max = -maxsize
@@ -1494,6 +1507,7 @@ class GraphView(QtWidgets.QGraphicsView, ViewerMixin):
 
         self.setTransformationAnchor(QtWidgets.QGraphicsView.NoAnchor)
         self.setTransform(matrix)
+        self.schedule_viewport_update()
 
     def wheel_zoom(self, event):
         """Handle mouse wheel zooming."""
@@ -1508,6 +1522,7 @@ class GraphView(QtWidgets.QGraphicsView, ViewerMixin):
         self.setTransformationAnchor(QtWidgets.QGraphicsView.AnchorUnderMouse)
         self.zoom = zoom
         self.scale(zoom, zoom)
+        self.schedule_viewport_update()
 
     def wheel_pan(self, event):
         """Handle mouse wheel panning."""
@@ -1518,6 +1533,7 @@ class GraphView(QtWidgets.QGraphicsView, ViewerMixin):
         matrix = self.transform().translate(tx * factor, ty * factor)
         self.setTransformationAnchor(QtWidgets.QGraphicsView.NoAnchor)
         self.setTransform(matrix)
+        self.schedule_viewport_update()
 
     def scale_view(self, scale):
         factor = (self.transform()
@@ -1553,64 +1569,228 @@ class GraphView(QtWidgets.QGraphicsView, ViewerMixin):
             value = min_ + int(float(range_) * scrolloffset)
             scrollbar.setValue(value)
 
+        self.schedule_viewport_update()
+
     def add_commits(self, commits):
-        """Traverse commits and add them to the view."""
+        """Lay out commits and show the ones that are in view"""
         self.commits.extend(commits)
-        scene = self.scene()
-        for commit in commits:
-            item = Commit(commit, self.notifier)
-            self.items[commit.oid] = item
-            for ref in commit.tags:
-                self.items[ref] = item
-            scene.addItem(item)
-
-        self.layout_commits()
-        self.link(commits)
+        self.layout_commits(commits)
+        self.schedule_viewport_update()
 
-    def link(self, commits):
-        """Create edges linking commits with their parents"""
-        scene = self.scene()
-        for commit in commits:
-            try:
-                commit_item = self.items[commit.oid]
-            except KeyError:
-                # TODO - Handle truncated history viewing
-                continue
-            for parent in reversed(commit.parents):
-                try:
-                    parent_item = self.items[parent.oid]
-                except KeyError:
-                    # TODO - Handle truncated history viewing
-                    continue
-                try:
-                    edge = parent_item.edges[commit.oid]
-                except KeyError:
-                    edge = Edge(parent_item, commit_item)
-                else:
-                    continue
-                parent_item.edges[commit.oid] = edge
-                commit_item.edges[parent.oid] = edge
-                scene.addItem(edge)
+    def layout_commits(self, commits):
+        """Position newly added commits
 
-    def layout_commits(self):
-        positions = self.position_nodes()
+        Commits laid out by earlier calls keep their cells, so the layout
+        of the new commits is recorded without touching existing items.
+        Graphics items are only created for the rows near the viewport;
+        see update_viewport().
 
-        # Each edge is accounted in two commits. Hence, accumulate invalid
-        # edges to prevent double edge invalidation.
-        invalid_edges = set()
+        """
+        self.position_nodes(commits)
 
-        for oid, (x, y) in positions.items():
-            item = self.items[oid]
+        rows = self.rows
+        max_row = self.max_row
+        for commit in commits:
+            row = commit.row
+            rows[row].append(commit)
+            if row > max_row:
+                max_row = row
+            self.index_edges(commit)
+        self.max_row = max_row
+
+        self.update_scene_rect()
+        # Force the visible rows to be recomputed
+        self.viewport_rows = None
+
+    def index_edges(self, commit):
+        """Index edges that are too long to be found from their endpoints"""
+        margin = self.viewport_margin
+        bucket_rows = self.edge_bucket_rows
+        edge_buckets = self.edge_buckets
+        for parent in commit.parents:
+            if parent.row is None or commit.row - parent.row <= margin:
+                continue
+            first = parent.row // bucket_rows
+            last = commit.row // bucket_rows
+            for bucket in range(first, last + 1):
+                edge_buckets[bucket].append((commit, parent))
+
+    def reset_viewport(self):
+        self.rows = collections.defaultdict(list)
+        self.edge_buckets = collections.defaultdict(list)
+        self.item_pool = []
+        self.max_row = -1
+        self.viewport_rows = None
+
+    def commit_position(self, commit):
+        """Return the scene position of a laid out commit"""
+        x_pos = self.x_start + commit.column * self.x_off
+        y_pos = self.y_off + commit.row * self.y_off
+        return (x_pos, y_pos)
+
+    def update_scene_rect(self):
+        """Size the scene for the whole layout, not just the created items"""
+        x_off = self.x_off
+        y_off = self.y_off
+        x_values = (self.x_start + self.min_column * x_off,
+                    self.x_start + self.max_column * x_off)
+        x_min = min(x_values)
+        x_max = max(x_values)
+        y_min = y_off + max(self.max_row, 0) * y_off
+        y_max = y_off
+        # Leave room for the commits and for the labels to their right
+        pad = abs(y_off) * 2
+        label_width = 300
+        rect = QtCore.QRectF(x_min - pad, y_min - pad,
+                             x_max - x_min + pad * 2 + label_width,
+                             y_max - y_min + pad * 2)
+        self.scene().setSceneRect(rect)
+
+    def schedule_viewport_update(self):
+        """Update the items in view once control returns to the event loop"""
+        self.viewport_timer.start(0)
+
+    def visible_rows(self):
+        """Return the (first, last) rows that intersect the viewport"""
+        rect = self.mapToScene(self.viewport().rect()).boundingRect()
+        y_off = self.y_off
+        first = int(math.floor(rect.bottom() / y_off)) - 1
+        last = int(math.ceil(rect.top() / y_off)) - 1
+        return (max(first, 0), max(last, 0))
 
-            pos = item.pos()
-            if pos != (x, y):
-                item.setPos(x, y)
+    def update_viewport(self):
+        """Create items near the viewport and recycle the ones that are not
 
-                for edge in item.edges.values():
-                    invalid_edges.add(edge)
+        Items are created for the commits in the rows that intersect the
+        viewport, extended by viewport_margin rows, and for the endpoints of
+        the edges that cross the viewport.  Selected items are kept.
 
-        for edge in invalid_edges:
-            edge.commits_were_invalidated()
+        """
+        if not self.commits:
+            return
+        first, last = self.visible_rows()
+        current = self.viewport_rows
+        if current is not None and current[0] <= first and last <= current[1]:
+            return
+        margin = self.viewport_margin
+        first = max(first - margin, 0)
+        last = min(last + margin, self.max_row)
+        self.viewport_rows = (first, last)
+
+        wanted = {}
+        edges = []
+        rows = self.rows
+        for row in range(first, last + 1):
+            for commit in rows.get(row, ()):
+                wanted[commit.oid] = commit
+                for parent in commit.parents:
+                    if parent.row is not None:
+                        edges.append((commit, parent))
+                for child in commit.children:
+                    if child.row is not None:
+                        edges.append((child, commit))
+
+        bucket_rows = self.edge_bucket_rows
+        edge_buckets = self.edge_buckets
+        for bucket in range(first // bucket_rows, last // bucket_rows + 1):
+            for commit, parent in edge_buckets.get(bucket, ()):
+                if parent.row <= last and commit.row >= first:
+                    edges.append((commit, parent))
+
+        for commit, parent in edges:
+            wanted.setdefault(commit.oid, commit)
+            wanted.setdefault(parent.oid, parent)
+
+        for item in self.selected_items():
+            wanted.setdefault(item.commit.oid, item.commit)
+
+        items = self.items
+        for item in set(items.values()):
+            if item.commit.oid not in wanted:
+                self.release_item(item)
+
+        for oid, commit in wanted.items():
+            if oid not in items:
+                self.create_item(commit)
+
+        self.link(edges)
+
+    def item_for(self, oid):
+        """Return the item for an oid, creating it when it is out of view"""
+        try:
+            return self.items[oid]
+        except KeyError:
+            pass
+        if not self.commits:
+            return None
+        try:
+            commit = self.commits[0].store.commit(oid)
+        except KeyError:
+            return None
+        if commit.row is None:
+            return None
+        item = self.create_item(commit)
+        edges = [(commit, parent) for parent in commit.parents]
+        edges.extend([(child, commit) for child in commit.children])
+        self.link(edges)
+        return item
+
+    def create_item(self, commit):
+        """Create or recycle the item for a commit"""
+        try:
+            item = self.item_pool.pop()
+        except IndexError:
+            item = Commit(commit, self.notifier)
+        else:
+            item.set_commit(commit)
+        x_pos, y_pos = self.commit_position(commit)
+        item.setPos(x_pos, y_pos)
+
+        self.items[commit.oid] = item
+        for ref in commit.tags:
+            self.items[ref] = item
+        self.scene().addItem(item)
+        return item
+
+    def release_item(self, item):
+        """Remove an item from the scene and keep it for reuse"""
+        scene = self.scene()
+        oid = item.commit.oid
+        for edge in item.edges.values():
+            if edge.source is item:
+                other = edge.dest
+            else:
+                other = edge.source
+            other.edges.pop(oid, None)
+            scene.removeItem(edge)
+        item.edges = {}
+        scene.removeItem(item)
+
+        items = self.items
+        items.pop(oid, None)
+        for ref in item.commit.tags:
+            if items.get(ref) is item:
+                del items[ref]
+
+        if len(self.item_pool) < self.item_pool_size:
+            self.item_pool.append(item)
+
+    def link(self, edges):
+        """Create edges linking (commit, parent) pairs that have items"""
+        scene = self.scene()
+        items = self.items
+        for commit, parent in edges:
+            try:
+                commit_item = items[commit.oid]
+                parent_item = items[parent.oid]
+            except KeyError:
+                continue
+            if commit.oid in parent_item.edges:
+                continue
+            edge = Edge(parent_item, commit_item)
+            parent_item.edges[commit.oid] = edge
+            commit_item.edges[parent.oid] = edge
+            scene.addItem(edge)
 
     """Commit node layout technique
 
@@ -1654,9 +1834,19 @@ children equal to its one. This prevents branch from jumping too far from
 its fork.
 
     Initialization is performed by reset_columns method. Column allocation is
-implemented in alloc_column method. Initialization and main loop are in
-recompute_grid method. The method also embeds row assignment algorithm by
-implementation.
+implemented in alloc_column method. The main loop is in update_grid method.
+The method also embeds row assignment algorithm by implementation.
+
+    Incremental layout
+
+    Commits arrive in batches in topological order, so all parents of a
+commit are laid out in the same batch or an earlier one. The column and row
+state is kept between batches and update_grid only visits the new commits.
+A commit that is loaded after its parent was visited may not have been
+assigned a column by the parent. Such a commit asks for a column near its
+first parent's one, and frontier is propagated with respect to all of its
+parents before its row is allocated. This meets first aim of the row
+assignment algorithm without revisiting the parents.
 
     Actions for each node are follow.
     1. If the node was not assigned a column then it is assigned empty one.
@@ -1823,16 +2013,23 @@ step 2. Hence, it must be propagated for children on side columns.
         else:
             self.columns[column] = count - 1
 
-    def recompute_grid(self):
-        self.reset_columns()
-        self.reset_rows()
-
-        for node in self.sort_by_generation(list(self.commits)):
+    def update_grid(self, commits):
+        for node in self.sort_by_generation(list(commits)):
             if node.column is None:
-                # Node is either root or its parent is not in items. The last
-                # happens when tree loading is in progress. Allocate new
-                # columns for such nodes.
-                node.column = self.alloc_column()
+                # Node is either root or its parents were visited before the
+                # node was loaded. Prefer a column near the first parent.
+                desired = 0
+                for parent in node.parents:
+                    if parent.column is not None:
+                        desired = parent.column
+                        break
+                node.column = self.alloc_column(desired)
+
+            # Parents visited in earlier batches may not have propagated
+            # frontier for this node.
+            for parent in node.parents:
+                if parent.row is not None:
+                    self.propagate_frontier(node.column, parent.row + 1)
 
             node.row = self.alloc_cell(node.column, node.tags)
 
@@ -1878,20 +2075,14 @@ step 2. Hence, it must be propagated for children on side columns.
                 # This is a leaf node.
                 self.leave_column(node.column)
 
-    def position_nodes(self):
-        self.recompute_grid()
+    def position_nodes(self, commits):
+        self.update_grid(commits)
 
-        x_start = self.x_start
         x_min = self.x_min
-        x_off = self.x_off
-        y_off = self.y_off
-
         positions = {}
 
-        for node in self.commits:
-            x_pos = x_start + node.column * x_off
-            y_pos = y_off + node.row * y_off
-
+        for node in commits:
+            x_pos, y_pos = self.commit_position(node)
             positions[node.oid] = (x_pos, y_pos)
             x_min = min(x_min, x_pos)
 
@@ -1943,6 +2134,14 @@ step 2. Hence, it must be propagated for children on side columns.
         self.selection_list = []
         self.viewport().repaint()
 
+    def scrollContentsBy(self, dx, dy):
+        QtWidgets.QGraphicsView.scrollContentsBy(self, dx, dy)
+        self.schedule_viewport_update()
+
+    def resizeEvent(self, event):
+        QtWidgets.QGraphicsView.resizeEvent(self, event)
+        self.schedule_viewport_update()
+
     def wheelEvent(self, event):
         """Handle Qt mouse wheel events."""
         if event.modifiers() & Qt.ControlModifier:
@@ -1970,6 +2169,7 @@ step 2. Hence, it must be propagated for children on side columns.
             xratio = yratio = max(xratio, yratio)
         self.scale(xratio, yratio)
         self.centerOn(rect.center())
+        self.schedule_viewport_update()
 
 
 # Glossary
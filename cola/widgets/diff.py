@@ -34,18 +34,22 @@ FILES_SELECTED = 'FILES_SELECTED'
 
 
 class DiffSyntaxHighlighter(QtGui.QSyntaxHighlighter):
-    """Implements the diff syntax highlighting"""
-
-    INITIAL_STATE = -1
-    DEFAULT_STATE = 0
-    DIFFSTAT_STATE = 1
-    DIFF_FILE_HEADER_STATE = 2
-    DIFF_STATE = 3
-    SUBMODULE_STATE = 4
-
-    DIFF_FILE_HEADER_START_RGX = re.compile(r'diff --git a/.* b/.*')
-    DIFF_HUNK_HEADER_RGX = re.compile(r'(?:@@ -[0-9,]+ \+[0-9,]+ @@)|'
-                                      r'(?:@@@ (?:-[0-9,]+ ){2}\+[0-9,]+ @@@)')
+    """Implements the diff syntax highlighting
+
+    The states of the blocks are precomputed by diffparse.HighlightStates
+    when the text is set.  While "deferred" is set, blocks only receive
+    their state and are remembered as pending, and highlight_block()
+    formats them later, e.g. once they are scrolled into view.
+
+    """
+
+    INITIAL_STATE = diffparse.HighlightStates.INITIAL_STATE
+    DEFAULT_STATE = diffparse.HighlightStates.DEFAULT_STATE
+    DIFFSTAT_STATE = diffparse.HighlightStates.DIFFSTAT_STATE
+    DIFF_FILE_HEADER_STATE = diffparse.HighlightStates.DIFF_FILE_HEADER_STATE
+    DIFF_STATE = diffparse.HighlightStates.DIFF_STATE
+    SUBMODULE_STATE = diffparse.HighlightStates.SUBMODULE_STATE
+
     BAD_WHITESPACE_RGX = re.compile(r'\s+$')
 
     def __init__(self, doc, whitespace=True, is_commit=False):
@@ -53,6 +57,10 @@ class DiffSyntaxHighlighter(QtGui.QSyntaxHighlighter):
         self.whitespace = whitespace
         self.enabled = True
         self.is_commit = is_commit
+        self.states = diffparse.HighlightStates(is_commit=is_commit)
+        self.deferred = False
+        self.pending = bytearray()
+        self.stale = False
 
         QPalette = QtGui.QPalette
         cfg = gitcfg.current()
@@ -76,61 +84,62 @@ class DiffSyntaxHighlighter(QtGui.QSyntaxHighlighter):
         self.setCurrentBlockState(self.INITIAL_STATE)
 
     def set_enabled(self, enabled):
+        if enabled != self.enabled:
+            # The formats of existing blocks can no longer be reused
+            self.stale = True
         self.enabled = enabled
 
+    def set_lines(self, lines, start=0):
+        """Precompute the states of the blocks from `start` onwards"""
+        self.states.truncate(start)
+        self.states.extend(lines)
+        self.pending[start:] = bytearray(len(lines))
+        self.stale = False
+
+    def highlight_block(self, block):
+        """Format a block whose formatting was deferred"""
+        number = block.blockNumber()
+        if number < len(self.pending) and self.pending[number]:
+            self.rehighlightBlock(block)
+
     def highlightBlock(self, text):
         if not self.enabled or not text:
             return
 
-        state = self.previousBlockState()
-        if state == self.INITIAL_STATE:
-            if text.startswith('Submodule '):
-                state = self.SUBMODULE_STATE
-            elif text.startswith('diff --git '):
-                state = self.DIFFSTAT_STATE
-            elif self.is_commit:
-                state = self.DEFAULT_STATE
-            else:
-                state = self.DIFFSTAT_STATE
-
-        if state == self.DIFFSTAT_STATE:
-            if self.DIFF_FILE_HEADER_START_RGX.match(text):
-                state = self.DIFF_FILE_HEADER_STATE
-                self.setFormat(0, len(text), self.diff_header_fmt)
-            elif self.DIFF_HUNK_HEADER_RGX.match(text):
-                state = self.DIFF_STATE
-                self.setFormat(0, len(text), self.bold_diff_header_fmt)
-            elif '|' in text:
-                i = text.index('|')
-                self.setFormat(0, i, self.bold_diff_header_fmt)
-                self.setFormat(i, len(text) - i, self.diff_header_fmt)
-            else:
-                self.setFormat(0, len(text), self.diff_header_fmt)
-        elif state == self.DIFF_FILE_HEADER_STATE:
-            if self.DIFF_HUNK_HEADER_RGX.match(text):
-                state = self.DIFF_STATE
-                self.setFormat(0, len(text), self.bold_diff_header_fmt)
-            else:
-                self.setFormat(0, len(text), self.diff_header_fmt)
-        elif state == self.DIFF_STATE:
-            if self.DIFF_FILE_HEADER_START_RGX.match(text):
-                state = self.DIFF_FILE_HEADER_STATE
-                self.setFormat(0, len(text), self.diff_header_fmt)
-            elif self.DIFF_HUNK_HEADER_RGX.match(text):
-                self.setFormat(0, len(text), self.bold_diff_header_fmt)
-            elif text.startswith('-'):
-                self.setFormat(0, len(text), self.diff_remove_fmt)
-            elif text.startswith('+'):
-                self.setFormat(0, len(text), self.diff_add_fmt)
-                if self.whitespace:
-                    m = self.BAD_WHITESPACE_RGX.search(text)
-                    if m is not None:
-                        i = m.start()
-                        self.setFormat(i, len(text) - i,
-                                       self.bad_whitespace_fmt)
-
+        number = self.currentBlock().blockNumber()
+        states = self.states
+        if number < len(states.states):
+            state = states.states[number]
+            fmt = states.formats[number]
+        else:
+            state, fmt = states.classify(text, self.previousBlockState())
         self.setCurrentBlockState(state)
 
+        deferred = self.deferred
+        if number < len(self.pending):
+            self.pending[number] = deferred
+        if deferred:
+            return
+
+        if fmt == states.HEADER:
+            self.setFormat(0, len(text), self.diff_header_fmt)
+        elif fmt == states.BOLD_HEADER:
+            self.setFormat(0, len(text), self.bold_diff_header_fmt)
+        elif fmt == states.DIFFSTAT:
+            i = text.index('|')
+            self.setFormat(0, i, self.bold_diff_header_fmt)
+            self.setFormat(i, len(text) - i, self.diff_header_fmt)
+        elif fmt == states.REMOVAL:
+            self.setFormat(0, len(text), self.diff_remove_fmt)
+        elif fmt == states.ADDITION:
+            self.setFormat(0, len(text), self.diff_add_fmt)
+            if self.whitespace:
+                m = self.BAD_WHITESPACE_RGX.search(text)
+                if m is not None:
+                    i = m.start()
+                    self.setFormat(i, len(text) - i,
+                                   self.bad_whitespace_fmt)
+
 
 class DiffTextEdit(VimHintedPlainTextEdit):
 
@@ -148,6 +157,9 @@ class DiffTextEdit(VimHintedPlainTextEdit):
             self.numbers = None
 
         self.cursorPositionChanged.connect(self._cursor_changed)
+        self.verticalScrollBar().valueChanged.connect(self.highlight_visible)
+        # The lines of the current text, for sharing a prefix with the next
+        self._lines = None
 
     def _cursor_changed(self):
         """Update the line number display when the cursor changes"""
@@ -159,6 +171,7 @@ class DiffTextEdit(VimHintedPlainTextEdit):
         super(DiffTextEdit, self).resizeEvent(event)
         if self.numbers:
             self.numbers.refresh_size()
+        self.highlight_visible()
 
     def set_loading_message(self):
         self.hint.set_value('+++ ' + N_('Loading...'))
@@ -170,6 +183,98 @@ class DiffTextEdit(VimHintedPlainTextEdit):
             self.numbers.set_diff(diff)
         self.set_value(diff)
 
+    def setPlainText(self, text):
+        """Replace the text, keeping the blocks of a shared prefix
+
+        Only the blocks after the prefix that the new text shares with the
+        current text are replaced, so the unchanged blocks keep their
+        formats.  Formatting is deferred until blocks become visible.
+
+        """
+        lines = text.split('\n')
+        document = self.document()
+        old_lines = self._lines
+        common = 0
+        if (old_lines is not None and not self.highlighter.stale and
+                document.blockCount() == len(old_lines)):
+            for old, new in zip(old_lines, lines):
+                if old != new:
+                    break
+                common += 1
+            if common and (document.findBlockByNumber(common - 1).text() !=
+                           lines[common - 1]):
+                common = 0
+
+        highlighter = self.highlighter
+        highlighter.set_lines(lines[common:], start=common)
+        highlighter.deferred = True
+        try:
+            if common == 0:
+                super(DiffTextEdit, self).setPlainText(text)
+            elif common < len(lines) or common < len(old_lines):
+                cursor = QtGui.QTextCursor(
+                    document.findBlockByNumber(common - 1))
+                cursor.movePosition(QtGui.QTextCursor.EndOfBlock)
+                cursor.movePosition(QtGui.QTextCursor.End,
+                                    QtGui.QTextCursor.KeepAnchor)
+                tail = lines[common:]
+                if tail:
+                    cursor.insertText('\n' + '\n'.join(tail))
+                else:
+                    cursor.removeSelectedText()
+        finally:
+            highlighter.deferred = False
+        self._set_lines(lines)
+        self.highlight_visible()
+
+    def append_diff(self, diff):
+        """Append text that continues the current diff"""
+        if not diff:
+            return
+        if self.numbers:
+            self.numbers.append_diff(diff)
+        document = self.document()
+        lines = diff.split('\n')
+        if document.isEmpty():
+            start = 0
+        else:
+            start = document.blockCount()
+            diff = '\n' + diff
+        highlighter = self.highlighter
+        highlighter.set_lines(lines, start=start)
+        highlighter.deferred = True
+        try:
+            cursor = QtGui.QTextCursor(document)
+            cursor.movePosition(QtGui.QTextCursor.End)
+            cursor.insertText(diff)
+        finally:
+            highlighter.deferred = False
+        if self._lines is not None:
+            self._set_lines(self._lines[:start] + lines)
+        self.highlight_visible()
+
+    def _set_lines(self, lines):
+        """Remember the lines of the text when they match the blocks"""
+        if self.document().blockCount() == len(lines):
+            self._lines = lines
+        else:
+            # Qt split the text differently, e.g. on U+2029
+            self._lines = None
+            self.highlighter.set_lines([])
+            self.highlighter.rehighlight()
+
+    def highlight_visible(self, _value=None):
+        """Format the visible blocks whose formatting was deferred"""
+        height = self.viewport().height()
+        offset = self.contentOffset()
+        block = self.firstVisibleBlock()
+        while block.isValid():
+            top = self.blockBoundingGeometry(block).translated(offset).top()
+            if top > height:
+                break
+            self.highlighter.highlight_block(block)
+            block = block.next()
+
 
 class DiffLineNumbers(TextDecorator):
 
@@ -200,6 +305,15 @@ class DiffLineNumbers(TextDecorator):
         else:
             self.lines = None
 
+    def append_diff(self, diff):
+        """Extend the line numbers for text appended to the diff"""
+        if self.lines is None:
+            return
+        parser = self.parser
+        self.lines = parser.parse_more(diff)
+        self.formatter.set_digits(parser.digits())
+        self.refresh_size()
+
     def set_lines(self, lines):
         self.lines = lines
 
@@ -304,6 +418,7 @@ class DiffEditor(DiffTextEdit):
     options_changed = Signal()
     updated = Signal()
     diff_text_changed = Signal(object)
+    diff_text_appended = Signal(object)
 
     def __init__(self, parent, titlebar):
         DiffTextEdit.__init__(self, parent, numbers=True)
@@ -347,6 +462,14 @@ class DiffEditor(DiffTextEdit):
         self.diffopts_button.setMenu(self.diffopts_menu)
         qtutils.hide_button_menu_indicator(self.diffopts_button)
 
+        # "Load More" is shown when a large diff was only partially loaded
+        self.load_more_button = create_action_button(
+            tooltip=N_('Load More'), icon=icons.ellipsis())
+        qtutils.connect_button(self.load_more_button,
+                               cmds.run(cmds.LoadMoreDiff))
+        self.load_more_button.hide()
+
+        titlebar.add_corner_widget(self.load_more_button)
         titlebar.add_corner_widget(self.diffopts_button)
 
         self.action_apply_selection = qtutils.add_action(
@@ -366,6 +489,8 @@ class DiffEditor(DiffTextEdit):
 
         diff_text_changed = model.message_diff_text_changed
         model.add_observer(diff_text_changed, self.diff_text_changed.emit)
+        diff_text_appended = model.message_diff_text_appended
+        model.add_observer(diff_text_appended, self.diff_text_appended.emit)
 
         self.selection_model = selection_model = selection.selection_model()
         selection_model.add_observer(selection_model.message_selection_changed,
@@ -373,6 +498,9 @@ class DiffEditor(DiffTextEdit):
         self.updated.connect(self.refresh, type=Qt.QueuedConnection)
 
         self.diff_text_changed.connect(self.set_diff)
+        self.diff_text_changed.connect(self._update_load_more)
+        self.diff_text_appended.connect(self.append_diff)
+        self.diff_text_appended.connect(self._update_load_more)
 
     def refresh(self):
         enabled = False
@@ -384,6 +512,9 @@ class DiffEditor(DiffTextEdit):
                 enabled = True
         self.action_revert_selection.setEnabled(enabled)
 
+    def _update_load_more(self, _text=None):
+        self.load_more_button.setVisible(self.model.has_more_diff())
+
     def enable_line_numbers(self, enabled):
         """Enable/disable the diff line number display"""
         self.numbers.setVisible(enabled)
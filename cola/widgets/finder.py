@@ -8,10 +8,12 @@ from qtpy.QtCore import Qt
 from qtpy.QtCore import Signal
 
 from ..i18n import N_
+from ..models import pathindex
+from ..models import prefs
+from ..models import trigrams
 from ..utils import Group
 from .. import cmds
 from .. import core
-from .. import gitcmds
 from .. import hotkeys
 from .. import icons
 from .. import utils
@@ -90,7 +92,10 @@ class FindFilesThread(QtCore.QThread):
             args = []
         else:
             args = [add_wildcards(arg) for arg in utils.shell_split(query)]
-        filenames = gitcmds.tracked_files(*args)
+        if prefs.trigram_index():
+            filenames = trigrams.trigram_index().find_paths(args)
+        else:
+            filenames = pathindex.tracked_paths().current().find_paths(args)
         if query == self.query:
             self.result.emit(filenames)
         else:
@@ -1,13 +1,19 @@
 from __future__ import division, absolute_import, unicode_literals
+import threading
+import time
 
 from qtpy import QtCore
+from qtpy import QtGui
 from qtpy import QtWidgets
 from qtpy.QtCore import Qt
 from qtpy.QtCore import Signal
 
 from ..cmds import do
+from ..compat import queue
 from ..git import git
 from ..i18n import N_
+from ..models import prefs
+from ..models import trigrams
 from ..qtutils import diff_font
 from ..utils import Group
 from .. import cmds
@@ -57,29 +63,186 @@ def goto_grep(line):
 
 
 class GrepThread(QtCore.QThread):
-    """Gather `git grep` results in a background thread"""
+    """Gather `git grep` results in a background thread
 
+    Matches are emitted in batches as they arrive.  Each search has a
+    generation number, and starting a new search kills the "git grep"
+    process of the search that it supersedes.
+
+    """
+
+    lines = Signal(object, object)
     result = Signal(object, object, object)
 
+    #: The interval, in seconds, between batches of matches
+    interval = 0.05
+    #: The maximum number of lines in a batch
+    batch_size = 1000
+    #: The maximum number of candidate paths passed to "git grep".
+    #: Matching many pathspecs costs more than searching every file.
+    max_paths = 500
+
     def __init__(self, parent):
         QtCore.QThread.__init__(self, parent)
         self.query = None
         self.shell = False
         self.regexp_mode = '--basic-regexp'
+        self.generation = 0
+        self.proc = None
+        self._running = False
+        self._lock = threading.Lock()
+
+    def search(self, query, shell=False, regexp_mode='--basic-regexp'):
+        """Start a search, superseding the current one, and return its id"""
+        with self._lock:
+            self.query = query
+            self.shell = shell
+            self.regexp_mode = regexp_mode
+            self.generation += 1
+            generation = self.generation
+            proc = self.proc
+            start = not self._running
+            self._running = True
+        self._kill(proc)
+        if start:
+            # The previous run() may still be returning
+            self.wait()
+            self.start()
+        return generation
+
+    def cancel(self):
+        """Stop the current search"""
+        with self._lock:
+            self.query = None
+            self.generation += 1
+            proc = self.proc
+        self._kill(proc)
+
+    def _kill(self, proc):
+        if proc is None:
+            return
+        try:
+            proc.kill()
+        except OSError:
+            pass
 
     def run(self):
-        if self.query is None:
-            return
-        query = self.query
-        if self.shell:
+        while True:
+            with self._lock:
+                query = self.query
+                shell = self.shell
+                regexp_mode = self.regexp_mode
+                generation = self.generation
+                if query is None:
+                    self._running = False
+                    return
+            self.grep(query, shell, regexp_mode, generation)
+            with self._lock:
+                if generation == self.generation:
+                    self._running = False
+                    return
+
+    def grep(self, query, shell, regexp_mode, generation):
+        """Run "git grep" and emit its matches until it is superseded"""
+        if shell:
             args = utils.shell_split(query)
         else:
             args = [query]
-        status, out, err = git.grep(self.regexp_mode, n=True, *args)
-        if query == self.query:
-            self.result.emit(status, out, err)
-        else:
-            self.run()
+            candidates = self.candidates(query, regexp_mode)
+            if candidates == []:
+                # Nothing can match
+                self.result.emit(generation, 1, '')
+                return
+            if candidates is not None:
+                # Only the files that may match are searched
+                args += ['--'] + [':(literal)' + path for path in candidates]
+        max_count = prefs.grep_max_count() or None
+        threads = prefs.grep_threads() or None
+        proc = git.start('grep', regexp_mode, n=True, max_count=max_count,
+                         threads=threads, *args)
+        proc.stdin.close()
+        with self._lock:
+            current = generation == self.generation
+            if current:
+                self.proc = proc
+        if not current:
+            self._kill(proc)
+
+        # stdout and stderr are drained by helper threads so that a
+        # partial batch can be flushed on time, and so that "git grep"
+        # never blocks on a full stderr pipe.
+        lines = queue.Queue()
+        errors = []
+        readers = [
+            threading.Thread(target=_read_lines, args=(proc.stdout, lines)),
+            threading.Thread(target=_read_all, args=(proc.stderr, errors)),
+        ]
+        for reader in readers:
+            reader.daemon = True
+            reader.start()
+
+        batch = []
+        emitted = 0.0
+        while generation == self.generation:
+            timeout = None
+            if batch:
+                timeout = max(0.0, emitted + self.interval - time.time())
+            try:
+                line = lines.get(True, timeout)
+            except queue.Empty:
+                # Flush the partial batch on time
+                flush = True
+            else:
+                if line is None:
+                    break
+                batch.append(line)
+                flush = (len(batch) >= self.batch_size or
+                         time.time() - emitted >= self.interval)
+            if flush:
+                self.lines.emit(generation, '\n'.join(batch))
+                batch = []
+                emitted = time.time()
+
+        if generation != self.generation:
+            self._kill(proc)
+        for reader in readers:
+            reader.join()
+        proc.stdout.close()
+        proc.stderr.close()
+        err = core.decode(b''.join(errors))
+        status = core.wait(proc)
+        with self._lock:
+            if self.proc is proc:
+                self.proc = None
+            current = generation == self.generation
+        if current:
+            if batch:
+                self.lines.emit(generation, '\n'.join(batch))
+            self.result.emit(generation, status, err)
+
+    def candidates(self, query, regexp_mode):
+        """Return the paths that may match a query, or None for all paths"""
+        if not prefs.trigram_index() or query.startswith('-'):
+            return None
+        candidates = trigrams.trigram_index().grep_candidates(
+            query, regexp_mode)
+        if candidates is not None and len(candidates) > self.max_paths:
+            candidates = None
+        return candidates
+
+
+def _read_lines(fh, lines):
+    """Put each line of a file into a queue, followed by None"""
+    try:
+        for line in core.read_lines(fh):
+            lines.put(line)
+    finally:
+        lines.put(None)
+
+
+def _read_all(fh, chunks):
+    """Append the contents of a file to a list of chunks"""
+    chunks.append(fh.read())
 
 
 class Grep(Dialog):
@@ -87,8 +250,6 @@ class Grep(Dialog):
 
     def __init__(self, parent=None):
         Dialog.__init__(self, parent)
-        self.grep_result = ''
-
         self.setWindowTitle(N_('Search'))
         if parent is not None:
             self.setWindowModality(Qt.WindowModal)
@@ -168,7 +329,10 @@ class Grep(Dialog):
         self.setLayout(self.mainlayout)
 
         thread = self.worker_thread = GrepThread(self)
+        thread.lines.connect(self.process_lines, type=Qt.QueuedConnection)
         thread.result.connect(self.process_result, type=Qt.QueuedConnection)
+        self.generation = 0
+        self.has_lines = False
 
         self.input_txt.textChanged.connect(lambda s: self.search())
         self.regexp_combo.currentIndexChanged.connect(lambda x: self.search())
@@ -206,13 +370,14 @@ class Grep(Dialog):
 
         query = self.input_txt.value()
         if len(query) < 2:
+            self.worker_thread.cancel()
             self.result_txt.clear()
             self.preview_txt.clear()
             return
-        self.worker_thread.query = query
-        self.worker_thread.shell = self.shell_checkbox.isChecked()
-        self.worker_thread.regexp_mode = self.regexp_mode()
-        self.worker_thread.start()
+        self.has_lines = False
+        self.generation = self.worker_thread.search(
+            query, shell=self.shell_checkbox.isChecked(),
+            regexp_mode=self.regexp_mode())
 
     def search_for(self, txt):
         """Set the initial value of the input text"""
@@ -241,25 +406,47 @@ class Grep(Dialog):
         cursor.setPosition(offset)
         self.result_txt.setTextCursor(cursor)
 
-    def process_result(self, status, out, err):
-        """Apply the results from grep to the widgets"""
-        if status == 0:
-            value = out + err
-        elif out + err:
-            value = 'git grep: ' + out + err
-        else:
-            value = ''
-
+    def set_result(self, value):
+        """Replace the results while keeping the scroll and cursor position"""
         # save scrollbar and text cursor
         scroll = self.text_scroll()
         offset = min(len(value), self.text_offset())
 
-        self.grep_result = value
         self.result_txt.set_value(value)
         # restore
         self.set_text_scroll(scroll)
         self.set_text_offset(offset)
 
+    def process_lines(self, generation, text):
+        """Show a batch of matches from grep"""
+        if generation != self.generation:
+            return
+        if self.has_lines:
+            # Append without moving the text cursor
+            cursor = QtGui.QTextCursor(self.result_txt.document())
+            cursor.movePosition(QtGui.QTextCursor.End)
+            cursor.insertText('\n' + text)
+        else:
+            # The first batch replaces the results of the previous search
+            self.has_lines = True
+            self.set_result(text)
+            self.edit_group.setEnabled(True)
+
+    def process_result(self, generation, status, err):
+        """Apply the exit status and errors from grep to the widgets"""
+        if generation != self.generation:
+            return
+        if status == 0:
+            value = err
+        elif err:
+            value = 'git grep: ' + err
+        else:
+            value = ''
+        if not self.has_lines:
+            self.set_result(value)
+        elif value:
+            self.process_lines(generation, value)
+
         enabled = status == 0
         self.edit_group.setEnabled(enabled)
         self.refresh_group.setEnabled(True)
@@ -275,6 +462,11 @@ class Grep(Dialog):
         """Launch an editor on the currently selected line"""
         goto_grep(self.result_txt.selected_line()),
 
+    def done(self, exit_code):
+        """Stop searching when the dialog closes"""
+        self.worker_thread.cancel()
+        return Dialog.done(self, exit_code)
+
     def export_state(self):
         """Export persistent settings"""
         state = super(Grep, self).export_state()
@@ -1,5 +1,6 @@
 from __future__ import division, absolute_import, unicode_literals
 import itertools
+import threading
 
 from qtpy.QtCore import Qt
 from qtpy.QtCore import Signal
@@ -15,6 +16,7 @@ from ..models import selection
 from ..widgets import gitignore
 from .. import cmds
 from .. import core
+from .. import gitcmds
 from .. import hotkeys
 from .. import icons
 from .. import qtutils
@@ -213,6 +215,7 @@ class StatusTreeWidget(QtWidgets.QTreeWidget):
         self.updated.connect(self.refresh, type=Qt.QueuedConnection)
 
         self.m = main.model()
+        self.prefetcher = DiffPrefetcher(self)
         self.m.add_observer(self.m.message_about_to_update,
                             self.about_to_update.emit)
         self.m.add_observer(self.m.message_updated, self.updated.emit)
@@ -835,19 +838,26 @@ class StatusTreeWidget(QtWidgets.QTreeWidget):
         elif category == self.idx_staged:
             item = self.staged_items()[0]
             cmds.do(cmds.DiffStaged, item.path, deleted=item.deleted)
+            self.prefetcher.prefetch(self.m.staged, idx, cached=True,
+                                     deleted=self.m.staged_deleted,
+                                     ref=self.m.head)
 
         # A modified file
         elif category == self.idx_modified:
             item = self.modified_items()[0]
             cmds.do(cmds.Diff, item.path, deleted=item.deleted)
+            self.prefetcher.prefetch(self.m.modified, idx,
+                                     deleted=self.m.unstaged_deleted)
 
         elif category == self.idx_unmerged:
             item = self.unmerged_items()[0]
             cmds.do(cmds.Diff, item.path)
+            self.prefetcher.prefetch(self.m.unmerged, idx)
 
         elif category == self.idx_untracked:
             item = self.unstaged_items()[0]
             cmds.do(cmds.ShowUntracked, item.path)
+            self.prefetcher.cancel()
 
     def move_up(self):
         idx = self.selected_idx()
@@ -919,6 +929,102 @@ class StatusTreeWidget(QtWidgets.QTreeWidget):
                 selection.union(selection.selection_model()))
 
 
+class DiffPrefetcher(object):
+    """Computes the diffs of neighbouring status entries in the background
+
+    The diffs of the entries around the selected one are parked in the
+    diff cache so that stepping through the status list does not have to
+    wait for "git diff".  Work for entries that are no longer near the
+    selection is cancelled.
+
+    """
+
+    #: The number of entries to prefetch on each side of the selection
+    count = 3
+
+    def __init__(self, parent):
+        self.runtask = qtutils.RunTask(parent=parent)
+        self._tasks = {}
+
+    def prefetch(self, paths, idx, cached=False, deleted=(), ref=None):
+        """Prefetch the diffs around paths[idx]"""
+        wanted = []
+        for offset in range(1, self.count + 1):
+            for neighbour in (idx + offset, idx - offset):
+                if 0 <= neighbour < len(paths):
+                    wanted.append((paths[neighbour], cached))
+        wanted_set = set(wanted)
+        for key, task in list(self._tasks.items()):
+            if key not in wanted_set:
+                task.cancel()
+                del self._tasks[key]
+        for key in wanted:
+            if key in self._tasks:
+                continue
+            path = key[0]
+            task = DiffPrefetchTask(path, cached, path in deleted, ref,
+                                    self.runtask)
+            self._tasks[key] = task
+            self.runtask.start(task, finish=self._finished)
+
+    def cancel(self):
+        """Cancel all prefetching"""
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+
+    def _finished(self, task):
+        key = (task.path, task.cached)
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+
+
+class DiffPrefetchTask(qtutils.Task):
+    """Compute a diff and store it in the diff cache"""
+
+    def __init__(self, path, cached, deleted, ref, parent):
+        qtutils.Task.__init__(self, parent)
+        self.path = path
+        self.cached = cached
+        self.deleted = deleted
+        self.ref = ref
+        self.cancelled = False
+        self._stream = None
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            if self._stream is not None:
+                self._stream.kill()
+
+    def task(self):
+        cache = gitcmds.diff_cache()
+        if self.cancelled:
+            return None
+        key = cache.key(self.path, cached=self.cached, deleted=self.deleted,
+                        ref=self.ref)
+        if key in cache:
+            return None
+        with self._lock:
+            if self.cancelled:
+                return None
+            opts = {}
+            if self.ref:
+                opts['ref'] = self.ref
+            self._stream = stream = gitcmds.diff_stream(
+                filename=self.path, cached=self.cached, deleted=self.deleted,
+                **opts)
+        text = stream.read(max_lines=prefs.max_diff_lines(),
+                           max_size=prefs.max_diff_size())
+        complete = stream.exhausted
+        stream.close()
+        # A cancelled read returns an incomplete diff
+        if complete and not self.cancelled:
+            cache.put(key, text)
+        return None
+
+
 class StatusFilterWidget(QtWidgets.QWidget):
 
     def __init__(self, parent=None):
@@ -8,6 +8,8 @@ try:
 except ImportError:
     from mock import MagicMock
 
+from qtpy import QtGui
+
 from cola.compat import odict
 from cola.widgets.branch import BranchesTreeHelper, BranchTreeWidgetItem
 
@@ -98,6 +100,42 @@ class BranchesTreeHelperTestCase(unittest.TestCase):
         self.assertEqual({'top': {'child_1': {}, 'child_2': {
             'sub_child_2_1': {}, 'sub_child_2_2': {}}}}, result)
 
+    def test_should_collapse_items_on_load_state(self):
+        """Test that load_state collapses items that were saved collapsed."""
+        items = self._create_top_item()
+        for item in items.values():
+            item.setExpanded = MagicMock()
+        tree_helper = BranchesTreeHelper()
+
+        tree_helper.load_state(items['top'], {'top': {'child_1': {}}}['top'])
+        items['top'].setExpanded.assert_called_with(True)
+        items['child_1'].setExpanded.assert_called_with(False)
+        self.assertFalse(items['sub_child_2_1'].setExpanded.called)
+
+    def test_should_match_a_rebuilt_tree_on_add_and_remove_item(self):
+        """Test that applying a delta matches a tree built from scratch."""
+        before = ['a', 'b/c', 'b/d', 'e/f/g', 'h']
+        after = ['0', 'a', 'a2/x', 'b/c', 'b/c2', 'e/f/g2', 'h/i']
+        tree_helper = BranchesTreeHelper()
+        top = tree_helper.create_top_level_item(
+            'top', tree_helper.group_branches(before, '/'))
+
+        icon = QtGui.QIcon()
+        positions = dict((name, i) for i, name in enumerate(after))
+        for name in set(before) - set(after):
+            tree_helper.remove_item(top, name, positions, icon, icon)
+        for name in set(after) - set(before):
+            tree_helper.add_item(top, name, positions, icon, icon)
+
+        expect = tree_helper.create_top_level_item(
+            'top', tree_helper.group_branches(after, '/'))
+        self.assertEqual(self._tree(expect), self._tree(top))
+
+    def _tree(self, item):
+        children = [self._tree(item.child(i))
+                    for i in range(item.childCount())]
+        return (item.name, children)
+
     def _create_item(self, name, expanded):
         item = BranchTreeWidgetItem(name)
         item.isExpanded = MagicMock(return_value=expanded)
@@ -2,7 +2,9 @@
 from __future__ import absolute_import, division, unicode_literals
 
 from cola import core
+from cola import git
 from cola import gitcmds
+from cola.models.browse import LastCommits
 from cola.models.main import MainModel
 
 from test import helper
@@ -25,6 +27,27 @@ class ClassicModelTestCase(helper.GitRepositoryTestCase):
         self.assertTrue('foo/bar/baz' not in self.model.modified)
         self.assertTrue('foo/bar/baz' not in self.model.untracked)
 
+    def test_stage_paths_bulk(self):
+        """Test stage_paths() with additions, changes and removals."""
+        self.commit_files()
+        paths = ['file %d' % i for i in range(2000)] + ['new\nline']
+        for path in paths:
+            self.touch(path)
+        self.write_file('A', 'change')
+        core.unlink('B')
+        status, out, err = self.model.stage_paths(paths + ['A', 'B'])
+
+        self.assertEqual(status, 0)
+        self.assertTrue("add 'A'" in out)
+        self.assertEqual(len(self.model.staged), len(paths) + 2)
+        self.assertEqual(self.model.modified, [])
+        self.assertEqual(self.model.untracked, [])
+
+        status, out, err = self.model.unstage_paths(paths + ['A', 'B'])
+        self.assertEqual(status, 0)
+        self.assertEqual(self.model.staged, [])
+        self.assertEqual(len(self.model.untracked), len(paths))
+
     def test_unstage_paths(self):
         """Test a simple usage of unstage_paths()."""
         self.commit_files()
@@ -55,3 +78,32 @@ class ClassicModelTestCase(helper.GitRepositoryTestCase):
 
         self.assertTrue('foo/bar/baz' in self.model.untracked)
         self.assertTrue('foo/bar/baz' not in self.model.staged)
+
+
+class LastCommitsTestCase(helper.GitRepositoryTestCase):
+    """Tests the batched last-commit lookup used by the browser."""
+
+    def test_last_commits(self):
+        self.write_file('A', 'change')
+        self.git('commit', '-m', 'change A', 'A')
+        core.makedirs('foo/bar')
+        self.touch('foo/bar/baz')
+        self.git('add', 'foo/bar/baz')
+        self.git('commit', '-m', 'add baz')
+
+        last_commits = LastCommits(git.current())
+        result = last_commits.get(['A', 'B', 'foo', 'foo/bar/baz', 'C'])
+
+        self.assertEqual(result['A'][1], 'change A')
+        self.assertEqual(result['B'][1], 'initial commit')
+        self.assertEqual(result['foo'][1], 'add baz')
+        self.assertEqual(result['foo/bar/baz'][1], 'add baz')
+        self.assertEqual(result['C'], None)
+
+    def test_last_commits_follows_head(self):
+        last_commits = LastCommits(git.current())
+        self.assertEqual(last_commits.get(['A'])['A'][1], 'initial commit')
+
+        self.write_file('A', 'change')
+        self.git('commit', '-m', 'change A', 'A')
+        self.assertEqual(last_commits.get(['A'])['A'][1], 'change A')
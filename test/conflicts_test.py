@@ -0,0 +1,51 @@
+from __future__ import absolute_import, division, unicode_literals
+
+import unittest
+
+from cola.models import conflicts
+
+from test import helper
+
+
+CONFLICTED = """before
+<<<<<<< HEAD
+ours
+=======
+theirs
+>>>>>>> topic
+after
+"""
+
+
+class ConflictScannerTestCase(helper.TmpPathTestCase):
+
+    def setUp(self):
+        helper.TmpPathTestCase.setUp(self)
+        self.scanner = conflicts.ConflictScanner(threads=4)
+
+    def test_scan(self):
+        self.write_file('conflicted', CONFLICTED)
+        self.write_file('clean', 'not at the start <<<<<<< of a line\n')
+        self.write_file('empty', '')
+        paths = ['conflicted', 'clean', 'empty', 'missing']
+        self.assertEqual(self.scanner.scan(paths), {
+            'conflicted': True,
+            'clean': False,
+            'empty': False,
+            'missing': False,
+        })
+
+    def test_verdicts_are_cached_until_the_file_changes(self):
+        self.write_file('path', CONFLICTED)
+        self.assertTrue(self.scanner.has_conflicts('path'))
+        self.assertTrue(self.scanner.has_conflicts('path'))
+        self.assertEqual(self.scanner.hits, 1)
+        self.assertEqual(self.scanner.misses, 1)
+
+        self.write_file('path', 'resolved\n')
+        self.assertFalse(self.scanner.has_conflicts('path'))
+        self.assertEqual(self.scanner.misses, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
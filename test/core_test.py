@@ -2,6 +2,7 @@
 # encoding: utf-8
 
 from __future__ import absolute_import, division, unicode_literals
+import io
 import unittest
 
 from cola import core
@@ -35,6 +36,27 @@ class CoreColaUnicodeTestCase(unittest.TestCase):
         actual = core.decode(None)
         self.assertEqual(expect, actual)
 
+    def test_read_lines(self):
+        """Lines are reassembled across chunk boundaries"""
+        data = core.encode('unicøde\r\nsecond\n\nlast')
+        lines = list(core.read_lines(io.BytesIO(data), size=3))
+        self.assertEqual(lines, ['unicøde', 'second', '', 'last'])
+
+    def test_read_lines_does_not_wait_for_full_chunks(self):
+        """Lines are yielded as soon as they are available"""
+        class Pipe(object):
+            chunks = [b'first\n', b'second\n']
+
+            def read1(self, size):
+                return self.chunks.pop(0) if self.chunks else b''
+
+            def read(self, size):
+                raise AssertionError('read() would block')
+
+        lines = core.read_lines(Pipe())
+        self.assertEqual(next(lines), 'first')
+        self.assertEqual(list(lines), ['second'])
+
 
 if __name__ == '__main__':
     unittest.main()
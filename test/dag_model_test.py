@@ -0,0 +1,116 @@
+from __future__ import absolute_import, division, unicode_literals
+
+import unittest
+
+from cola import core
+from cola import git
+from cola.models import dag
+
+from test import helper
+
+
+class CommitStoreTestCase(unittest.TestCase):
+
+    def test_edges_and_interning(self):
+        store = dag.CommitStore()
+        a = store.from_record(('a' * 40, [], 'Ann', 'd1', 'ann@x', 'one'))
+        b = store.from_record(('b' * 40, [a.oid], 'Ann', 'd2', 'ann@x', 'two'))
+        c = store.from_record(('c' * 40, [a.oid], 'Bob', 'd3', 'bob@x',
+                               'three'))
+        m = store.from_record(('d' * 40, [b.oid, c.oid], 'Bob', 'd4', 'bob@x',
+                               'merge'), labels=['HEAD -> refs/heads/master'])
+
+        self.assertEqual(len(store), 4)
+        self.assertEqual(store.strings, ['', 'Ann', 'ann@x', 'Bob', 'bob@x'])
+        self.assertEqual(m.parents, [b, c])
+        self.assertEqual(a.children, [b, c])
+        self.assertTrue(a.is_fork())
+        self.assertTrue(m.is_merge())
+        self.assertEqual(m.generation, 2)
+        self.assertEqual(m.tags, set(['HEAD', 'heads/master']))
+        self.assertEqual(store.commit(m.oid).author, 'Bob')
+
+    def test_positions(self):
+        store = dag.CommitStore()
+        commit = store.new(oid='a' * 40)
+        self.assertEqual(commit.column, None)
+        commit.column = 3
+        commit.row = 0
+        self.assertEqual(store.commit(commit.oid).column, 3)
+        self.assertEqual(store.commit(commit.oid).row, 0)
+        commit.column = -1
+        self.assertEqual(commit.column, -1)
+        commit.column = None
+        self.assertEqual(commit.column, None)
+
+
+class CommitCacheTestCase(helper.GitRepositoryTestCase):
+
+    def commit(self, name):
+        self.touch(name)
+        self.git('add', name)
+        self.git('commit', '-m', name)
+
+    def read(self, ref='HEAD', count=100):
+        ctx = dag.DAG(ref, count)
+        reader = dag.RepoReader(ctx, git=git.current())
+        commits = list(reader)
+        self.assertEqual(reader.returncode, 0)
+        return [(c.oid, [p.oid for p in c.parents], c.summary, sorted(c.tags))
+                for c in commits]
+
+    def test_round_trip(self):
+        records = [
+            ('a' * 40, [], 'A U Thor', '2020-01-01', 'a@example.com', 'one'),
+            ('b' * 40, ['a' * 40, 'c' * 40], 'A U Thor', '2020-01-02',
+             'a@example.com', 'two'),
+        ]
+        tips = (['b' * 40], ['^' + 'c' * 40])
+        cache = dag.CommitCache('HEAD', 10, git=git.current())
+        cache.save(tips, records)
+
+        loaded_tips, loaded_records = cache.load()
+        self.assertEqual(loaded_tips, tips)
+        self.assertEqual([tuple(r) for r in loaded_records], records)
+
+    def test_corrupt_cache_is_a_miss(self):
+        cache = dag.CommitCache('HEAD', 10, git=git.current())
+        cache.save((['a' * 40], []), [])
+        core.write(cache.path, 'garbage')
+        self.assertEqual(cache.load(), None)
+
+    def test_reader_matches_git_log(self):
+        self.commit('C')
+        self.git('tag', 'v1')
+        expect = self.read()
+        # The second read is served from the cache
+        self.assertEqual(self.read(), expect)
+        self.assertTrue('tags/v1' in expect[-1][3])
+
+    def test_reader_extends_cache(self):
+        self.read()
+        self.commit('C')
+        self.commit('D')
+        cached = self.read()
+        self.assertEqual(len(cached), 3)
+        self.assertEqual([c[2] for c in cached],
+                         ['initial commit', 'C', 'D'])
+        self.assertEqual(cached[2][1], [cached[1][0]])
+
+    def test_reader_window_is_bounded(self):
+        self.read(count=2)
+        self.commit('C')
+        self.commit('D')
+        self.assertEqual([c[2] for c in self.read(count=2)], ['C', 'D'])
+
+    def test_reader_after_rewrite(self):
+        self.commit('C')
+        self.read()
+        self.git('reset', '--hard', 'HEAD~1')
+        self.commit('D')
+        self.assertEqual([c[2] for c in self.read()],
+                         ['initial commit', 'D'])
+
+
+if __name__ == '__main__':
+    unittest.main()
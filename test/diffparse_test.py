@@ -64,6 +64,23 @@ class ParseDiffTestCase(unittest.TestCase):
                 '         """Writes a new diff corresponding to the user\'s'
                 ' selection."""')
 
+    def test_hunk_index(self):
+        fixture_path = helper.fixture('diff.txt')
+        parser = diffparse.DiffParser('cola/diffparse.py',
+                                      core.read(fixture_path))
+        hunks = parser.hunks
+
+        self.assertEqual(parser.hunks_between(0, 0), hunks[:1])
+        self.assertEqual(parser.hunks_between(22, 23), hunks[:2])
+        self.assertEqual(parser.hunks_between(24, 40), hunks[1:2])
+        self.assertEqual(parser.hunks_between(30, 100), hunks[1:])
+        self.assertEqual(parser.hunks_between(100, 200), [])
+
+        self.assertTrue(parser.hunk_for_line(0) is hunks[0])
+        self.assertTrue(parser.hunk_for_line(23) is hunks[1])
+        self.assertTrue(parser.hunk_for_line(41) is hunks[2])
+        self.assertTrue(parser.hunk_for_line(100) is hunks[2])
+
     def test_diff_at_start(self):
         fixture_path = helper.fixture('diff-start.txt')
         parser = diffparse.DiffParser('foo bar/a', core.read(fixture_path))
@@ -144,6 +161,29 @@ class DiffLinesTestCase(unittest.TestCase):
         actual = len(lines)
         self.assertEqual(expect, actual)
 
+    def test_parse_more_matches_parse(self):
+        """Parsing a diff in pieces gives the same line numbers"""
+        expect = self.parser.parse(self.text)
+        digits = self.parser.digits()
+        text_lines = self.text.splitlines()
+        self.parser.reset()
+        actual = None
+        for idx in range(0, len(text_lines), 7):
+            actual = self.parser.parse_more(
+                '\n'.join(text_lines[idx:idx+7]))
+        self.assertEqual(list(expect), list(actual))
+        self.assertEqual(digits, self.parser.digits())
+
+    def test_random_access_matches_iteration(self):
+        """Line numbers are computed independently for each chunk"""
+        expect = list(self.parser.parse(self.text))
+        self.parser.reset()
+        lines = self.parser.parse(self.text)
+        lines.CHUNK = 4
+        for idx in reversed(range(len(expect))):
+            self.assertEqual(lines[idx], expect[idx])
+        self.assertEqual(lines[-1], expect[-1])
+
     def test_diff_line_count_ranges(self):
         parser = self.parser
         lines = parser.parse(self.text)
@@ -326,6 +366,50 @@ class FormatDiffLinesTestCase(unittest.TestCase):
         self.assertEqual(expect, actual)
 
 
+class HighlightStatesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.lines = [
+            ' a.txt | 2 +-',
+            '',
+            'diff --git a/a.txt b/a.txt',
+            'index 1234567..89abcde 100644',
+            '@@ -1 +1 @@',
+            '-old',
+            '+new',
+            ' same',
+        ]
+
+    def test_states(self):
+        states = diffparse.HighlightStates()
+        states.extend(self.lines)
+        S = diffparse.HighlightStates
+        self.assertEqual(list(states.states), [
+            S.DIFFSTAT_STATE, S.INITIAL_STATE, S.DIFF_FILE_HEADER_STATE,
+            S.DIFF_FILE_HEADER_STATE, S.DIFF_STATE, S.DIFF_STATE,
+            S.DIFF_STATE, S.DIFF_STATE])
+        self.assertEqual(list(states.formats), [
+            S.DIFFSTAT, S.PLAIN, S.HEADER, S.HEADER, S.BOLD_HEADER,
+            S.REMOVAL, S.ADDITION, S.PLAIN])
+
+    def test_commit_message_is_plain(self):
+        states = diffparse.HighlightStates(is_commit=True)
+        states.extend(['Subject', '', '+not a diff'])
+        self.assertEqual(list(states.formats), [states.PLAIN] * 3)
+
+    def test_extend_matches_single_pass(self):
+        expect = diffparse.HighlightStates()
+        expect.extend(self.lines)
+
+        states = diffparse.HighlightStates()
+        states.extend(['unrelated', 'lines'])
+        states.truncate(0)
+        states.extend(self.lines[:3])
+        states.extend(self.lines[3:])
+        self.assertEqual(states.states, expect.states)
+        self.assertEqual(states.formats, expect.formats)
+
+
 class ParseRangeStrTestCase(unittest.TestCase):
 
     def test_parse_range_str(self):
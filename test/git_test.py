@@ -5,6 +5,7 @@ from __future__ import absolute_import, division, unicode_literals
 
 import os
 import signal
+import threading
 import time
 import unittest
 
@@ -17,6 +18,8 @@ from cola import git
 from cola.compat import WIN32
 from cola.git import STDOUT
 
+from test import helper
+
 
 class GitModuleTestCase(unittest.TestCase):
 
@@ -294,5 +297,104 @@ class GitCommandTest(unittest.TestCase):
         signal.signal(signal.SIGALRM, prev_handler)
 
 
+class IndexLockTestCase(unittest.TestCase):
+    """Tests the read/write lock used by Git.execute()"""
+
+    def test_is_readonly(self):
+        self.assertTrue(git.is_readonly(['git', 'log', '-1']))
+        self.assertTrue(git.is_readonly(
+            ['git', '-c', 'diff.suppressBlankEmpty=false', 'ls-files']))
+        self.assertTrue(git.is_readonly(['git', 'config', '--get', 'a.b']))
+        self.assertTrue(git.is_readonly(['git', 'remote']))
+        self.assertTrue(git.is_readonly(['git', 'stash', 'list']))
+        self.assertFalse(git.is_readonly(['git', 'add', '--', 'a']))
+        self.assertFalse(git.is_readonly(['git', 'config', 'a.b', 'c']))
+        self.assertFalse(git.is_readonly(['git', 'remote', 'rm', 'origin']))
+        self.assertFalse(git.is_readonly(['git', 'update-index']))
+        self.assertFalse(git.is_readonly(['git']))
+        self.assertFalse(git.is_readonly(['python', '-c', 'pass']))
+
+    def test_readers_share_the_lock(self):
+        lock = git.ReadWriteLock()
+        lock.acquire_read()
+        acquired = []
+        thread = threading.Thread(
+                target=lambda: (lock.acquire_read(), acquired.append(True)))
+        thread.start()
+        thread.join(5.0)
+        self.assertEqual(acquired, [True])
+        lock.release_read()
+        lock.release_read()
+
+    def test_writers_are_exclusive(self):
+        lock = git.ReadWriteLock()
+        events = []
+
+        def write():
+            with lock.writing():
+                events.append('write')
+
+        lock.acquire_read()
+        thread = threading.Thread(target=write)
+        thread.start()
+        time.sleep(0.1)
+        self.assertEqual(events, [])
+        events.append('read')
+        lock.release_read()
+        thread.join(5.0)
+        self.assertEqual(events, ['read', 'write'])
+
+
+class CatFileTestCase(helper.GitRepositoryTestCase):
+    """Tests the persistent "git cat-file --batch" object readers"""
+
+    def setUp(self):
+        helper.GitRepositoryTestCase.setUp(self)
+        self.git_obj = git.Git()
+
+    def tearDown(self):
+        self.git_obj.stop_object_readers()
+        helper.GitRepositoryTestCase.tearDown(self)
+
+    def test_read_object(self):
+        self.write_file('A', 'A\n')
+        self.git('commit', '-m', 'A', 'A')
+        oid, objtype, data = self.git_obj.read_object('HEAD:A')
+        self.assertEqual(objtype, 'blob')
+        self.assertEqual(data, b'A\n')
+        self.assertEqual(len(oid), 40)
+        # the same process answers subsequent queries
+        proc = self.git_obj._cat_file._proc
+        self.assertEqual(self.git_obj.read_object('HEAD')[1], 'commit')
+        self.assertTrue(self.git_obj._cat_file._proc is proc)
+
+    def test_read_missing_object(self):
+        self.assertEqual(self.git_obj.read_object('HEAD:missing'), None)
+        self.assertEqual(self.git_obj.object_info('HEAD:missing'), None)
+        self.assertEqual(self.git_obj.read_object('HEAD')[1], 'commit')
+
+    def test_object_info(self):
+        self.write_file('A', 'A\n')
+        self.git('commit', '-m', 'A', 'A')
+        oid, objtype, size = self.git_obj.object_info('HEAD:A')
+        self.assertEqual(objtype, 'blob')
+        self.assertEqual(size, 2)
+
+    def test_restart_after_exit(self):
+        self.assertEqual(self.git_obj.read_object('HEAD')[1], 'commit')
+        self.git_obj._cat_file._proc.kill()
+        self.git_obj._cat_file._proc.wait()
+        self.assertEqual(self.git_obj.read_object('HEAD')[1], 'commit')
+
+    def test_idle_shutdown(self):
+        reader = git.CatFile(self.git_obj, idle_timeout=0.05)
+        self.assertEqual(reader.query('HEAD')[1], 'commit')
+        self.assertTrue(reader.is_running())
+        time.sleep(0.5)
+        self.assertFalse(reader.is_running())
+        self.assertEqual(reader.query('HEAD')[1], 'commit')
+        reader.stop()
+
+
 if __name__ == '__main__':
     unittest.main()
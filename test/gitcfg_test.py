@@ -1,7 +1,10 @@
 from __future__ import absolute_import, division, unicode_literals
 
+import subprocess
 import unittest
 
+from cola import core
+from cola import git
 from cola import gitcfg
 
 from test import helper
@@ -84,11 +87,147 @@ class GitConfigTestCase(helper.GitRepositoryTestCase):
         opts = self.config.find('guitool.Meow Cat.*')
         self.assertEqual(opts['guitool.Meow Cat.cmd'], 'cat hello')
 
+    def test_lookups_are_throttled(self):
+        config = gitcfg.GitConfig()
+        config.check_interval = 60.0
+        self.git('config', 'test.value', 'old')
+        self.assertEqual(config.get('test.value'), 'old')
+        avoided = config.stats_avoided
+
+        self.git('config', 'test.value', 'new')
+        self.assertEqual(config.get('test.value'), 'old')
+        self.assertTrue(config.stats_avoided > avoided)
+
+        config.invalidate()
+        self.assertEqual(config.get('test.value'), 'new')
+
     def test_guitool_opts_mixed_case(self):
         self.git('config', 'guitool.Meow Cat.cmd', 'cat hello')
         opts = self.config.get_guitool_opts('Meow Cat')
         self.assertEqual(opts['cmd'], 'cat hello')
 
+    def test_file_encodings(self):
+        config = gitcfg.GitConfig()
+        self.git('config', 'cola.fileattributes', 'true')
+        self.write_file('.gitattributes', '*.txt encoding=iso-8859-1\n')
+        core.makedirs('sub')
+        self.write_file('sub/.gitattributes', 'B encoding=utf-16\n')
+        paths = ['A', 'B', 'a.txt', 'sub/B', 'sub/b.txt']
+        self.assertEqual(config.file_encodings(paths), {
+            'A': 'utf-8',
+            'B': 'utf-8',
+            'a.txt': 'iso-8859-1',
+            'sub/B': 'utf-16',
+            'sub/b.txt': 'iso-8859-1',
+        })
+        self.assertEqual(config.file_encoding('sub/B'), 'utf-16')
+
+        # The cache is dropped when a .gitattributes file changes
+        self.write_file('sub/.gitattributes', 'B encoding=utf-32\n')
+        config.invalidate()
+        self.assertEqual(config.file_encoding('sub/B'), 'utf-32')
+        self.assertEqual(config.file_encoding('a.txt'), 'iso-8859-1')
+
+    def test_include_path(self):
+        self.write_file('included.cfg', '[test]\n\tincluded = yes\n')
+        self.git('config', 'include.path', '../included.cfg')
+        self.assertEqual(self.config.get('test.included'), True)
+
+    def assert_follows_includes(self):
+        config = gitcfg.GitConfig()
+        config.check_interval = 60.0
+        self.git('config', 'include.path', '../included.cfg')
+        self.assertEqual(config.get('test.included'), None)
+
+        # Included files are watched even before they exist
+        self.write_file('included.cfg', '[test]\n\tincluded = one\n')
+        config.invalidate()
+        self.assertEqual(config.get('test.included'), 'one')
+
+        self.write_file('included.cfg', '[test]\n\tincluded = two\n')
+        config.invalidate()
+        self.assertEqual(config.get('test.included'), 'two')
+
+        # includeIf.onbranch: is evaluated again when HEAD changes
+        self.git('config', 'includeIf.onbranch:topic.path', '../topic.cfg')
+        self.write_file('topic.cfg', '[test]\n\ttopic = true\n')
+        config.invalidate()
+        self.assertEqual(config.get('test.topic'), None)
+        self.git('checkout', '-q', '-b', 'topic')
+        config.invalidate()
+        self.assertEqual(config.get('test.topic'), True)
+
+    def test_included_files_are_watched(self):
+        self.assert_follows_includes()
+
+    def test_included_files_are_watched_using_git(self):
+        builtin_reader = gitcfg.BUILTIN_READER
+        gitcfg.BUILTIN_READER = False
+        try:
+            self.assert_follows_includes()
+        finally:
+            gitcfg.BUILTIN_READER = builtin_reader
+
+
+class ConfigReaderTestCase(helper.GitRepositoryTestCase):
+    """Compare read_config_file() against "git config --list" """
+
+    def git_config_list(self, path):
+        """Return the (key, value) pairs listed by git for a config file"""
+        cmd = ['git', 'config', '--null', '--includes',
+               '--file', path, '--list']
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+        out, _ = proc.communicate()
+        entries = []
+        for item in core.decode(out).split('\0')[:-1]:
+            key, newline, value = item.partition('\n')
+            entries.append((key, value if newline else None))
+        return entries
+
+    def assert_conforms(self, path):
+        expect = self.git_config_list(path)
+        actual = gitcfg.read_config_file(path, git_dir=git.current().git_dir())
+        self.assertTrue(expect)
+        self.assertEqual(expect, actual)
+
+    def test_basic(self):
+        self.assert_conforms(helper.fixture('config', 'basic.cfg'))
+
+    def test_syntax(self):
+        self.assert_conforms(helper.fixture('config', 'syntax.cfg'))
+
+    def test_include(self):
+        self.assert_conforms(helper.fixture('config', 'include.cfg'))
+
+    def test_invalid(self):
+        self.assert_conforms(helper.fixture('config', 'invalid.cfg'))
+
+    def test_recursive(self):
+        self.assert_conforms(helper.fixture('config', 'recursive.cfg'))
+
+    def test_repo_config(self):
+        self.git('config', '--add', 'test.multi', 'one')
+        self.git('config', '--add', 'test.multi', 'two')
+        self.git('config', 'test.Sub Section.key', ' "quotes" and \\ ')
+        self.assert_conforms('.git/config')
+
+    def test_line_endings(self):
+        with open('crlf.cfg', 'wb') as f:
+            f.write(b'\xef\xbb\xbf[test]\r\n\tkey = value \\\r\n'
+                    b' continued\r\n\tlast = "quoted\rcarriage"')
+        self.assert_conforms('crlf.cfg')
+
+    def test_wildmatch(self):
+        self.assertTrue(gitcfg.wildmatch('**/repo/**', '/home/user/repo/.git'))
+        self.assertTrue(gitcfg.wildmatch('/a/**/b', '/a/b'))
+        self.assertTrue(gitcfg.wildmatch('/a/**/b', '/a/x/y/b'))
+        self.assertTrue(gitcfg.wildmatch('/a/[!x]/b', '/a/y/b'))
+        self.assertTrue(gitcfg.wildmatch('/A/*', '/a/b', icase=True))
+        self.assertFalse(gitcfg.wildmatch('/a/*', '/a/b/c'))
+        self.assertFalse(gitcfg.wildmatch('/a/?', '/a//'))
+        self.assertFalse(gitcfg.wildmatch('/a/[!x]', '/a//'))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -3,12 +3,16 @@ from __future__ import absolute_import, division, unicode_literals
 import os
 import unittest
 
+from cola import core
 from cola import gitcmds
 from cola import gitcfg
 
 from test import helper
 
 
+ZERO = '0' * 40
+
+
 class GitCmdsTestCase(helper.GitRepositoryTestCase):
     """Tests the cola.gitcmds module."""
     def setUp(self):
@@ -92,6 +96,155 @@ class GitCmdsTestCase(helper.GitRepositoryTestCase):
         os.unlink(gitcmds.merge_message_path())
         self.assertEqual(gitcmds.merge_message_path(), None)
 
+    def test_worktree_state_backends_agree(self):
+        """status_state() and diff_state() report the same worktree state"""
+        self.write_file('A', 'change')
+        self.write_file('C', 'C')
+        self.git('add', 'C')
+        self.write_file('D', 'D')
+        os.unlink('B')
+        self.git('mv', 'A', 'E')
+        status = gitcmds.status_state()
+        expect = gitcmds.diff_state()
+        self.assertEqual(status, expect)
+        self.assertEqual(status['staged'], ['A', 'C', 'E'])
+        self.assertEqual(status['modified'], ['B', 'E'])
+        self.assertEqual(status['untracked'], ['D'])
+        self.assertEqual(status['staged_deleted'], set(['A']))
+        self.assertEqual(status['unstaged_deleted'], set(['B']))
+
+    def test_worktree_state_filter_paths(self):
+        self.write_file('A', 'change')
+        self.write_file('B', 'change')
+        self.write_file('C', 'C')
+        state = gitcmds.status_state(paths=['B', 'C'])
+        self.assertEqual(state['modified'], ['B'])
+        self.assertEqual(state['untracked'], ['C'])
+        state = gitcmds.status_state(display_untracked=False)
+        self.assertEqual(state['untracked'], [])
+
+    def test_diff_stream(self):
+        """DiffStream reads a diff in bounded batches"""
+        self.write_file('A', ''.join('line %d\n' % i for i in range(20)))
+        expect = gitcmds.diff_helper(filename='A', cached=False)
+
+        stream = gitcmds.diff_stream(filename='A', cached=False)
+        batches = [stream.read(max_lines=10)]
+        self.assertFalse(stream.exhausted)
+        self.assertEqual(len(batches[0].splitlines()), 10)
+        while not stream.exhausted:
+            batches.append(stream.read(max_size=64))
+        self.assertEqual('\n'.join(batches), expect)
+        self.assertEqual(stream.lines_read, len(expect.splitlines()))
+        self.assertEqual(stream.read(), '')
+
+    def test_diff_stream_close(self):
+        self.write_file('A', 'change')
+        stream = gitcmds.diff_stream(filename='A', cached=False)
+        stream.close()
+        self.assertTrue(stream.exhausted)
+        self.assertEqual(stream.read(), '')
+
+    def test_diff_stream_kill(self):
+        self.write_file('A', 'change')
+        stream = gitcmds.diff_stream(filename='A', cached=False)
+        stream.kill()
+        stream.read()
+        self.assertTrue(stream.exhausted)
+        self.assertNotEqual(stream.proc.returncode, None)
+
+    def test_diff_cache(self):
+        cache = gitcmds.DiffCache(10)
+        self.write_file('A', 'change')
+        key = cache.key('A')
+        self.assertEqual(cache.get(key), None)
+        cache.put(key, 'diff')
+        self.assertEqual(cache.get(key), 'diff')
+        self.assertEqual(cache.key('A'), key)
+        self.assertNotEqual(cache.key('A', cached=True), key)
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+        # Changes to the worktree file or the index change the key
+        self.write_file('A', 'changed again')
+        self.assertNotEqual(cache.key('A'), key)
+        key = cache.key('A', cached=True)
+        self.git('add', 'A')
+        self.assertNotEqual(cache.key('A', cached=True), key)
+
+    def test_diff_cache_budget(self):
+        cache = gitcmds.DiffCache(10)
+        cache.put('a', '12345')
+        cache.put('b', '12345')
+        cache.get('a')
+        cache.put('c', '123')
+        # "b" was the least recently used entry
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), '12345')
+        self.assertEqual(cache.size, 8)
+        cache.put('d', '12345678901')
+        self.assertEqual(cache.get('d'), None)
+
+    def test_diff_cache_invalidate(self):
+        cache = gitcmds.DiffCache(100)
+        key_a = cache.key('A')
+        key_b = cache.key('B')
+        cache.put(key_a, 'a')
+        cache.put(key_b, 'b')
+        cache.invalidate(['A'])
+        self.assertEqual(cache.get(key_a), None)
+        self.assertEqual(cache.get(key_b), 'b')
+        cache.invalidate()
+        self.assertEqual(cache.stats()['entries'], 0)
+        self.assertEqual(cache.size, 0)
+
+    def test_parse_status_porcelain_v2(self):
+        records = [
+            '# branch.oid (initial)',
+            '# branch.upstream origin/master',
+            '1 M. N... 100644 100644 100644 %s %s staged' % (ZERO, ZERO),
+            '1 .D N... 100644 100644 000000 %s %s deleted' % (ZERO, ZERO),
+            '1 AM SC.. 000000 160000 160000 %s %s sub' % (ZERO, ZERO),
+            '2 R. N... 100644 100644 100644 %s %s R100 new name' % (
+                ZERO, ZERO),
+            'old name',
+            'u UU N... 100644 100644 100644 100644 %s %s %s both' % (
+                ZERO, ZERO, ZERO),
+            '? untracked file',
+            '! ignored',
+        ]
+        state, headers = gitcmds.parse_status_porcelain_v2(records)
+        self.assertEqual(headers['branch.oid'], '(initial)')
+        self.assertEqual(headers['branch.upstream'], 'origin/master')
+        self.assertEqual(state['staged'],
+                         ['staged', 'sub', 'new name', 'old name'])
+        self.assertEqual(state['modified'], ['deleted', 'sub'])
+        self.assertEqual(state['unmerged'], ['both'])
+        self.assertEqual(state['untracked'], ['untracked file'])
+        self.assertEqual(state['staged_deleted'], set(['old name']))
+        self.assertEqual(state['unstaged_deleted'], set(['deleted']))
+        self.assertEqual(state['submodules'], set(['sub']))
+
+    def test_listdir(self):
+        os.mkdir('dir')
+        self.touch('dir/a', 'dir/b', 'C')
+        self.git('add', 'dir', 'C')
+        self.git('commit', '-m', 'dir')
+        self.touch('dir/untracked')
+        self.assertEqual(gitcmds.ls_tree('./'),
+                         [('blob', 'A'), ('blob', 'B'),
+                          ('blob', 'C'), ('tree', 'dir')])
+        self.assertEqual(gitcmds.listdir('dir/'),
+                         ([], ['dir/a', 'dir/b', 'dir/untracked']))
+        self.assertEqual(gitcmds.ls_tree('dir/', ref='missing'), [])
+
+    def test_commit_body(self):
+        self.git('commit', '--allow-empty',
+                 '-m', 'subject', '-m', 'body line 1\nbody line 2')
+        self.assertEqual(gitcmds.commit_body('HEAD'),
+                         'body line 1\nbody line 2')
+        self.assertEqual(gitcmds.commit_body('HEAD~'), '')
+
     def test_all_refs(self):
         self.git('branch', 'a')
         self.git('branch', 'b')
@@ -122,6 +275,52 @@ class GitCmdsTestCase(helper.GitRepositoryTestCase):
                          ['origin/a', 'origin/b', 'origin/c', 'origin/master'])
         self.assertEqual(tags, ['f', 'e', 'd'])
 
+    def test_ref_cache(self):
+        self.git('branch', 'a')
+        self.git('tag', 'd')
+        cache = gitcmds.RefCache()
+        cache.racy_seconds = 0
+        self.assertTrue(cache.update())
+        self.assertEqual(cache.local_branches, ['a', 'master'])
+        self.assertEqual(cache.tags, ['d'])
+        self.assertEqual(cache.generation, 1)
+
+        # Nothing changed, so for-each-ref is not run
+        self.assertFalse(cache.update())
+        self.assertEqual(cache.loads, 1)
+        self.assertEqual(cache.avoided, 1)
+
+        self.git('branch', '-D', 'a')
+        self.git('branch', 'b')
+        self.git('tag', 'e')
+        self.assertTrue(cache.update())
+        self.assertEqual(cache.generation, 2)
+        self.assertEqual(cache.delta, {
+            'local_branches': (['b'], ['a']),
+            'tags': (['e'], []),
+        })
+        self.assertEqual(cache.local_branches, ['b', 'master'])
+        self.assertEqual(cache.tags, ['e', 'd'])
+
+    def test_ref_cache_reftable_key(self):
+        cache = gitcmds.RefCache()
+        key = cache.refs_key()
+        self.assertTrue(len(key) > 1)
+
+        # Reftable repositories only track reftable/tables.list
+        core.makedirs('.git/reftable')
+        self.assertEqual(cache.refs_key(), None)
+        self.write_file('.git/reftable/tables.list', 'one.ref\n')
+        key = cache.refs_key()
+        self.assertEqual(len(key), 1)
+        self.git('branch', 'unseen')
+        self.assertEqual(cache.refs_key(), key)
+
+        self.write_file('.git/reftable/tables.list.lock', 'two.ref\n')
+        os.rename('.git/reftable/tables.list.lock',
+                  '.git/reftable/tables.list')
+        self.assertNotEqual(cache.refs_key(), key)
+
 
 if __name__ == '__main__':
     unittest.main()
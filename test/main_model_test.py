@@ -212,5 +212,141 @@ class RemoteArgsTestCase(unittest.TestCase):
         self.assertFalse('rebase' in kwargs)
 
 
+class RefreshSchedulerTestCase(helper.GitRepositoryTestCase):
+    """Tests the coalescing of refresh requests."""
+
+    def setUp(self):
+        helper.GitRepositoryTestCase.setUp(self)
+        self.model = main.MainModel(cwd=core.getcwd())
+        self.scheduled = 0
+        self.refreshed = []
+        self.model.scheduler.schedule = self.schedule
+        self.model.add_observer(self.model.message_updated, self.updated)
+
+    def schedule(self):
+        self.scheduled += 1
+
+    def updated(self):
+        self.refreshed.append(list(self.model.modified))
+
+    def test_requests_are_merged(self):
+        self.write_file('A', 'change')
+        self.model.request_refresh(main.REFRESH_FILES)
+        self.model.request_refresh(main.REFRESH_REFS)
+        self.model.request_refresh(main.REFRESH_FILES)
+        self.assertEqual(self.scheduled, 3)
+        self.assertEqual(self.refreshed, [])
+
+        refreshed = self.model.scheduler.flush()
+        self.assertEqual(refreshed, main.REFRESH_FILES | main.REFRESH_REFS)
+        self.assertEqual(self.refreshed, [['A']])
+        self.assertEqual(self.model.local_branches, ['master'])
+        self.assertEqual(self.model.scheduler.flush(), 0)
+
+        stats = self.model.scheduler.stats()
+        self.assertEqual(stats['requested'], 3)
+        self.assertEqual(stats['performed'], 1)
+        self.assertEqual(stats['skipped'], 2)
+
+    def test_immediate_refresh_absorbs_pending_requests(self):
+        self.model.request_refresh(main.REFRESH_FILES)
+        self.model.update_status()
+        self.assertEqual(self.model.scheduler.flush(), 0)
+        self.assertEqual(len(self.refreshed), 1)
+        self.assertEqual(self.model.scheduler.skipped, 1)
+
+    def test_stale_refresh_is_dropped(self):
+        scheduler = self.model.scheduler
+        self.model.request_refresh(main.REFRESH_FILES)
+
+        def newer_request():
+            # Simulate a request arriving while the worktree is read
+            self.model.remove_observer(newer_request)
+            self.model.request_refresh(main.REFRESH_FILES)
+
+        self.model.add_observer(self.model.message_about_to_update,
+                                newer_request)
+        scheduler.flush()
+        self.assertEqual(self.refreshed, [])
+        self.assertEqual(scheduler.skipped, 1)
+
+        scheduler.flush()
+        self.assertEqual(len(self.refreshed), 1)
+        self.assertEqual(scheduler.performed, 1)
+
+    def test_stale_refresh_still_updates_refs(self):
+        scheduler = self.model.scheduler
+        self.model.request_refresh(main.REFRESH_FILES | main.REFRESH_REFS)
+
+        def newer_request():
+            self.model.remove_observer(newer_request)
+            self.model.request_refresh(main.REFRESH_FILES)
+
+        self.model.add_observer(self.model.message_about_to_update,
+                                newer_request)
+        self.git('branch', 'topic')
+        scheduler.flush()
+        self.assertEqual(self.model.local_branches, ['master', 'topic'])
+        self.assertEqual(len(self.refreshed), 1)
+        self.assertEqual(scheduler.flush(), main.REFRESH_FILES)
+
+    def test_path_refresh_merges_state(self):
+        self.write_file('A', 'change')
+        self.write_file('C', 'C')
+        self.model.update_status()
+        self.assertEqual(self.model.untracked, ['C'])
+
+        # Changes to paths that were not reported stay unnoticed
+        self.write_file('B', 'change')
+        self.write_file('D[1]', 'D')
+        self.write_file('D1', 'D')
+        self.git('checkout', 'A')
+        self.model.request_refresh_paths(['A', 'D[1]'])
+        self.model.request_refresh_paths(['B'])
+        self.assertEqual(self.model.scheduler.flush(), main.REFRESH_PATHS)
+
+        self.assertEqual(self.model.modified, ['B'])
+        self.assertEqual(self.model.untracked, ['C', 'D[1]'])
+
+    def test_file_refresh_absorbs_path_refresh(self):
+        self.write_file('C', 'C')
+        self.model.request_refresh_paths(['C'])
+        self.model.request_refresh(main.REFRESH_FILES)
+        self.assertEqual(self.model.scheduler.flush(), main.REFRESH_FILES)
+        self.assertEqual(self.model.untracked, ['C'])
+
+        self.model.request_refresh_paths(['C'])
+        self.model.update_file_status()
+        self.assertEqual(self.model.scheduler.flush(), 0)
+
+    def test_paths_refresh_absorbs_pending_paths(self):
+        self.write_file('A', 'change')
+        self.write_file('B', 'change')
+        self.model.request_refresh_paths(['A'])
+        self.model.update_paths_status(['B'])
+        self.assertEqual(self.model.modified, ['A', 'B'])
+        self.assertEqual(self.model.scheduler.flush(), 0)
+
+    def test_diff_parser_is_reused(self):
+        self.model.set_filename('A')
+        self.model.set_diff_text('@@ -1 +1 @@\n-A\n+B')
+        parser = self.model.diff_parser()
+        self.assertTrue(self.model.diff_parser() is parser)
+        self.assertEqual(len(parser.hunks), 1)
+
+        self.model.set_diff_text('@@ -1 +1 @@\n-A\n+C')
+        self.assertFalse(self.model.diff_parser() is parser)
+
+
+class MergeSortedPathsTestCase(unittest.TestCase):
+
+    def test_merge(self):
+        items = ['a', 'b', 'c/d', 'e']
+        result = main.merge_sorted_paths(items, ['b', 'c', 'f'],
+                                         ['c', 'f', 'g'])
+        self.assertEqual(result, ['a', 'c', 'c/d', 'e', 'f'])
+        self.assertEqual(items, ['a', 'b', 'c/d', 'e'])
+
+
 if __name__ == '__main__':
     unittest.main()
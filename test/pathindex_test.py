@@ -0,0 +1,77 @@
+from __future__ import absolute_import, division, unicode_literals
+
+import unittest
+
+from cola import core
+from cola import git
+from cola.models import pathindex
+
+from test import helper
+
+
+class PathIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.index = pathindex.PathIndex([
+            'README.md',
+            'cola/diffparse.py',
+            'cola/widgets/diff.py',
+            'share/doc/git-cola/git-cola.rst',
+            'test/diffparse_test.py',
+        ])
+
+    def test_dirs(self):
+        self.assertEqual(self.index.dirs,
+                         set(['cola', 'cola/widgets', 'share', 'share/doc',
+                              'share/doc/git-cola', 'test']))
+
+    def test_substring_matches_rank_first(self):
+        self.assertEqual(self.index.matches('diff', False), [
+            'cola/diffparse.py',
+            'cola/widgets/diff.py',
+            'test/diffparse_test.py',
+        ])
+
+    def test_fuzzy_matches(self):
+        self.assertEqual(self.index.matches('wdiff', False),
+                         ['cola/widgets/diff.py'])
+        self.assertEqual(self.index.matches('rdme', False), ['README.md'])
+        self.assertEqual(self.index.matches('rdme', True), [])
+
+    def test_incremental_matches(self):
+        index = self.index
+        for text in ('d', 'di', 'dif', 'diffp', 'di', 'cola/', 'cola/w'):
+            fresh = pathindex.PathIndex(index.files)
+            self.assertEqual(index.matches(text, False),
+                             fresh.matches(text, False))
+
+    def test_empty_text_matches_everything(self):
+        self.assertEqual(len(self.index.matches('', False)), 11)
+        self.assertEqual(self.index.matches('', True)[0], 'README.md')
+        self.assertEqual(self.index.matches('', False)[0], 'cola')
+
+    def test_find_paths(self):
+        self.assertEqual(self.index.find_paths(['*widgets*']),
+                         ['cola/widgets/diff.py'])
+        self.assertEqual(len(self.index.find_paths([])), 5)
+
+
+class TrackedPathsTestCase(helper.GitRepositoryTestCase):
+
+    def test_rebuilt_once_per_index_change(self):
+        tracked = pathindex.TrackedPaths(git=git.current())
+        self.assertEqual(tracked.current().find_paths([]), ['A', 'B'])
+        tracked.current()
+        self.assertEqual(tracked.builds, 1)
+
+        core.makedirs('sub')
+        self.write_file('sub/C', 'C')
+        self.git('add', 'sub/C')
+        self.assertEqual(tracked.current().find_paths([]),
+                         ['A', 'B', 'sub/C'])
+        self.assertTrue('sub' in tracked.current().dirs)
+        self.assertEqual(tracked.builds, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+from __future__ import absolute_import, division, unicode_literals
+
+import unittest
+
+from cola import core
+from cola import git
+from cola.models import trigrams
+
+from test import helper
+
+
+class LiteralsTestCase(unittest.TestCase):
+
+    def test_regexp_literals(self):
+        literals = trigrams.regexp_literals
+        self.assertEqual(literals('hello.*world'), ['hello', 'world'])
+        self.assertEqual(literals('colou?rful', '--extended-regexp'),
+                         ['colo', 'rful'])
+        self.assertEqual(literals('ab[cd]efgh'), ['ab', 'efgh'])
+        self.assertEqual(literals('[]abc]defg'), ['defg'])
+        self.assertEqual(literals('[[:space:]]foo', '--extended-regexp'),
+                         ['foo'])
+        self.assertEqual(literals('[^[:digit:][=e=]x]abc'), ['abc'])
+        self.assertEqual(literals('[[.-.]]abc'), ['abc'])
+        self.assertEqual(literals('x\\{2\\}yzw'), ['yzw'])
+        self.assertEqual(literals('a.b', '--fixed-strings'), ['a.b'])
+
+    def test_regexp_alternations_are_not_reduced(self):
+        literals = trigrams.regexp_literals
+        self.assertEqual(literals('foo|bar', '--extended-regexp'), None)
+        self.assertEqual(literals('(foo)?bar', '--extended-regexp'), None)
+        self.assertEqual(literals('foo\\|bar'), None)
+
+    def test_glob_literals(self):
+        self.assertEqual(trigrams.glob_literals('*cola/wid*.py*'),
+                         ['cola/wid', '.py'])
+        self.assertEqual(trigrams.glob_literals('*[abc]xyz*'), ['xyz'])
+        self.assertEqual(trigrams.glob_literals('abc[!]d]xyz'),
+                         ['abc', 'xyz'])
+        self.assertEqual(trigrams.glob_literals('abc[[:digit:]]xyz'),
+                         ['abc', 'xyz'])
+
+
+class TrigramIndexTestCase(helper.GitRepositoryTestCase):
+
+    def setUp(self):
+        helper.GitRepositoryTestCase.setUp(self)
+        self.write_file('A', 'the quick brown fox\n')
+        self.write_file('B', 'jumps over the lazy dog\n')
+        core.makedirs('sub')
+        self.write_file('sub/C', 'quick thinking\n')
+        self.git('add', 'A', 'B', 'sub/C')
+        self.git('commit', '-m', 'contents')
+        self.index = trigrams.TrigramIndex(git=git.current())
+
+    def test_grep_candidates(self):
+        candidates = self.index.grep_candidates
+        self.assertEqual(candidates('quick'), ['A', 'sub/C'])
+        self.assertEqual(candidates('lazy.*dog'), ['B'])
+        self.assertEqual(candidates('missing'), [])
+        self.assertEqual(candidates('qu'), None)
+        self.assertEqual(candidates('[[:space:]]brown', '--extended-regexp'),
+                         ['A'])
+
+    def test_worktree_changes_are_candidates(self):
+        self.index.update()
+        self.write_file('B', 'quick\n')
+        self.assertEqual(self.index.grep_candidates('quick'),
+                         ['A', 'B', 'sub/C'])
+
+    def test_converted_files_are_candidates(self):
+        self.write_file('D', 'nothing\n')
+        self.git('add', 'D')
+        self.assertEqual(self.index.grep_candidates('quick'), ['A', 'sub/C'])
+
+        # The worktree contents of "ident" files differ from the blob
+        self.write_file('.gitattributes', 'D ident\n')
+        self.git('add', '.gitattributes')
+        self.assertEqual(self.index.grep_candidates('quick'),
+                         ['A', 'D', 'sub/C'])
+
+    def test_incremental_update(self):
+        self.index.update()
+        self.write_file('B', 'quick\n')
+        self.git('add', 'B')
+        self.git('rm', '-q', 'sub/C')
+        self.assertEqual(self.index.grep_candidates('quick'), ['A', 'B'])
+        self.assertEqual(len(self.index), 2)
+
+        # The index is reloaded from .git/cola/
+        index = trigrams.TrigramIndex(git=git.current())
+        self.assertEqual(index.grep_candidates('quick'), ['A', 'B'])
+        self.assertEqual(index.paths, self.index.paths)
+
+    def test_find_paths(self):
+        self.assertEqual(self.index.find_paths(['*sub*']), ['sub/C'])
+        self.assertEqual(self.index.find_paths(['*A*', '*B*']), ['A', 'B'])
+        self.assertEqual(self.index.find_paths([]), ['A', 'B', 'sub/C'])
+
+    def test_find_paths_with_brackets(self):
+        self.touch('ax', 'abcx')
+        self.git('add', 'ax', 'abcx')
+        self.assertEqual(self.index.find_paths(['*[abc]x*']), ['abcx', 'ax'])
+        self.assertEqual(self.index.find_paths(['*[!a]cx']), ['abcx'])
+
+
+if __name__ == '__main__':
+    unittest.main()